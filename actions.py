@@ -1,6 +1,4 @@
-LEFT_EDGE_BLOCKS = [(1, 0), (2, 0), (3, 0), (4, 0)]
-RIGHT_EDGE_BLOCKS = [(1, 1), (2, 2), (3, 3), (4, 4)]
-BOTTOM_BLOCKS = [(5, 1), (5, 2), (5, 3), (5, 4)]
+from geometry import ACTION_NUM_DIFFS, MOVE_ACTION_NUMBERS, VALID_ACTION_NUMBERS
 
 ACTIONS_TO_NUMBERS = {
     'up': 2,
@@ -37,21 +35,6 @@ ACTIONS = [
     'down-left-fire'
 ]
 
-ACTION_NUM_DIFFS_WITH_NOOP = {
-    0: (0, 0),
-    2: (-1, 0),
-    3: (1, 1),
-    4: (-1, -1),
-    5: (1, 0)
-}
-
-ACTION_NUM_DIFFS = {
-    2: (-1, 0),
-    3: (1, 1),
-    4: (-1, -1),
-    5: (1, 0)
-}
-
 INVERSE_ACTIONS = {
     2: 5,
     3: 4,
@@ -65,7 +48,7 @@ def get_valid_action_numbers_from_state(s, state_repr='simple'):
     Gets the valid actions from the given state
 
     """
-    if state_repr is 'verbose':
+    if state_repr == 'verbose':
         row, col = s[0]
         return get_valid_action_numbers(row, col)
     else:
@@ -89,40 +72,14 @@ def get_valid_action_numbers(row, col):
     """
     Gets the valid action numbers from the row/col position.
     """
-    if (row, col) == (0, 0):
-        return [3, 5]
-    elif (row, col) == (5, 0):
-        return [2]
-    elif (row, col) == (5, 5):
-        return [4]
-    elif (row, col) in BOTTOM_BLOCKS:
-        return [2, 4]
-    elif (row, col) in LEFT_EDGE_BLOCKS:
-        return [2, 3, 5]
-    elif (row, col) in RIGHT_EDGE_BLOCKS:
-        return [3, 4, 5]
-    else:
-        return [2, 3, 4, 5]
+    return VALID_ACTION_NUMBERS.get((row, col), MOVE_ACTION_NUMBERS)
 
 
 def get_valid_actions(row, col):
     """
     Gets the valid actions from the row/col position.
     """
-    if (row, col) == (0, 0):
-        return ['right', 'down']
-    elif (row, col) == (5, 0):
-        return ['up']
-    elif (row, col) == (5, 5):
-        return ['left']
-    elif (row, col) in BOTTOM_BLOCKS:
-        return ['left', 'up']
-    elif (row, col) in LEFT_EDGE_BLOCKS:
-        return ['up', 'right', 'down']
-    elif (row, col) in RIGHT_EDGE_BLOCKS:
-        return ['right', 'left', 'down']
-    else:
-        return ['up', 'right', 'left', 'down']
+    return [ACTIONS[a] for a in get_valid_action_numbers(row, col)]
 
 
 def action_number_to_name(a):
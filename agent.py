@@ -2,9 +2,28 @@ import logging
 import random
 from abc import ABCMeta, abstractmethod
 
-from learner import QLearner
+from learner import create_learner, HASHED_MEMORY_SIZE
 from world import QbertWorld
 
+LEARNER_NAMES = {
+    'block': ('block',),
+    'enemy': ('enemy',),
+    'friendly': ('friendly',),
+    'subsumption': ('block', 'friendly', 'enemy'),
+    'combined_verbose': ('combined_verbose',)
+}  # Names of the learners of each agent type, as returned by get_learners
+
+
+def get_learner_filenames(learners, filename):
+    """
+    Get learners by the filename of their learning data, as in Agent.save and Agent.load.
+
+    :param learners: a dict from learner name to learner
+    """
+    if len(learners) == 1:
+        return {filename: learner for learner in learners.values()}
+    return {'{}_{}'.format(filename, name): learner for name, learner in learners.items()}
+
 
 class Agent:
     __metaclass__ = ABCMeta
@@ -16,6 +35,45 @@ class Agent:
         """
         raise NotImplementedError
 
+    def get_learner_filenames(self, filename):
+        """
+        Get the learners of the agent by the filename of their learning data, as in save and load.
+        """
+        return get_learner_filenames(self.get_learners(), filename)
+
+    def save_changes(self, filename, episode):
+        """
+        Append the learning data changed since the last call to the delta logs of the learners.
+
+        :return: the number of appended entries
+        """
+        return sum(learner.save_changes(learner_filename, episode)
+                   for learner_filename, learner in self.get_learner_filenames(filename).items())
+
+    def compact(self, filename, episode):
+        """
+        Save the learning data, replacing the delta logs of the learners.
+        """
+        for learner_filename, learner in self.get_learner_filenames(filename).items():
+            learner.compact(learner_filename, episode)
+
+    def load_changes(self, filename):
+        """
+        Apply the delta logs of the learners on top of the loaded learning data.
+
+        :return: the number of episodes played at the last delta
+        """
+        return min(learner.load_changes(learner_filename)
+                   for learner_filename, learner in self.get_learner_filenames(filename).items())
+
+    def close(self):
+        """
+        Stop the background threads of the agent.
+        """
+        for learner in self.get_learners().values():
+            if learner.dyna is not None:
+                learner.dyna.stop()
+
 
 class QbertAgent(Agent):
     """
@@ -24,36 +82,90 @@ class QbertAgent(Agent):
     def __init__(self, agent_type='subsumption', random_seed=123, frame_skip=4, repeat_action_probability=0,
                  sound=True, display_screen=True, alpha=0.1, gamma=0.95,
                  epsilon=0.2, unexplored_threshold=1, unexplored_reward=100, exploration='combined',
-                 distance_metric=None, combined_reward=True, state_representation='simple'):
-        if agent_type is 'block':
+                 distance_metric=None, combined_reward=True, state_representation='simple', state_encoding='tuple',
+                 perception='rgb', q_store='dict', q_store_capacity=None, eviction='lru', q_store_spill=False,
+                 checkpoint_format='pickle',
+                 reset_mode='emulator', planning_depth=0, planning_budget=0.05, replay_size=0, replay_batch=0,
+                 sweeping_backups=0, dyna_model_size=0, nearest_radius=0, learner_type='tabular',
+                 block_learner_type=None, enemy_learner_type=None, friendly_learner_type=None,
+                 hashed_memory_size=HASHED_MEMORY_SIZE, ale=None, trace_directory=None, emulator_factory=None):
+        world_options = {
+            'state_encoding': state_encoding,
+            'perception': perception,
+            'reset_mode': reset_mode,
+            'ale': ale,
+            'trace_directory': trace_directory,
+            'emulator_factory': emulator_factory
+        }
+        learner_options = {
+            'learner_type': learner_type,
+            'learner_types': {'block': block_learner_type, 'enemy': enemy_learner_type,
+                              'friendly': friendly_learner_type},
+            'hashed_memory_size': hashed_memory_size,
+            'q_store': q_store,
+            'q_store_capacity': q_store_capacity,
+            'eviction': eviction,
+            'q_store_spill': q_store_spill,
+            'checkpoint_format': checkpoint_format,
+            'replay_size': replay_size,
+            'replay_batch': replay_batch,
+            'sweeping_backups': sweeping_backups,
+            'dyna_model_size': dyna_model_size,
+            'nearest_radius': nearest_radius
+        }
+        planner_options = None
+        if planning_depth > 0:
+            planner_options = {
+                'depth': planning_depth,
+                'time_budget': planning_budget
+            }
+        if agent_type == 'block':
             self.agent = QbertBlockAgent(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
                                          alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                         exploration, distance_metric, state_representation)
-        elif agent_type is 'enemy':
+                                         exploration, distance_metric, state_representation,
+                                         world_options=world_options,
+                                         learner_options=learner_options)
+        elif agent_type == 'enemy':
             self.agent = QbertEnemyAgent(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
                                          alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                         exploration, distance_metric, state_representation)
-        elif agent_type is 'friendly':
+                                         exploration, distance_metric, state_representation,
+                                         world_options=world_options,
+                                         learner_options=learner_options)
+        elif agent_type == 'friendly':
             self.agent = QbertFriendlyAgent(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
                                             alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                            exploration, distance_metric, state_representation)
-        elif agent_type is 'subsumption':
+                                            exploration, distance_metric, state_representation,
+                                            world_options=world_options,
+                                            learner_options=learner_options)
+        elif agent_type == 'subsumption':
             self.agent = QbertSubsumptionAgent(random_seed, frame_skip, repeat_action_probability, sound,
                                                display_screen, alpha, gamma, epsilon, unexplored_threshold,
                                                unexplored_reward, exploration, distance_metric, combined_reward,
-                                               state_representation)
-        elif agent_type is 'combined_verbose':
+                                               state_representation, world_options=world_options,
+                                               learner_options=learner_options, planner_options=planner_options)
+        elif agent_type == 'combined_verbose':
             self.agent = QbertCombinedVerboseAgent(random_seed, frame_skip, repeat_action_probability, sound,
                                                    display_screen, alpha, gamma, epsilon, unexplored_threshold,
-                                                   unexplored_reward, exploration, distance_metric)
+                                                   unexplored_reward, exploration, distance_metric,
+                                                   world_options=world_options,
+                                                   learner_options=learner_options)
         self.world = self.agent.world
 
     def action(self):
         return self.agent.action()
 
+    def get_learners(self):
+        """
+        Get the learners of the agent, by name.
+        """
+        return self.agent.get_learners()
+
     def q_size(self):
         return self.agent.q_size()
 
+    def close(self):
+        self.agent.close()
+
     def save(self, filename):
         self.agent.save(filename)
 
@@ -67,15 +179,16 @@ class QbertBlockAgent(Agent):
     """
     def __init__(self, random_seed, frame_skip, repeat_action_probability, sound, display_screen, alpha,
                  gamma, epsilon, unexplored_threshold, unexplored_reward, exploration, distance_metric,
-                 state_representation):
-        if state_representation is 'simple':
+                 state_representation, world_options=None, learner_options=None):
+        if state_representation == 'simple':
             state_repr = 'along_direction'
         else:
             state_repr = 'verbose'
         self.world = QbertWorld(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
-                                block_state_repr=state_repr)
-        self.block_learner = QLearner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                      exploration, distance_metric, state_repr)
+                                block_state_repr=state_repr, **(world_options or {}))
+        self.block_learner = create_learner(self.world, alpha, gamma, epsilon, unexplored_threshold,
+                                            unexplored_reward, exploration, distance_metric, state_repr,
+                                            role='block', **(learner_options or {}))
 
     def action(self):
         s = self.world.to_state_blocks()
@@ -85,8 +198,11 @@ class QbertBlockAgent(Agent):
         self.block_learner.update(s, a, s_next, block_score)
         return block_score + friendly_score + enemy_score
 
+    def get_learners(self):
+        return {'block': self.block_learner}
+
     def q_size(self):
-        return len(self.block_learner.Q)
+        return self.block_learner.q_size()
 
     def save(self, filename):
         self.block_learner.save(filename)
@@ -101,15 +217,16 @@ class QbertEnemyAgent(Agent):
     """
     def __init__(self, random_seed, frame_skip, repeat_action_probability, sound, display_screen, alpha,
                  gamma, epsilon, unexplored_threshold, unexplored_reward, exploration, distance_metric,
-                 state_representation):
-        if state_representation is 'simple':
+                 state_representation, world_options=None, learner_options=None):
+        if state_representation == 'simple':
             state_repr = 'adjacent_conservative'
         else:
             state_repr = 'verbose'
         self.world = QbertWorld(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
-                                enemy_state_repr=state_repr)
-        self.enemy_learner = QLearner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                      exploration, distance_metric, state_repr)
+                                enemy_state_repr=state_repr, **(world_options or {}))
+        self.enemy_learner = create_learner(self.world, alpha, gamma, epsilon, unexplored_threshold,
+                                            unexplored_reward, exploration, distance_metric, state_repr,
+                                            role='enemy', **(learner_options or {}))
 
     def action(self):
         s = self.world.to_state_enemies()
@@ -119,8 +236,11 @@ class QbertEnemyAgent(Agent):
         self.enemy_learner.update(s, a, s_next, enemy_score + enemy_penalty)
         return block_score + friendly_score + enemy_score
 
+    def get_learners(self):
+        return {'enemy': self.enemy_learner}
+
     def q_size(self):
-        return len(self.enemy_learner.Q)
+        return self.enemy_learner.q_size()
 
     def save(self, filename):
         self.enemy_learner.save(filename)
@@ -135,15 +255,16 @@ class QbertFriendlyAgent(Agent):
     """
     def __init__(self, random_seed, frame_skip, repeat_action_probability, sound, display_screen, alpha,
                  gamma, epsilon, unexplored_threshold, unexplored_reward, exploration, distance_metric,
-                 state_representation):
-        if state_representation is 'simple':
+                 state_representation, world_options=None, learner_options=None):
+        if state_representation == 'simple':
             state_repr = 'simple'
         else:
             state_repr = 'verbose'
         self.world = QbertWorld(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
-                                friendly_state_repr=state_repr)
-        self.friendly_learner = QLearner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                         exploration, distance_metric, state_repr)
+                                friendly_state_repr=state_repr, **(world_options or {}))
+        self.friendly_learner = create_learner(self.world, alpha, gamma, epsilon, unexplored_threshold,
+                                               unexplored_reward, exploration, distance_metric, state_repr,
+                                               role='friendly', **(learner_options or {}))
 
     def action(self):
         s = self.world.to_state_friendlies()
@@ -153,8 +274,11 @@ class QbertFriendlyAgent(Agent):
         self.friendly_learner.update(s, a, s_next, friendly_score)
         return block_score + friendly_score + enemy_score
 
+    def get_learners(self):
+        return {'friendly': self.friendly_learner}
+
     def q_size(self):
-        return len(self.friendly_learner.Q)
+        return self.friendly_learner.q_size()
 
     def save(self, filename):
         self.friendly_learner.save(filename)
@@ -168,11 +292,13 @@ class QbertCombinedVerboseAgent(Agent):
     Obert agent which uses a verbose state for enemies, blocks and friendlies.
     """
     def __init__(self, random_seed, frame_skip, repeat_action_probability, sound, display_screen, alpha,
-                 gamma, epsilon, unexplored_threshold, unexplored_reward, exploration, distance_metric):
+                 gamma, epsilon, unexplored_threshold, unexplored_reward, exploration, distance_metric,
+                 world_options=None, learner_options=None):
         state_repr = 'verbose'
-        self.world = QbertWorld(random_seed, frame_skip, repeat_action_probability, sound, display_screen)
-        self.learner = QLearner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                exploration, distance_metric, state_repr)
+        self.world = QbertWorld(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
+                                **(world_options or {}))
+        self.learner = create_learner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
+                                      exploration, distance_metric, state_repr, **(learner_options or {}))
 
     def action(self):
         s = self.world.to_state_combined_verbose()
@@ -182,8 +308,11 @@ class QbertCombinedVerboseAgent(Agent):
         self.learner.update(s, a, s_next, block_score + friendly_score + enemy_score + enemy_penalty)
         return block_score + friendly_score + enemy_score
 
+    def get_learners(self):
+        return {'combined_verbose': self.learner}
+
     def q_size(self):
-        return len(self.learner.Q)
+        return self.learner.q_size()
 
     def save(self, filename):
         self.learner.save(filename)
@@ -199,8 +328,9 @@ class QbertSubsumptionAgent(Agent):
     """
     def __init__(self, random_seed, frame_skip, repeat_action_probability, sound, display_screen, alpha,
                  gamma, epsilon, unexplored_threshold, unexplored_reward, exploration, distance_metric,
-                 combined_reward, state_representation):
-        if state_representation is 'simple':
+                 combined_reward, state_representation, world_options=None, learner_options=None,
+                 planner_options=None):
+        if state_representation == 'simple':
             block_state_repr = 'adjacent'
             enemy_state_repr = 'adjacent_dangerous'
             friendly_state_repr = 'simple'
@@ -211,16 +341,26 @@ class QbertSubsumptionAgent(Agent):
         self.world = QbertWorld(random_seed, frame_skip, repeat_action_probability, sound, display_screen,
                                 block_state_repr=block_state_repr,
                                 enemy_state_repr=enemy_state_repr,
-                                friendly_state_repr=friendly_state_repr)
-        self.block_learner = QLearner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                      exploration, distance_metric, state_repr=block_state_repr, tag='blocks')
-        self.friendly_learner = QLearner(self.world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward,
-                                         exploration, distance_metric, state_repr=friendly_state_repr,
-                                         tag='friendlies')
+                                friendly_state_repr=friendly_state_repr,
+                                **(world_options or {}))
+        self.block_learner = create_learner(self.world, alpha, gamma, epsilon, unexplored_threshold,
+                                            unexplored_reward, exploration, distance_metric,
+                                            state_repr=block_state_repr, role='block', tag='blocks',
+                                            **(learner_options or {}))
+        self.friendly_learner = create_learner(self.world, alpha, gamma, epsilon, unexplored_threshold,
+                                               unexplored_reward, exploration, distance_metric,
+                                               state_repr=friendly_state_repr, role='friendly', tag='friendlies',
+                                               **(learner_options or {}))
         enemy_epsilon = 0
-        self.enemy_learner = QLearner(self.world, alpha, gamma, enemy_epsilon, unexplored_threshold, unexplored_reward,
-                                      exploration, distance_metric, state_repr=enemy_state_repr, tag='enemies')
+        self.enemy_learner = create_learner(self.world, alpha, gamma, enemy_epsilon, unexplored_threshold,
+                                            unexplored_reward, exploration, distance_metric,
+                                            state_repr=enemy_state_repr, role='enemy', tag='enemies',
+                                            **(learner_options or {}))
         self.combined_reward = combined_reward
+        self.planner = None
+        if planner_options is not None:
+            from planner import LookaheadPlanner
+            self.planner = LookaheadPlanner(self.world, **planner_options)
 
     def action(self):
         enemy_present = self.world.is_enemy_nearby()
@@ -233,6 +373,8 @@ class QbertSubsumptionAgent(Agent):
             logging.debug('Enemy present!')
             s_enemies = self.world.to_state_enemies()
             a_enemies = self.enemy_learner.get_best_actions(s_enemies)
+            if self.planner is not None:
+                a_enemies = self.planner.filter_actions(a_enemies)
         if friendly_present:
             logging.debug('Friendly present!')
             s_friendlies = self.world.to_state_friendlies()
@@ -264,10 +406,22 @@ class QbertSubsumptionAgent(Agent):
         self.block_learner.update(s, chosen_action, s_next, combined_score)
         return block_score + friendly_score + enemy_score
 
+    def get_learners(self):
+        return {
+            'block': self.block_learner,
+            'friendly': self.friendly_learner,
+            'enemy': self.enemy_learner
+        }
+
     def q_size(self):
-        return len(self.block_learner.Q) + \
-               len(self.friendly_learner.Q) + \
-               len(self.enemy_learner.Q)
+        return self.block_learner.q_size() + \
+               self.friendly_learner.q_size() + \
+               self.enemy_learner.q_size()
+
+    def close(self):
+        if self.planner is not None:
+            self.planner.close()
+        Agent.close(self)
 
     def save(self, filename):
         self.block_learner.save('{}_{}'.format(filename, 'block'))
@@ -0,0 +1,165 @@
+import argparse
+import logging
+
+import numpy as np
+
+from actions import get_valid_action_numbers_from_state
+from agent import QbertAgent
+from game_trace import ReplayALE
+from q_store import StateInterner, NUM_ACTION_COLUMNS
+
+
+class TransitionLog:
+    """
+    Transitions (s, a, reward, s_next) of a learner, with interned states.
+    """
+    def __init__(self):
+        self.interner = StateInterner()
+        self.state_ids = []
+        self.actions = []
+        self.rewards = []
+        self.next_state_ids = []
+
+    def add(self, s, a, s_next, reward):
+        self.state_ids.append(self.interner.intern(s))
+        self.actions.append(a)
+        self.rewards.append(reward)
+        self.next_state_ids.append(self.interner.intern(s_next))
+
+    def __len__(self):
+        return len(self.actions)
+
+
+def collect_transitions(agent, trace_directory, logs=None):
+    """
+    Replay a trace with the agent, which takes the recorded actions and logs the transitions of its learners instead
+    of learning from them. The states and rewards are those of the agent, so that a trace recorded with any agent can
+    be used to learn with another state representation.
+
+    :param logs: the transition logs of the learners by name, to add the transitions to
+    :return: the transition logs of the learners by name
+    """
+    world = agent.world
+    world.ale = world.transitions.ale = ale = ReplayALE(trace_directory)
+    logs = logs if logs is not None else {}
+    for name, learner in agent.get_learners().items():
+        log = logs.setdefault(name, TransitionLog())
+        learner.select_best_actions = lambda s: [ale.get_decision_action()]
+        learner.update = log.add
+    num_episodes = 0
+    while not ale.exhausted:
+        world.reset()
+        if ale.get_decision_action() is None:  # End of the trace
+            break
+        while not ale.game_over():
+            if ale.get_decision_action() is None:
+                logging.warning('Trace {} diverged at event {}, skipping to the next game'.format(trace_directory,
+                                                                                                ale.position))
+                break
+            agent.action()
+        world.reset_game()
+        num_episodes += 1
+    logging.info('Replayed {} episodes of {}'.format(num_episodes, trace_directory))
+    return logs
+
+
+def fit_q(log, gamma, state_repr, initial_q=None, num_iterations=100, tolerance=1e-6):
+    """
+    Fitted Q-iteration over logged transitions: every iteration sets the Q value of every logged (state, action) pair
+    to the mean of its backed up targets, with vectorized scatter operations over the interned state ids.
+
+    :param initial_q: the initial Q values, with a row per interned state and a column per action number
+    :return: the Q values and visit counts, with a row per interned state and a column per action number
+    """
+    num_states = len(log.interner)
+    state_ids = np.array(log.state_ids, dtype=np.int64)
+    actions = np.array(log.actions, dtype=np.int64)
+    rewards = np.array(log.rewards, dtype=np.float64)
+    next_state_ids = np.array(log.next_state_ids, dtype=np.int64)
+    valid = np.zeros((num_states, NUM_ACTION_COLUMNS), dtype=bool)
+    for state_id, s in enumerate(log.interner.states):
+        valid[state_id, get_valid_action_numbers_from_state(s, state_repr)] = True
+    has_valid_actions = valid.any(axis=1)
+
+    pair_ids = state_ids * NUM_ACTION_COLUMNS + actions
+    n = np.bincount(pair_ids, minlength=num_states * NUM_ACTION_COLUMNS)
+    visited = n > 0
+    q = np.zeros(num_states * NUM_ACTION_COLUMNS) if initial_q is None else initial_q.ravel().copy()
+    for iteration in range(num_iterations):
+        v = np.where(valid, q.reshape(num_states, NUM_ACTION_COLUMNS), -np.inf).max(axis=1)
+        v[~has_valid_actions] = 0
+        targets = rewards + gamma * v[next_state_ids]
+        new_q = np.bincount(pair_ids, weights=targets, minlength=len(q))
+        new_q[visited] /= n[visited]
+        new_q[~visited] = q[~visited]
+        change = np.abs(new_q - q).max() if len(q) > 0 else 0
+        q = new_q
+        if change < tolerance:
+            logging.info('Converged after {} iterations'.format(iteration + 1))
+            break
+    return q.reshape(num_states, NUM_ACTION_COLUMNS), n.reshape(num_states, NUM_ACTION_COLUMNS)
+
+
+def train(agent, trace_directories, num_iterations=100):
+    """
+    Fit the Q values of the learners of the agent to the transitions of the given traces, on top of their current
+    Q values, and add the logged visits to their visit counts.
+    """
+    learners = agent.get_learners()
+    original_updates = {name: learner.update for name, learner in learners.items()}
+    original_selections = {name: learner.select_best_actions for name, learner in learners.items()}
+    logs = {}
+    for trace_directory in trace_directories:
+        collect_transitions(agent, trace_directory, logs)
+    for name, learner in learners.items():
+        learner.update = original_updates[name]
+        learner.select_best_actions = original_selections[name]
+        log = logs[name]
+        logging.info('Fitting {} learner to {} transitions of {} states'.format(name, len(log), len(log.interner)))
+        if len(log) == 0:
+            continue
+        store = learner.store
+        states = log.interner.states
+        initial_q = np.array([[store.get_q(s, a) for a in range(NUM_ACTION_COLUMNS)] for s in states])
+        q, n = fit_q(log, learner.gamma, learner.state_repr, initial_q, num_iterations)
+        for state_id, a in zip(*np.nonzero(n)):
+            s = states[state_id]
+            store.set_q(s, a, float(q[state_id, a]))
+            store.set_n(s, a, store.get_n(s, a) + int(n[state_id, a]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the Q values of an agent to recorded traces, without emulator.')
+    parser.add_argument('trace_directories', nargs='+',
+                        help='The directories of the traces recorded with --trace_directory.')
+    parser.add_argument('-f', '--save_learning_filename', required=True,
+                        help='The file to save the learning data to.')
+    parser.add_argument('-o', '--load_learning_filename', default=None,
+                        help='The file to load initial learning data from.')
+    parser.add_argument('-a', '--agent_type', default='subsumption',
+                        choices=['block', 'enemy', 'friendly', 'subsumption', 'combined_verbose'],
+                        help='The agent type to use.')
+    parser.add_argument('-s', '--state_representation', default='simple', choices=['simple', 'verbose'],
+                        help='The state representation to use.')
+    parser.add_argument('-b', '--state_encoding', default='tuple', choices=['tuple', 'bitboard'],
+                        help='The encoding of verbose states: nested tuples or integer bitboards.')
+    parser.add_argument('-q', '--q_store', default='dict', choices=['dict', 'array'],
+                        help='The storage of the Q and N tables.')
+    parser.add_argument('-k', '--checkpoint_format', default='pickle', choices=['pickle', 'columnar'],
+                        help='The format to save learning data in.')
+    parser.add_argument('-i', '--num_iterations', default=100, type=int,
+                        help='The maximum number of fitted Q-iterations.')
+    args = parser.parse_args()
+    agent = QbertAgent(agent_type=args.agent_type, state_representation=args.state_representation, sound=False,
+                       display_screen=False, state_encoding=args.state_encoding, q_store=args.q_store,
+                       checkpoint_format=args.checkpoint_format, ale=ReplayALE(args.trace_directories[0]))
+    if args.load_learning_filename is not None:
+        agent.load(args.load_learning_filename)
+    train(agent, args.trace_directories, args.num_iterations)
+    agent.save(args.save_learning_filename)
+    logging.info('Total Q size: {}'.format(agent.q_size()))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
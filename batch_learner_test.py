@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from batch_learner import TransitionLog, fit_q
+from q_store import NUM_ACTION_COLUMNS
+
+A = ((0, 0), 'a')
+B = ((1, 0), 'b')
+C = ((2, 0), 'c')
+D = ((1, 1), 'd')
+GAMMA = 0.5
+
+
+def create_log():
+    log = TransitionLog()
+    log.add(A, 5, B, 1)
+    log.add(A, 5, B, 3)
+    log.add(B, 5, C, 10)
+    log.add(A, 3, D, -4)
+    return log
+
+
+def test_fit_q():
+    log = create_log()
+    q, n = fit_q(log, GAMMA, 'verbose')
+    a, b, c, d = (log.interner.lookup(s) for s in (A, B, C, D))
+    assert q[b, 5] == pytest.approx(10)
+    assert q[a, 5] == pytest.approx(2 + GAMMA * 10)  # Mean reward, then the best action from B
+    assert q[a, 3] == pytest.approx(-4)
+    assert not q[c].any() and not q[d].any()
+    assert n[a, 5] == 2 and n[a, 3] == 1 and n[b, 5] == 1
+    assert n.sum() == len(log)
+
+
+def test_fit_q_from_initial_values():
+    log = create_log()
+    initial_q = np.zeros((len(log.interner), NUM_ACTION_COLUMNS))
+    c = log.interner.lookup(C)
+    initial_q[c, 5] = 8
+    initial_q[c, 4] = 100  # Not a valid action from the top left edge
+    q, _ = fit_q(log, GAMMA, 'verbose', initial_q)
+    b, a = log.interner.lookup(B), log.interner.lookup(A)
+    assert q[b, 5] == pytest.approx(10 + GAMMA * 8)
+    assert q[a, 5] == pytest.approx(2 + GAMMA * (10 + GAMMA * 8))
+    assert q[c, 5] == 8 and q[c, 4] == 100  # Not visited, so left unchanged
+
@@ -0,0 +1,313 @@
+import argparse
+import json
+import logging
+import platform
+import random
+from timeit import default_timer
+
+import numpy as np
+
+from actions import get_valid_action_numbers
+from agent import QbertAgent
+from fake_ale import FakeALE
+from game_trace import ReplayALE
+from geometry import CELLS
+from learner import QLearner, LinearQLearner, HashedQLearner
+from nearest import NearestStateIndex
+from ram_perception import PERCEPTION_FIELDS, cross_validate
+from tuple_utils import list_to_tuple
+from world import QbertWorld
+
+TABLE_SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+NUM_TABLE_ACTIONS = 4  # Valid actions of the synthetic states, which are like the 'adjacent' block states
+AGENT_TYPES = ('block', 'subsumption', 'combined_verbose')
+
+
+def measure(function, number, repeat=3):
+    """
+    Time the given function.
+
+    :return: the best time per call over the repeats, in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = default_timer()
+        for _ in range(number):
+            function()
+        best = min(best, (default_timer() - start) / number)
+    return best
+
+
+def create_emulator(trace_directory=None):
+    """
+    Create a ReplayALE looping over the given trace, or a FakeALE if none is given.
+    """
+    if trace_directory is not None:
+        return ReplayALE(trace_directory, loop=True)
+    return FakeALE()
+
+
+def create_world(trace_directory=None, **world_options):
+    return QbertWorld(random_seed=123, frame_skip=4, repeat_action_probability=0, sound=False, display_screen=False,
+                      block_state_repr='adjacent', enemy_state_repr='adjacent_dangerous', friendly_state_repr='simple',
+                      ale=create_emulator(trace_directory), **world_options)
+
+
+def benchmark_perception(number, trace_directory=None):
+    """
+    Time the screen and RAM perception backends and the state encoders, on a recorded frame.
+
+    :return: a dict from benchmark name to time per call, in seconds
+    """
+    results = {}
+    world = create_world(trace_directory)
+    world.reset()
+    results['update_rgb'] = measure(world.update_rgb, number)
+    ram_world = create_world(trace_directory, perception='ram')
+    ram_world.reset()
+    ram_world.update_perception()  # Calibrate
+    results['update_ram'] = measure(ram_world.ram_perception.update, number)
+    for state_encoding in ('tuple', 'bitboard'):
+        world.state_encoding = state_encoding
+        for name in sorted(dir(world)):
+            if name.startswith('to_state_'):
+                results['{}[{}]'.format(name, state_encoding)] = measure(getattr(world, name), number)
+    world.state_encoding = 'tuple'
+    results['list_to_tuple'] = measure(lambda: list_to_tuple(world.block_colors), number)
+    results['get_valid_action_numbers'] = measure(lambda: [get_valid_action_numbers(row, col) for row, col in CELLS],
+                                                  number) / len(CELLS)
+    return results
+
+
+def check_perception(num_actions, trace_directory=None):
+    """
+    Cross-validate the RAM perception backend against the screen parser on every frame reached by random actions.
+
+    :return: a dict from perception field to the number of frames on which the two backends disagree
+    """
+    random.seed(0)
+    world = create_world(trace_directory, perception='ram')
+    world.reset()
+    mismatches = dict.fromkeys(PERCEPTION_FIELDS, 0)
+    for _ in range(num_actions):
+        for field in cross_validate(world):
+            mismatches[field] += 1
+        if world.ale.game_over():
+            world.reset_game()
+            world.reset()
+        world.perform_action(random.choice(get_valid_action_numbers(world.current_row, world.current_col)))
+    return mismatches
+
+
+def benchmark_learner(table_sizes, number, q_stores=('dict', 'array', 'bounded')):
+    """
+    Time action selection and updates of a QLearner on synthetic tables of the given numbers of entries.
+
+    :return: a dict from benchmark name to time per call, in seconds
+    """
+    random.seed(0)
+    results = {}
+    world = create_world()
+    for q_store in q_stores:
+        for table_size in table_sizes:
+            learner = QLearner(world, alpha=0.1, gamma=0.95, epsilon=0.2, unexplored_threshold=1,
+                               unexplored_reward=100, exploration='combined', distance_metric=None, state_repr='simple',
+                               q_store=q_store)
+            num_states = max(1, table_size // NUM_TABLE_ACTIONS)
+            random_state = np.random.RandomState(0)
+            values = random_state.rand(num_states, NUM_TABLE_ACTIONS).tolist()
+            actions = get_valid_action_numbers(1, 0)
+            for i, state_values in enumerate(values):
+                s = i, 0, 0, 0
+                for a, q in zip(actions, state_values):
+                    learner.store.set_q(s, a, q)
+            states = [(i, 0, 0, 0) for i in random_state.randint(num_states, size=number).tolist()]
+            states_iter = iter(states * 3)
+            suffix = '[{},{}]'.format(q_store, table_size)
+            results['select' + suffix] = measure(lambda: learner.get_best_actions(next(states_iter)), number)
+            states_iter = iter(states * 3)
+            results['update' + suffix] = measure(
+                lambda: learner.update(next(states_iter), actions[0], (0, 0, 0, 0), 25), number)
+    return results
+
+
+def benchmark_generalization(number, trace_directory=None, q_stores=('dict', 'array')):
+    """
+    Time the generalization of a backup to the close states of every distance metric, in both state encodings.
+
+    :return: a dict from benchmark name to time per call, in seconds
+    """
+    results = {}
+    world = create_world(trace_directory)
+    world.reset()
+    for q_store in q_stores:
+        for distance_metric in ('manhattan', 'hamming', 'same_result'):
+            for state_encoding in ('tuple', 'bitboard'):
+                world.state_encoding = state_encoding
+                learner = QLearner(world, alpha=0.1, gamma=0.95, epsilon=0.2, unexplored_threshold=1,
+                                   unexplored_reward=100, exploration='combined', distance_metric=distance_metric,
+                                   state_repr='verbose', q_store=q_store)
+                name = 'update_close[{},{},{}]'.format(q_store, distance_metric, state_encoding)
+                results[name] = measure(lambda: learner.update_close(2, 1.0), number)
+    world.state_encoding = 'tuple'
+    return results
+
+
+def benchmark_feature_learners(number, trace_directory=None):
+    """
+    Time action selection and updates of the feature learners on the combined verbose state of a recorded frame, in
+    both state encodings. The features of the state are computed on every call.
+
+    :return: a dict from benchmark name to time per call, in seconds
+    """
+    random.seed(0)
+    results = {}
+    world = create_world(trace_directory)
+    world.reset()
+    for learner_type, learner_class in (('linear', LinearQLearner), ('hashed', HashedQLearner)):
+        for state_encoding in ('tuple', 'bitboard'):
+            world.state_encoding = state_encoding
+            s = world.to_state_combined_verbose()
+            learner = learner_class(world, alpha=0.1, gamma=0.95, epsilon=0.2, exploration='combined',
+                                    state_repr='verbose')
+
+            def select():
+                learner.last_state = None
+                learner.get_best_actions(s)
+
+            def update():
+                learner.last_state = None
+                learner.update(s, 2, s, 25)
+
+            suffix = '[{},{}]'.format(learner_type, state_encoding)
+            results['select' + suffix] = measure(select, number)
+            results['update' + suffix] = measure(update, number)
+    world.state_encoding = 'tuple'
+    return results
+
+
+def benchmark_nearest(table_sizes, number, radius=2):
+    """
+    Time nearest state lookups in indexes of the given numbers of synthetic combined verbose states (bitboard
+    encoding), querying states at one or two bits from indexed ones.
+
+    :return: a dict from benchmark name to time per call, in seconds
+    """
+    results = {}
+    for table_size in table_sizes:
+        random_state = np.random.RandomState(0)
+        cells = random_state.randint(len(CELLS), size=table_size).tolist()
+        colors = random_state.randint(1 << 21, size=table_size).tolist()
+        sparse = [(random_state.rand(table_size, 21) < p).dot(1 << np.arange(21)).tolist() for p in (0.1, 0.05, 0.1)]
+        states = [(CELLS[cell], c, e, f, d) for cell, c, e, f, d in zip(cells, colors, *sparse)]
+        index = NearestStateIndex(radius)
+        for s in states:
+            index.add(s)
+        queries = []
+        for i in random_state.randint(table_size, size=number).tolist():
+            position, c, e, f, d = states[i]
+            flipped = 1 << random_state.randint(21) | 1 << random_state.randint(21)
+            queries.append((position, c ^ flipped, e, f, d))
+        queries_iter = iter(queries * 3)
+        results['nearest[{}]'.format(table_size)] = measure(lambda: index.get_nearest(next(queries_iter)), number)
+    return results
+
+
+def benchmark_agents(agent_types, num_actions, trace_directory=None, **agent_options):
+    """
+    Measure the number of actions per second of full agents against the fake emulator.
+
+    :return: a dict from agent type to actions per second
+    """
+    results = {}
+    for agent_type in agent_types:
+        random.seed(0)
+        agent = QbertAgent(agent_type=agent_type, sound=False, display_screen=False,
+                           ale=create_emulator(trace_directory), **agent_options)
+        world = agent.world
+        world.reset()
+        start = default_timer()
+        for _ in range(num_actions):
+            agent.action()
+            if world.ale.game_over():
+                world.reset_game()
+                world.reset()
+        results[agent_type] = num_actions / (default_timer() - start)
+    return results
+
+
+def run_benchmarks(table_sizes=TABLE_SIZES, number=1000, num_actions=2000, agent_types=AGENT_TYPES,
+                   trace_directory=None):
+    """
+    Run the micro benchmarks (times per call, in seconds) and the macro benchmark (actions per second).
+    """
+    micro = {}
+    logging.info('Benchmarking perception and state encoders')
+    micro.update(benchmark_perception(number, trace_directory))
+    logging.info('Benchmarking learners on tables of {} entries'.format(list(table_sizes)))
+    micro.update(benchmark_learner(table_sizes, number))
+    micro.update(benchmark_generalization(number, trace_directory))
+    micro.update(benchmark_feature_learners(number, trace_directory))
+    micro.update(benchmark_nearest(table_sizes, number))
+    logging.info('Benchmarking agents {}'.format(list(agent_types)))
+    macro = benchmark_agents(agent_types, num_actions, trace_directory)
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'micro': micro,
+        'macro': macro
+    }
+
+
+def compare(results, baseline):
+    """
+    Log the ratio of every result to the baseline, where a ratio above 1 is an improvement.
+    """
+    for name, seconds in sorted(results['micro'].items()):
+        if name in baseline['micro']:
+            logging.info('{}: {:.2f}x'.format(name, baseline['micro'][name] / seconds))
+    for name, actions_per_second in sorted(results['macro'].items()):
+        if name in baseline['macro']:
+            logging.info('{} agent: {:.2f}x'.format(name, actions_per_second / baseline['macro'][name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the agents against a fake emulator.')
+    parser.add_argument('-o', '--output_filename', default='benchmark.json',
+                        help='The JSON file to save the results to.')
+    parser.add_argument('-b', '--baseline_filename', default=None,
+                        help='The JSON file of previous results to compare with.')
+    parser.add_argument('-t', '--trace_directory', default=None,
+                        help='The directory of a recorded trace to replay instead of the fake emulator recording.')
+    parser.add_argument('-s', '--table_sizes', default=list(TABLE_SIZES), type=int, nargs='+',
+                        help='The numbers of entries of the synthetic Q tables.')
+    parser.add_argument('-n', '--number', default=1000, type=int,
+                        help='The number of calls per micro benchmark.')
+    parser.add_argument('-a', '--num_actions', default=2000, type=int,
+                        help='The number of actions per agent in the macro benchmark.')
+    parser.add_argument('-c', '--check_perception', action='store_true',
+                        help='Only cross-validate the RAM perception backend against the screen parser for the '
+                             'number of actions, and exit with an error if they disagree on a frame.')
+    args = parser.parse_args()
+    if args.check_perception:
+        mismatches = check_perception(args.num_actions, args.trace_directory)
+        if any(mismatches.values()):
+            parser.exit(1, 'RAM perception disagrees with the screen on {}\n'.format(mismatches))
+        logging.info('RAM perception agrees with the screen on {} frames'.format(args.num_actions))
+        return
+    results = run_benchmarks(table_sizes=args.table_sizes, number=args.number, num_actions=args.num_actions,
+                             trace_directory=args.trace_directory)
+    with open(args.output_filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    for name, seconds in sorted(results['micro'].items()):
+        logging.info('{}: {:.2f} us'.format(name, seconds * 1e6))
+    for name, actions_per_second in sorted(results['macro'].items()):
+        logging.info('{} agent: {:.0f} actions per second'.format(name, actions_per_second))
+    if args.baseline_filename is not None:
+        with open(args.baseline_filename) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
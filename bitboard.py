@@ -0,0 +1,57 @@
+from geometry import NUM_ROWS, CELLS, CELL_INDEX, CELL_BITS, SURROUNDING_CELLS
+
+
+def disc_bit(row, side):
+    """
+    Gets the bit of the disc at the given row and side (0 for left, 1 for right).
+    """
+    return 1 << (2 * row + side)
+
+
+def get_edge_disc_bits(row, col):
+    """
+    Gets the bits of the discs Qbert can jump on from the given block, in the (top_left, top_right, bot_left,
+    bot_right) order of SURROUNDING_CELLS: None for the directions without a disc at the edge of the pyramid.
+    """
+    return disc_bit(row, 0) if col == 0 else None, disc_bit(row, 1) if col == row else None, None, None
+
+
+def pack_grid(grid):
+    """
+    Packs a nested list pyramid grid of 0/1 values into an integer bitboard.
+    """
+    bits = 0
+    for row, col in CELLS:
+        if grid[row][col]:
+            bits |= CELL_BITS[row, col]
+    return bits
+
+
+def unpack_grid(bits):
+    """
+    Unpacks an integer bitboard into a nested tuple pyramid grid of 0/1 values.
+    """
+    return tuple(tuple((bits >> CELL_INDEX[row, col]) & 1 for col in range(row + 1)) for row in range(NUM_ROWS))
+
+
+def pack_discs(discs):
+    """
+    Packs the nested list of (left, right) discs at each row into an integer bitboard.
+    """
+    bits = 0
+    for row, (left, right) in enumerate(discs):
+        if left:
+            bits |= disc_bit(row, 0)
+        if right:
+            bits |= disc_bit(row, 1)
+    return bits
+
+
+def popcount(bits):
+    """
+    Counts the number of set bits in a bitboard.
+    """
+    return bin(bits).count('1')
+
+
+SURROUNDING_DISC_BITS = {cell: get_edge_disc_bits(*cell) for cell in SURROUNDING_CELLS}
@@ -0,0 +1,171 @@
+import argparse
+import glob
+import logging
+import os
+import pickle
+
+import numpy as np
+
+from pickler import load_from_pickle
+from q_store import DictQStore
+
+CHECKPOINT_DIRECTORY = 'checkpoint'
+
+replace_file = getattr(os, 'replace', os.rename)  # Overwrites the destination atomically (os.rename before Python 3.3)
+
+
+def get_checkpoint_path(filename, column):
+    return os.path.join(CHECKPOINT_DIRECTORY, '{}_{}'.format(filename, column))
+
+
+def write_file(path, write):
+    """
+    Write a file through a temporary file which replaces it once complete, so that the previous file stays intact
+    until then, including when the data being written is memory-mapped from it (see load_checkpoint).
+
+    :param write: a function writing the content to the given binary file object
+    """
+    temporary_path = '{}.tmp'.format(path)
+    with open(temporary_path, 'wb') as f:
+        write(f)
+    replace_file(temporary_path, path)
+
+
+def save_checkpoint(store, filename):
+    """
+    Save a Q store as a columnar checkpoint: the pickled list of interned states, and one row per state of float32 Q
+    values, uint32 visit counts and flags of the stored Q values, as .npy files indexed by action number.
+    """
+    if not os.path.isdir(CHECKPOINT_DIRECTORY):
+        os.makedirs(CHECKPOINT_DIRECTORY)
+    states, q, n, stored = store.to_arrays()
+    write_file(get_checkpoint_path(filename, 'states.pkl'),
+               lambda f: pickle.dump(states, f, protocol=pickle.HIGHEST_PROTOCOL))
+    write_file(get_checkpoint_path(filename, 'q.npy'), lambda f: np.save(f, np.asarray(q, dtype=np.float32)))
+    write_file(get_checkpoint_path(filename, 'n.npy'), lambda f: np.save(f, np.asarray(n, dtype=np.uint32)))
+    write_file(get_checkpoint_path(filename, 'stored.npy'), lambda f: np.save(f, np.asarray(stored, dtype=bool)))
+
+
+def load_checkpoint(store, filename, mmap_mode='c'):
+    """
+    Load a columnar checkpoint into a Q store. The arrays are memory-mapped, so that processes loading the same
+    checkpoint share its pages until they write to them.
+
+    :param mmap_mode: the numpy.memmap mode of the arrays ('c' for copy-on-write, 'r' for read-only)
+    """
+    with open(get_checkpoint_path(filename, 'states.pkl'), 'rb') as f:
+        states = pickle.load(f)
+    q = np.load(get_checkpoint_path(filename, 'q.npy'), mmap_mode=mmap_mode)
+    n = np.load(get_checkpoint_path(filename, 'n.npy'), mmap_mode=mmap_mode)
+    stored = np.load(get_checkpoint_path(filename, 'stored.npy'), mmap_mode=mmap_mode)
+    store.load_arrays(states, q, n, stored)
+
+
+def save_weights(weights, filename):
+    """
+    Save the weights of a feature learner as a columnar checkpoint.
+    """
+    if not os.path.isdir(CHECKPOINT_DIRECTORY):
+        os.makedirs(CHECKPOINT_DIRECTORY)
+    write_file(get_checkpoint_path(filename, 'weights.npy'), lambda f: np.save(f, weights))
+
+
+def load_weights(filename):
+    """
+    Load the weights of a feature learner from a columnar checkpoint.
+    """
+    return np.load(get_checkpoint_path(filename, 'weights.npy'))
+
+
+def learning_data_exists(filename, checkpoint_format, column='q.npy', pickle_suffix='Q'):
+    """
+    Check whether the learning data of a learner was saved in the given format ('pickle' or 'columnar').
+
+    :param column: the checkpoint file of the learning data in the columnar format
+    :param pickle_suffix: the suffix of the pickle file of the learning data in the pickle format
+    """
+    if checkpoint_format == 'columnar':
+        return os.path.exists(get_checkpoint_path(filename, column))
+    return os.path.exists(os.path.join('pickle', '{}_{}.pkl'.format(filename, pickle_suffix)))
+
+
+def get_delta_log_path(filename):
+    return get_checkpoint_path(filename, 'delta.pkl')
+
+
+def append_delta(filename, episode, entries):
+    """
+    Append the Q and N entries changed since the previous delta to the delta log of a learner.
+
+    :param episode: the number of episodes played when the entries were saved
+    :param entries: a dict from (s, a) to (Q value, N value), as applied by QLearner.apply_entries
+    """
+    if not os.path.isdir(CHECKPOINT_DIRECTORY):
+        os.makedirs(CHECKPOINT_DIRECTORY)
+    with open(get_delta_log_path(filename), 'ab') as f:
+        pickle.dump((episode, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_deltas(filename):
+    """
+    Iterate over the (episode, entries) deltas of the delta log of a learner, in the order they were appended. A
+    delta truncated by a crash while it was being appended ends the log.
+    """
+    path = get_delta_log_path(filename)
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+            except (pickle.UnpicklingError, ValueError, TypeError):
+                logging.warning('Ignoring the truncated end of {}'.format(path))
+                break
+
+
+def reset_delta_log(filename, episode=None):
+    """
+    Empty the delta log of a learner, e.g. after saving all of its entries. If an episode is given, the log keeps it
+    as an empty delta.
+    """
+    path = get_delta_log_path(filename)
+    if os.path.exists(path):
+        os.remove(path)
+    if episode is not None:
+        append_delta(filename, episode, {})
+
+
+def convert_pickle(filename):
+    """
+    Convert the Q and N pickle files of a learner (pickle/<filename>_Q.pkl and pickle/<filename>_N.pkl) to a columnar
+    checkpoint with the same filename.
+    """
+    store = DictQStore()
+    store.load_dicts(load_from_pickle('{}_{}'.format(filename, 'Q')), load_from_pickle('{}_{}'.format(filename, 'N')))
+    save_checkpoint(store, filename)
+    logging.info('Converted {} ({} Q values)'.format(filename, len(store)))
+
+
+def find_pickles():
+    """
+    Get the filenames of every learner with Q and N pickle files.
+    """
+    filenames = [os.path.basename(path)[:-len('_Q.pkl')] for path in glob.glob(os.path.join('pickle', '*_Q.pkl'))]
+    return sorted(f for f in filenames if os.path.exists(os.path.join('pickle', '{}_N.pkl'.format(f))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert Q and N pickle files to columnar checkpoints.')
+    parser.add_argument('filenames', nargs='*',
+                        help="The learner filenames to convert, e.g. 'data_block' for pickle/data_block_Q.pkl and "
+                             "pickle/data_block_N.pkl. Converts every pickled learner by default.")
+    args = parser.parse_args()
+    for filename in args.filenames or find_pickles():
+        convert_pickle(filename)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from checkpoint import save_checkpoint, load_checkpoint, save_weights, load_weights
+from q_store import create_q_store
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def fill(store, num_states=5000):
+    for i in range(num_states):
+        store.set_q((i, i % 7), 2 + i % 4, i * 0.5)
+        store.set_n((i, i % 7), 2 + i % 4, i % 11)
+
+
+@pytest.mark.parametrize('q_store', ['dict', 'array', 'bounded'])
+def test_save_load_round_trip(q_store):
+    store = create_q_store(q_store)
+    fill(store)
+    save_checkpoint(store, 'data')
+    loaded = create_q_store(q_store)
+    load_checkpoint(loaded, 'data')
+    assert loaded.to_dicts() == store.to_dicts()
+
+
+@pytest.mark.parametrize('q_store', ['dict', 'array', 'bounded'])
+def test_resave_to_the_loaded_checkpoint(q_store):
+    store = create_q_store(q_store)
+    fill(store)
+    save_checkpoint(store, 'data')
+    loaded = create_q_store(q_store)
+    load_checkpoint(loaded, 'data')  # Memory-maps the files about to be overwritten
+    loaded.set_q((0, 0), 3, 1.5)  # An existing state, so that the array store keeps the memory maps
+    save_checkpoint(loaded, 'data')
+    assert loaded.get_q((4999, 4999 % 7), 2 + 4999 % 4) == 4999 * 0.5
+
+    reloaded = create_q_store(q_store)
+    load_checkpoint(reloaded, 'data')
+    assert reloaded.to_dicts() == loaded.to_dicts()
+    assert reloaded.get_q((0, 0), 3) == 1.5
+
+
+def test_resave_loaded_weights():
+    weights = np.arange(24, dtype=np.float32).reshape(4, 6)
+    save_weights(weights, 'data')
+    loaded = load_weights('data')
+    save_weights(loaded + 1, 'data')
+    assert np.array_equal(load_weights('data'), weights + 1)
@@ -0,0 +1,225 @@
+import random
+
+import pytest
+
+from bitboard import unpack_grid, pack_grid, pack_discs
+from fake_ale import FakeALE
+from geometry import NUM_ROWS, ACTION_NUM_DIFFS, ACTION_NUM_DIFFS_WITH_NOOP
+from tuple_utils import list_to_tuple
+from world import QbertWorld
+
+BLOCK_STATE_REPRS = ['simple', 'adjacent', 'adjacent_one_block_left', 'along_direction', 'verbose']
+ENEMY_STATE_REPRS = ['simple', 'adjacent', 'adjacent_conservative', 'adjacent_conservative_with_position',
+                     'adjacent_dangerous', 'verbose']
+FRIENDLY_STATE_REPRS = ['simple', 'verbose']
+
+
+class Baseline:
+    """
+    The nested list encoders of the states, as they were before the bitboards and the geometry tables.
+    """
+    def __init__(self, world):
+        self.row, self.col = world.current_row, world.current_col
+        self.block_colors = [list(row) for row in world.block_colors]
+        self.enemies = [list(row) for row in world.enemies]
+        self.friendlies = [list(row) for row in world.friendlies]
+        self.discs = [list(row) for row in world.discs]
+
+    def surrounding(self, value):
+        row, col = self.row, self.col
+        top_left = value(row - 1, col - 1) if col != 0 else None
+        top_right = value(row - 1, col) if col != row else None
+        if row != NUM_ROWS - 1:
+            return top_left, top_right, value(row + 1, col), value(row + 1, col + 1)
+        return top_left, top_right, None, None
+
+    def blocks_simple(self):
+        return self.surrounding(lambda r, c: self.block_colors[r][c])
+
+    def num_adjacent_uncolored_blocks(self, row, col):
+        return sum(1 for diff_row, diff_col in ACTION_NUM_DIFFS_WITH_NOOP.values()
+                   if 0 <= row + diff_row < NUM_ROWS and 0 <= col + diff_col <= row + diff_row and
+                   self.block_colors[row + diff_row][col + diff_col] == 0)
+
+    def blocks_adjacent(self):
+        return self.surrounding(self.num_adjacent_uncolored_blocks)
+
+    def blocks_adjacent_one_block_left(self):
+        return self.blocks_adjacent() + (sum(map(sum, self.block_colors)) == 20,)
+
+    def blocks_along_direction(self):
+        def num_colored(row_diff, col_diff):
+            r, c, num = self.row + row_diff, self.col + col_diff, 0
+            while 0 <= r < NUM_ROWS and 0 <= c <= r:
+                num += self.block_colors[r][c] == 1
+                r += row_diff
+                c += col_diff
+            return num
+        row, col = self.row, self.col
+        top_left = num_colored(-1, -1) if col != 0 else None
+        top_right = num_colored(-1, 0) if col != row else None
+        if row != NUM_ROWS - 1:
+            return top_left, top_right, num_colored(1, 0), num_colored(1, 1)
+        return top_left, top_right, None, None
+
+    def is_enemy_adjacent(self, row, col):
+        if 0 <= row < NUM_ROWS and 0 <= col <= row and self.enemies[row][col] != 1:
+            for diff_row, diff_col in ACTION_NUM_DIFFS.values():
+                r, c = row + diff_row, col + diff_col
+                if 0 <= r < NUM_ROWS and 0 <= c <= r and self.enemies[r][c] == 1:
+                    return True
+        return False
+
+    def enemies_simple(self):
+        row, col, enemies, discs = self.row, self.col, self.enemies, self.discs
+        top_left = top_right = bot_left = bot_right = None
+        if col != 0 and enemies[row - 1][col - 1] == 0 or col == 0 and discs[row][0] == 1:
+            top_left = 0
+        elif col != 0 and enemies[row - 1][col - 1] == 1:
+            top_left = 1
+        if col != row and enemies[row - 1][col] == 0 or col == row and discs[row][1] == 1:
+            top_right = 0
+        elif col != row and enemies[row - 1][col] == 1:
+            top_right = 1
+        if row != NUM_ROWS - 1:
+            bot_left = enemies[row + 1][col]
+            bot_right = enemies[row + 1][col + 1]
+        return top_left, top_right, bot_left, bot_right
+
+    def enemies_adjacent(self, adjacent_value):
+        row, col, enemies, discs = self.row, self.col, self.enemies, self.discs
+        top_left = top_right = bot_left = bot_right = None
+        if self.is_enemy_adjacent(row - 1, col - 1):
+            top_left = adjacent_value
+        elif col != 0 and enemies[row - 1][col - 1] == 0:
+            top_left = 0
+        elif col == 0 and discs[row][0] == 1:
+            top_left = 1
+        if self.is_enemy_adjacent(row - 1, col):
+            top_right = adjacent_value
+        elif col != row and enemies[row - 1][col] == 0:
+            top_right = 0
+        elif col == row and discs[row][1] == 1:
+            top_right = 1
+        if row != NUM_ROWS - 1:
+            if self.is_enemy_adjacent(row + 1, col):
+                bot_left = adjacent_value
+            elif enemies[row + 1][col] == 0:
+                bot_left = 0
+            if self.is_enemy_adjacent(row + 1, col + 1):
+                bot_right = adjacent_value
+            elif enemies[row + 1][col + 1] == 0:
+                bot_right = 0
+        return top_left, top_right, bot_left, bot_right
+
+    def enemies_adjacent_dangerous(self):
+        row, col, enemies, discs = self.row, self.col, self.enemies, self.discs
+        top_left = top_right = bot_left = bot_right = None
+        if col != 0 and enemies[row - 1][col - 1] == 1:
+            top_left = 3
+        elif self.is_enemy_adjacent(row - 1, col - 1):
+            top_left = 2
+        elif col != 0 and enemies[row - 1][col - 1] == 0:
+            top_left = 0
+        elif col == 0 and discs[row][0] == 1:
+            top_left = 1
+        if col != row and enemies[row - 1][col - 1] == 1:  # Sic: the top left block, wrapping around the row
+            top_right = 3
+        elif self.is_enemy_adjacent(row - 1, col):
+            top_right = 2
+        elif col != row and enemies[row - 1][col] == 0:
+            top_right = 0
+        elif col == row and discs[row][1] == 1:
+            top_right = 1
+        if row != NUM_ROWS - 1:
+            for cell in ((row + 1, col), (row + 1, col + 1)):
+                if enemies[cell[0]][cell[1]] == 1:
+                    value = 3
+                elif self.is_enemy_adjacent(*cell):
+                    value = 2
+                else:
+                    value = 0
+                if cell[1] == col:
+                    bot_left = value
+                else:
+                    bot_right = value
+        return top_left, top_right, bot_left, bot_right
+
+    def friendlies_simple(self):
+        return self.surrounding(lambda r, c: self.friendlies[r][c])
+
+    def encode(self, name):
+        position = self.row, self.col
+        return {
+            'blocks_simple': self.blocks_simple,
+            'blocks_adjacent': self.blocks_adjacent,
+            'blocks_adjacent_one_block_left': self.blocks_adjacent_one_block_left,
+            'blocks_along_direction': self.blocks_along_direction,
+            'blocks_verbose': lambda: (position, list_to_tuple(self.block_colors)),
+            'enemies_simple': self.enemies_simple,
+            'enemies_adjacent': lambda: self.enemies_adjacent(2),
+            'enemies_adjacent_conservative': lambda: self.enemies_adjacent(None),
+            'enemies_adjacent_conservative_with_position': lambda: self.enemies_adjacent(None) + position,
+            'enemies_adjacent_dangerous': self.enemies_adjacent_dangerous,
+            'enemies_verbose': lambda: (position, list_to_tuple(self.enemies)),
+            'friendlies_simple': self.friendlies_simple,
+            'friendlies_verbose': lambda: (position, list_to_tuple(self.friendlies)),
+            'combined_verbose': lambda: (position, list_to_tuple(self.block_colors), list_to_tuple(self.enemies),
+                                         list_to_tuple(self.friendlies), list_to_tuple(self.discs)),
+        }[name]()
+
+
+def create_world(state_encoding, seed):
+    return QbertWorld(random_seed=123, frame_skip=4, repeat_action_probability=0, sound=False, display_screen=False,
+                      state_encoding=state_encoding, ale=FakeALE(num_frames=256, seed=seed))
+
+
+def iter_frames(world, num_actions=200):
+    """
+    Iterate over the frames of the fake recording reached by random actions.
+    """
+    random.seed(0)
+    world.reset()
+    for _ in range(num_actions):
+        yield
+        if world.ale.game_over():
+            world.reset_game()
+            world.reset()
+        world.perform_action(random.choice([2, 3, 4, 5]))
+
+
+def encode(world, name):
+    return getattr(world, 'to_state_' + name)()
+
+
+ENCODERS = ['blocks_' + repr_name for repr_name in BLOCK_STATE_REPRS] + \
+           ['enemies_' + repr_name for repr_name in ENEMY_STATE_REPRS] + \
+           ['friendlies_' + repr_name for repr_name in FRIENDLY_STATE_REPRS] + ['combined_verbose']
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('name', ENCODERS)
+def test_tuple_encoders_match_the_baseline(name, seed):
+    world = create_world('tuple', seed)
+    for _ in iter_frames(world):
+        assert encode(world, name) == Baseline(world).encode(name)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_bitboard_encoders_match_the_tuple_encoders(seed):
+    world = create_world('bitboard', seed)
+    for _ in iter_frames(world):
+        baseline = Baseline(world)
+        for name in ENCODERS:
+            if not name.endswith('verbose'):
+                assert encode(world, name) == baseline.encode(name)
+        for name, grid in (('blocks_verbose', baseline.block_colors), ('enemies_verbose', baseline.enemies),
+                           ('friendlies_verbose', baseline.friendlies)):
+            position, bits = encode(world, name)
+            assert position == (baseline.row, baseline.col)
+            assert unpack_grid(bits) == list_to_tuple(grid)
+            assert bits == pack_grid(grid)
+        position, block_bits, enemy_bits, friendly_bits, disc_bits = encode(world, 'combined_verbose')
+        assert (block_bits, enemy_bits, friendly_bits) == \
+            tuple(pack_grid(grid) for grid in (baseline.block_colors, baseline.enemies, baseline.friendlies))
+        assert disc_bits == pack_discs(baseline.discs)
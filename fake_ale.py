@@ -0,0 +1,163 @@
+import numpy as np
+
+from geometry import CELLS, NUM_ROWS
+from ram_perception import TILE_ADDRESSES, QBERT_X_BYTE, QBERT_Y_BYTE
+from world import PROBE_YS, PROBE_XS, AGENT_PROBES_START, AGENT_BLOCK_OFFSET_RANGE, LEFT_DISC_PROBES_START, \
+    RIGHT_DISC_PROBES_START, SCORE_PROBE, NUM_BLOCKS, LEVEL_BYTE, COLOR_BLACK, COLOR_YELLOW, COLOR_QBERT, \
+    COLOR_PURPLE, COLOR_GREEN
+
+SCREEN_HEIGHT, SCREEN_WIDTH = 210, 160
+RAM_SIZE = 128
+NUM_LIVES = 4
+
+# Palette indices of the colors drawn on the recorded screens
+INDEX_BLACK = 0
+INDEX_YELLOW = 1
+INDEX_QBERT = 2
+INDEX_PURPLE = 3
+INDEX_GREEN = 4
+INDEX_BLUE = 5
+PALETTE = np.zeros((256, 3), dtype=np.uint8)
+PALETTE[[INDEX_BLACK, INDEX_YELLOW, INDEX_QBERT, INDEX_PURPLE, INDEX_GREEN, INDEX_BLUE]] = [
+    COLOR_BLACK, COLOR_YELLOW, COLOR_QBERT, COLOR_PURPLE, COLOR_GREEN, (45, 50, 184)]
+
+TILE_GOAL = 2
+TILE_OTHER = 1
+REWARDS = [0, 25, 300]
+REWARD_PROBABILITIES = [0.6, 0.35, 0.05]
+
+
+class FakeALE:
+    """
+    Deterministic stand-in for the subset of ALEInterface used by QbertWorld, which replays a recording of decision
+    frames (palette-indexed screen, RAM and reward) whatever the actions taken, so that the perception, the state
+    encoders and the learners can be benchmarked without the ROM or the ALE.
+
+    The recording is synthesized from a seed: Qbert, enemies, friendlies, discs and colored blocks are drawn at
+    random cells of the pyramid, with a RAM consistent with the screen for the RAM perception backend. Every decision
+    takes acts_per_decision acts, a life is lost every episode_length / NUM_LIVES decisions, and the game is over
+    after episode_length decisions.
+    """
+    def __init__(self, num_frames=64, episode_length=200, acts_per_decision=4, seed=0):
+        self.episode_length = episode_length
+        self.acts_per_decision = acts_per_decision
+        self.screens, self.rams, self.rewards = synthesize_recording(num_frames, seed)
+        self.settings = {}
+        self.frame = 0
+        self.screen = self.screens[0]
+        self.ram = self.rams[0].copy()
+        self.num_acts = 0
+        self.num_decisions = 0
+        self.num_lives = NUM_LIVES
+        self.over = False
+
+    def setInt(self, name, value):
+        self.settings[name] = value
+
+    def getInt(self, name):
+        return self.settings.get(name, 0)
+
+    def setFloat(self, name, value):
+        self.settings[name] = value
+
+    def getFloat(self, name):
+        return self.settings.get(name, 0.0)
+
+    def setBool(self, name, value):
+        self.settings[name] = value
+
+    def loadROM(self, filename):
+        pass
+
+    def getLegalActionSet(self):
+        return list(range(18))
+
+    def getMinimalActionSet(self):
+        return [0, 1, 2, 3, 4, 5]
+
+    def getScreenDims(self):
+        return SCREEN_WIDTH, SCREEN_HEIGHT
+
+    def getRAMSize(self):
+        return RAM_SIZE
+
+    def getRAM(self, ram):
+        ram[:] = self.ram
+
+    def getScreen(self, screen):
+        screen[...] = self.screen
+
+    def getScreenRGB(self, rgb_screen):
+        rgb_screen[...] = PALETTE[self.screen]
+
+    def lives(self):
+        return self.num_lives
+
+    def game_over(self):
+        return self.over
+
+    def act(self, a):
+        self.num_acts += 1
+        if self.num_acts % self.acts_per_decision != 0:
+            self.ram[0] = 1  # Qbert is moving
+            return 0
+        self.num_decisions += 1
+        self.load_frame(self.num_decisions % len(self.screens))
+        if self.num_decisions % max(1, self.episode_length // NUM_LIVES) == 0:
+            self.num_lives = max(0, self.num_lives - 1)
+        if self.num_decisions >= self.episode_length:
+            self.num_lives = 0
+            self.over = True
+        return self.rewards[self.frame]
+
+    def load_frame(self, frame):
+        self.frame = frame
+        self.screen = self.screens[frame]
+        self.ram[:] = self.rams[frame]
+
+    def reset_game(self):
+        self.num_acts = 0
+        self.num_decisions = 0
+        self.num_lives = NUM_LIVES
+        self.over = False
+        self.load_frame(0)
+
+    def cloneState(self):
+        return self.num_acts, self.num_decisions, self.num_lives, self.over, self.frame, self.ram.copy()
+
+    def restoreState(self, state):
+        self.num_acts, self.num_decisions, self.num_lives, self.over, frame, ram = state
+        self.load_frame(frame)
+        self.ram[:] = ram
+
+
+def synthesize_recording(num_frames, seed):
+    """
+    Synthesize the decision frames replayed by FakeALE.
+
+    :return: the palette-indexed screens, RAMs and rewards of the frames
+    """
+    random_state = np.random.RandomState(seed)
+    screens = np.zeros((num_frames, SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint8)
+    rams = np.zeros((num_frames, RAM_SIZE), dtype=np.uint8)
+    rewards = random_state.choice(REWARDS, size=num_frames, p=REWARD_PROBABILITIES).tolist()
+    agent_offset = AGENT_BLOCK_OFFSET_RANGE // 2
+    for screen, ram in zip(screens, rams):
+        colored = random_state.rand(NUM_BLOCKS) < 0.3
+        screen[PROBE_YS[:NUM_BLOCKS], PROBE_XS[:NUM_BLOCKS]] = np.where(colored, INDEX_YELLOW, INDEX_BLUE)
+        ram[TILE_ADDRESSES] = np.where(colored, TILE_GOAL, TILE_OTHER)
+        for index, probability in ((INDEX_PURPLE, 0.5), (INDEX_GREEN, 0.2), (INDEX_QBERT, 1)):
+            if random_state.rand() < probability:
+                cell = random_state.randint(NUM_BLOCKS)
+                probe = AGENT_PROBES_START + AGENT_BLOCK_OFFSET_RANGE * cell + agent_offset
+                screen[PROBE_YS[probe], PROBE_XS[probe]] = index
+        row, col = CELLS[cell]  # Qbert's cell, drawn last
+        ram[QBERT_X_BYTE] = 16 + 24 * col
+        ram[QBERT_Y_BYTE] = 16 + 24 * row
+        for start in (LEFT_DISC_PROBES_START, RIGHT_DISC_PROBES_START):
+            discs = start + np.flatnonzero(random_state.rand(NUM_ROWS) < 0.1)
+            screen[PROBE_YS[discs], PROBE_XS[discs]] = INDEX_BLUE
+        screen[PROBE_YS[SCORE_PROBE], PROBE_XS[SCORE_PROBE]] = INDEX_YELLOW
+        ram[LEVEL_BYTE] = 0
+        ram[RAM_SIZE - 1] = 1  # Qbert can take a decision
+    return screens, rams, rewards
@@ -0,0 +1,115 @@
+import zlib
+
+from bitboard import popcount
+from geometry import CELLS, CELL_INDEX, SURROUNDING_NEIGHBOURHOOD_MASKS, SURROUNDING_RAY_MASKS
+from nearest import COMPONENT_BITS, pack_component, pack_state
+
+NUM_GRIDS = 4  # Block colors, enemies, friendlies and discs of combined verbose states
+NUM_DIRECTIONS = 4  # Top left, top right, bottom left and bottom right
+MAX_ADJACENT = 5  # Including the surrounding block itself
+MAX_ALONG_DIRECTION = 5
+
+# Feature layout of verbose states
+BIAS_FEATURE = 0
+POSITION_FEATURES_START = 1
+GRID_FEATURES_START = POSITION_FEATURES_START + len(CELLS)
+ADJACENT_FEATURES_START = GRID_FEATURES_START + NUM_GRIDS * COMPONENT_BITS
+ALONG_DIRECTION_FEATURES_START = ADJACENT_FEATURES_START + NUM_DIRECTIONS * (MAX_ADJACENT + 1)
+NUM_PYRAMID_FEATURES = ALONG_DIRECTION_FEATURES_START + NUM_DIRECTIONS * (MAX_ALONG_DIRECTION + 1)
+
+# Feature layout of simple states: a one-hot value (None or 0 to MAX_SIMPLE_VALUE) per direction
+MAX_SIMPLE_VALUE = 5
+NUM_SIMPLE_FEATURES = 1 + NUM_DIRECTIONS * (MAX_SIMPLE_VALUE + 2)
+
+
+def get_pyramid_features(s):
+    """
+    Gets the active binary features of a verbose state, in either encoding: a bias, the one-hot position of Qbert, a
+    bit per block of every grid (block colors, enemies, friendlies or discs), and, on the first grid, the one-hot
+    number of unset blocks adjacent to each surrounding block (as in the 'adjacent' block states) and of set blocks
+    along each direction (as in the 'along_direction' block states).
+
+    :return: the sorted indices of the active features, out of NUM_PYRAMID_FEATURES
+    """
+    position = s[0]
+    features = [BIAS_FEATURE, POSITION_FEATURES_START + CELL_INDEX[position]]
+    first_grid = None
+    for g, component in enumerate(s[1:]):
+        bits = pack_component(component)
+        if first_grid is None:
+            first_grid = bits
+        offset = GRID_FEATURES_START + g * COMPONENT_BITS
+        features.extend(offset + i for i in get_set_bits(bits))
+    unset = ~first_grid
+    for d, (neighbourhood_mask, ray_mask) in enumerate(zip(SURROUNDING_NEIGHBOURHOOD_MASKS[position],
+                                                           SURROUNDING_RAY_MASKS[position])):
+        if neighbourhood_mask is not None:
+            features.append(ADJACENT_FEATURES_START + d * (MAX_ADJACENT + 1) + popcount(neighbourhood_mask & unset))
+            features.append(ALONG_DIRECTION_FEATURES_START + d * (MAX_ALONG_DIRECTION + 1) +
+                            popcount(ray_mask & first_grid))
+    return features
+
+
+def get_set_bits(bits):
+    """
+    Gets the indices of the set bits of an integer, from the lowest.
+    """
+    indices = []
+    while bits:
+        low_bit = bits & -bits
+        indices.append(low_bit.bit_length() - 1)
+        bits ^= low_bit
+    return indices
+
+
+def get_simple_features(s):
+    """
+    Gets the active binary features of a simple state (a value per surrounding block, None when unattainable): a bias
+    and the one-hot value of every direction.
+
+    :return: the indices of the active features, out of NUM_SIMPLE_FEATURES
+    """
+    features = [BIAS_FEATURE]
+    for d, value in enumerate(s):
+        features.append(1 + d * (MAX_SIMPLE_VALUE + 2) + (0 if value is None else min(value, MAX_SIMPLE_VALUE) + 1))
+    return features
+
+
+def get_state_keys(s, state_repr):
+    """
+    Gets the components of a state of any encoder, as keys to hash: the whole state, and the value of every direction
+    for simple states, or Qbert's position and every set block of every grid, alone and with the position, for verbose
+    states (in either encoding). The keys hold integers only, so that they have a canonical encoding (see hash_key).
+
+    :return: a list of tuples of integers
+    """
+    if state_repr == 'verbose':
+        position, bits = pack_state(s)
+        keys = [(0,), (1, position), (2, position, bits)]
+        for g, component in enumerate(s[1:]):
+            for i in get_set_bits(pack_component(component)):
+                keys.append((3, g, i))
+                keys.append((4, g, i, position))
+        return keys
+    values = tuple(-1 if value is None else value for value in s)
+    return [(0,), (2, values)] + [(1, d, value) for d, value in enumerate(values)]
+
+
+def hash_key(key):
+    """
+    Hashes a tuple of integers with the CRC-32 of its decimal encoding, which unlike the built-in hash of tuples is the
+    same in every run, Python version and platform.
+
+    :return: an unsigned 32-bit integer
+    """
+    return zlib.crc32(','.join(str(value) for value in key).encode('ascii')) & 0xffffffff
+
+
+def get_hashed_features(s, state_repr, num_features):
+    """
+    Gets the active features of a state of any encoder, by hashing its components (see get_state_keys) into the given
+    number of features. Colliding components share a feature.
+
+    :return: the sorted indices of the active features, without duplicates
+    """
+    return sorted(set(hash_key(key) % num_features for key in get_state_keys(s, state_repr)))
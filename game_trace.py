@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+# Events of a trace which are not actions
+START_EVENT = -1
+RESET_GAME_EVENT = -2
+RESTORE_STATE_EVENT = -3
+
+TRACE_FILENAME = 'trace.json'
+
+
+def get_chunk_path(directory, chunk):
+    return os.path.join(directory, 'chunk_{:05d}.npz'.format(chunk))
+
+
+class TraceRecorder:
+    """
+    Wraps an ALEInterface to record a trace of every call changing the emulator state (act, reset_game and
+    restoreState) with its reward and the resulting lives, RAM and palette-indexed screen, to chunks of compressed
+    arrays in a directory. The palette is learned from the RGB screens, so that a ReplayALE can serve both screens.
+
+    The world marks the act starting each decision, so that the recorded decisions can be replayed with their actions.
+    """
+    def __init__(self, ale, directory, chunk_size=1000):
+        self.ale = ale
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.settings = {}
+        self.chunk_sizes = []
+        self.num_events = 0
+        self.decision_pending = False
+        self.palette = np.zeros((256, 3), dtype=np.uint8)
+        self.chunk = None
+        self.screen = None
+        self.rgb_screen = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def __getattr__(self, name):
+        return getattr(self.ale, name)
+
+    def setInt(self, name, value):
+        self.settings[name] = value
+        self.ale.setInt(name, value)
+
+    def setFloat(self, name, value):
+        self.settings[name] = value
+        self.ale.setFloat(name, value)
+
+    def setBool(self, name, value):
+        self.settings[name] = value
+        self.ale.setBool(name, value)
+
+    def loadROM(self, filename):
+        self.ale.loadROM(filename)
+        width, height = self.ale.getScreenDims()
+        self.screen = np.empty([height, width], dtype=np.uint8)
+        self.rgb_screen = np.empty([height, width, 3], dtype=np.uint8)
+        self.record(START_EVENT, 0)
+
+    def mark_decision(self):
+        """
+        Mark the next act as the action of a decision.
+        """
+        self.decision_pending = True
+
+    def act(self, a):
+        reward = self.ale.act(a)
+        self.record(a, reward)
+        return reward
+
+    def reset_game(self):
+        self.ale.reset_game()
+        self.record(RESET_GAME_EVENT, 0)
+
+    def restoreState(self, state):
+        self.ale.restoreState(state)
+        self.record(RESTORE_STATE_EVENT, 0)
+
+    def record(self, event, reward):
+        ale = self.ale
+        if self.chunk is None:
+            self.chunk = {'events': [], 'rewards': [], 'lives': [], 'game_over': [], 'decisions': [], 'rams': [],
+                          'screens': []}
+        ram = np.empty(ale.getRAMSize(), dtype=np.uint8)
+        ale.getRAM(ram)
+        ale.getScreen(self.screen)
+        ale.getScreenRGB(self.rgb_screen)
+        self.palette[self.screen] = self.rgb_screen
+        chunk = self.chunk
+        chunk['events'].append(event)
+        chunk['rewards'].append(reward)
+        chunk['lives'].append(ale.lives())
+        chunk['game_over'].append(ale.game_over())
+        chunk['decisions'].append(self.decision_pending)
+        chunk['rams'].append(ram)
+        chunk['screens'].append(self.screen.copy())
+        self.decision_pending = False
+        self.num_events += 1
+        if len(chunk['events']) == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the events recorded since the last flush to a new chunk.
+        """
+        if self.chunk is None:
+            return
+        chunk = self.chunk
+        np.savez_compressed(get_chunk_path(self.directory, len(self.chunk_sizes)),
+                            events=np.array(chunk['events'], dtype=np.int16),
+                            rewards=np.array(chunk['rewards'], dtype=np.int32),
+                            lives=np.array(chunk['lives'], dtype=np.int8),
+                            game_over=np.array(chunk['game_over'], dtype=bool),
+                            decisions=np.array(chunk['decisions'], dtype=bool),
+                            rams=np.array(chunk['rams']),
+                            screens=np.array(chunk['screens']),
+                            palette=self.palette)
+        self.chunk_sizes.append(len(chunk['events']))
+        self.chunk = None
+
+    def close(self):
+        """
+        Flush the last events and write the description of the trace.
+        """
+        self.flush()
+        height, width = self.screen.shape
+        with open(os.path.join(self.directory, TRACE_FILENAME), 'w') as f:
+            json.dump({
+                'settings': self.settings,
+                'screen_dims': [width, height],
+                'ram_size': self.ale.getRAMSize(),
+                'legal_actions': [int(a) for a in self.ale.getLegalActionSet()],
+                'minimal_actions': [int(a) for a in self.ale.getMinimalActionSet()],
+                'chunk_sizes': self.chunk_sizes,
+                'num_events': self.num_events
+            }, f, indent=2)
+        logging.info('Recorded {} events to {}'.format(self.num_events, self.directory))
+
+
+class ReplayALE:
+    """
+    Implements the subset of ALEInterface used by QbertWorld by replaying a trace recorded by TraceRecorder, so that
+    perception, state encoders and learners can run at full speed without the emulator.
+
+    Every call changing the emulator state moves to the next event of the trace, whatever the given action: act and
+    restoreState return the recorded reward, reset_game skips to the next recorded reset. Once the trace is exhausted,
+    the game is over, unless looping over the trace.
+    """
+    def __init__(self, directory, loop=False):
+        self.directory = directory
+        self.loop = loop
+        with open(os.path.join(directory, TRACE_FILENAME)) as f:
+            self.description = json.load(f)
+        self.settings = dict(self.description['settings'])
+        self.num_events = self.description['num_events']
+        self.chunk_starts = np.cumsum([0] + self.description['chunk_sizes']).tolist()
+        self.chunk_index = None
+        self.chunk = None
+        self.exhausted = False
+        self.seek(0)
+
+    def get_chunk(self, position):
+        """
+        Get the chunk holding the event at the given position, loading it if needed.
+
+        :return: the chunk, and the index of the event in it
+        """
+        chunk_index = bisect_right(self.chunk_starts, position) - 1
+        if chunk_index != self.chunk_index:
+            with np.load(get_chunk_path(self.directory, chunk_index)) as data:
+                self.chunk = {name: data[name] for name in data.files}
+            self.chunk_index = chunk_index
+        return self.chunk, position - self.chunk_starts[chunk_index]
+
+    def seek(self, position):
+        """
+        Move to the event at the given position of the trace.
+        """
+        if position >= self.num_events:
+            if not self.loop:
+                self.exhausted = True
+                return
+            position = 0
+        chunk, i = self.get_chunk(position)
+        self.position = position
+        self.event = int(chunk['events'][i])
+        self.reward = int(chunk['rewards'][i])
+        self.num_lives = int(chunk['lives'][i])
+        self.over = bool(chunk['game_over'][i])
+        self.ram = chunk['rams'][i]
+        self.screen = chunk['screens'][i]
+        self.palette = chunk['palette']
+
+    def next_event(self):
+        self.seek(self.position + 1)
+
+    def get_decision_action(self):
+        """
+        Get the recorded action of the next act if it starts a decision, else None.
+        """
+        if self.exhausted or self.position + 1 >= self.num_events:
+            return None
+        chunk, i = self.get_chunk(self.position + 1)
+        return int(chunk['events'][i]) if chunk['decisions'][i] else None
+
+    def setInt(self, name, value):
+        self.settings[name] = value
+
+    def getInt(self, name):
+        return self.settings.get(name, 0)
+
+    def setFloat(self, name, value):
+        self.settings[name] = value
+
+    def getFloat(self, name):
+        return self.settings.get(name, 0.0)
+
+    def setBool(self, name, value):
+        self.settings[name] = value
+
+    def loadROM(self, filename):
+        pass
+
+    def getLegalActionSet(self):
+        return self.description['legal_actions']
+
+    def getMinimalActionSet(self):
+        return self.description['minimal_actions']
+
+    def getScreenDims(self):
+        return tuple(self.description['screen_dims'])
+
+    def getRAMSize(self):
+        return self.description['ram_size']
+
+    def getRAM(self, ram):
+        ram[:] = self.ram
+
+    def getScreen(self, screen):
+        screen[...] = self.screen
+
+    def getScreenRGB(self, rgb_screen):
+        rgb_screen[...] = self.palette[self.screen]
+
+    def lives(self):
+        return 0 if self.exhausted else self.num_lives
+
+    def game_over(self):
+        return self.exhausted or self.over
+
+    def act(self, a):
+        if self.exhausted:
+            return 0
+        self.next_event()
+        return 0 if self.exhausted else self.reward
+
+    def reset_game(self):
+        while not self.exhausted:
+            self.next_event()
+            if self.event == RESET_GAME_EVENT or self.event == START_EVENT:
+                break
+
+    def cloneState(self):
+        return self.position
+
+    def restoreState(self, state):
+        self.next_event()
@@ -0,0 +1,112 @@
+NUM_ROWS = 6
+
+LEFT_EDGE_BLOCKS = [(1, 0), (2, 0), (3, 0), (4, 0)]
+RIGHT_EDGE_BLOCKS = [(1, 1), (2, 2), (3, 3), (4, 4)]
+BOTTOM_BLOCKS = [(5, 1), (5, 2), (5, 3), (5, 4)]
+
+ACTION_NUM_DIFFS_WITH_NOOP = {
+    0: (0, 0),
+    2: (-1, 0),
+    3: (1, 1),
+    4: (-1, -1),
+    5: (1, 0)
+}
+
+ACTION_NUM_DIFFS = {
+    2: (-1, 0),
+    3: (1, 1),
+    4: (-1, -1),
+    5: (1, 0)
+}
+
+MOVE_ACTION_NUMBERS = (2, 3, 4, 5)
+
+CELLS = [(row, col) for row in range(NUM_ROWS) for col in range(row + 1)]  # Row-major order of the pyramid blocks
+CELL_INDEX = {cell: i for i, cell in enumerate(CELLS)}
+CELL_BITS = {cell: 1 << i for i, cell in enumerate(CELLS)}
+
+
+def is_on_pyramid(row, col):
+    """
+    Indicates if the row/col position is one of the pyramid blocks.
+    """
+    return 0 <= row < NUM_ROWS and 0 <= col <= row
+
+
+def cells_to_mask(cells):
+    """
+    Gets the bitboard mask of the given blocks.
+    """
+    mask = 0
+    for cell in cells:
+        mask |= CELL_BITS[cell]
+    return mask
+
+
+def build_neighbours():
+    """
+    Builds the (action number, resulting block) pairs of every valid move from every block.
+    """
+    neighbours = {}
+    for row, col in CELLS:
+        neighbours[row, col] = []
+        for a in MOVE_ACTION_NUMBERS:
+            diff_row, diff_col = ACTION_NUM_DIFFS[a]
+            if is_on_pyramid(row + diff_row, col + diff_col):
+                neighbours[row, col].append((a, (row + diff_row, col + diff_col)))
+    return neighbours
+
+
+def build_surrounding_cells():
+    """
+    Builds the (top_left, top_right, bot_left, bot_right) blocks around every block, None when unattainable.
+    """
+    surrounding = {}
+    for row, col in CELLS:
+        top_left = (row - 1, col - 1) if col != 0 else None
+        top_right = (row - 1, col) if col != row else None
+        bot_left = (row + 1, col) if row != NUM_ROWS - 1 else None
+        bot_right = (row + 1, col + 1) if row != NUM_ROWS - 1 else None
+        surrounding[row, col] = top_left, top_right, bot_left, bot_right
+    return surrounding
+
+
+def build_ray_masks():
+    """
+    Builds the masks of the blocks along each (row_diff, col_diff) direction from every block, excluding the block
+    itself.
+    """
+    ray_masks = {}
+    for row, col in CELLS:
+        ray_masks[row, col] = {}
+        for diff_row, diff_col in ACTION_NUM_DIFFS.values():
+            ray = []
+            r, c = row + diff_row, col + diff_col
+            while is_on_pyramid(r, c):
+                ray.append((r, c))
+                r, c = r + diff_row, c + diff_col
+            ray_masks[row, col][diff_row, diff_col] = cells_to_mask(ray)
+    return ray_masks
+
+
+NEIGHBOURS = build_neighbours()  # Valid (action number, resulting block) pairs from each block
+VALID_ACTION_NUMBERS = {cell: tuple(a for a, _ in moves) for cell, moves in NEIGHBOURS.items()}
+ADJACENT_MASKS = {cell: cells_to_mask(c for _, c in moves) for cell, moves in NEIGHBOURS.items()}
+NEIGHBOURHOOD_MASKS = {cell: mask | CELL_BITS[cell] for cell, mask in ADJACENT_MASKS.items()}  # Including itself
+RAY_MASKS = build_ray_masks()  # Blocks along each direction from each block
+
+SURROUNDING_CELLS = build_surrounding_cells()  # (top_left, top_right, bot_left, bot_right) blocks around each block
+SURROUNDING_BITS = {cell: tuple(None if c is None else CELL_BITS[c] for c in surrounding)
+                    for cell, surrounding in SURROUNDING_CELLS.items()}
+SURROUNDING_ADJACENT_MASKS = {cell: tuple(None if c is None else ADJACENT_MASKS[c] for c in surrounding)
+                              for cell, surrounding in SURROUNDING_CELLS.items()}
+SURROUNDING_NEIGHBOURHOOD_MASKS = {cell: tuple(None if c is None else NEIGHBOURHOOD_MASKS[c] for c in surrounding)
+                                   for cell, surrounding in SURROUNDING_CELLS.items()}
+SURROUNDING_RAY_MASKS = {
+    cell: tuple(None if c is None else RAY_MASKS[cell][c[0] - cell[0], c[1] - cell[1]] for c in surrounding)
+    for cell, surrounding in SURROUNDING_CELLS.items()
+}
+NEARBY = {
+    cell: tuple((CELL_BITS[c], ADJACENT_MASKS[c]) for c in (cell,) + surrounding if c is not None)
+    for cell, surrounding in SURROUNDING_CELLS.items()
+}  # (bit, adjacent mask) of each block and the blocks surrounding it
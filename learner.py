@@ -2,8 +2,21 @@ import logging
 import random
 from abc import ABCMeta, abstractmethod
 
+import numpy as np
+
 from actions import action_number_to_name, get_valid_action_numbers_from_state
+from checkpoint import save_checkpoint, load_checkpoint, append_delta, read_deltas, reset_delta_log, \
+    learning_data_exists, save_weights, load_weights
+from features import get_pyramid_features, get_simple_features, get_hashed_features, NUM_PYRAMID_FEATURES, \
+    NUM_SIMPLE_FEATURES
 from pickler import save_to_pickle, load_from_pickle
+from nearest import NearestStateIndex
+from q_store import create_q_store, NUM_ACTION_COLUMNS
+from planning import DynaPlanner
+from replay import ReplayBuffer
+from sweeping import PrioritizedSweeping
+
+HASHED_MEMORY_SIZE = 2 ** 20  # Default number of weights per action of hashed feature learners
 
 
 class Learner:
@@ -27,7 +40,9 @@ class Learner:
 class QLearner(Learner):
     def __init__(self, world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward, exploration,
                  distance_metric, state_repr, initial_q=None, initial_n=None, tag=None,
-                 exploration_function_type='simple'):
+                 exploration_function_type='simple', q_store='dict', q_store_capacity=None, eviction='lru',
+                 q_store_spill=False, checkpoint_format='pickle', replay_size=0, replay_batch=0, sweeping_backups=0,
+                 sweeping_threshold=1e-3, dyna_model_size=0, nearest_radius=0):
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
@@ -35,25 +50,49 @@ class QLearner(Learner):
         self.unexplored_reward = unexplored_reward
         self.exploration = exploration
         self.distance_metric = distance_metric
-        self.Q = initial_q if initial_q is not None else {}
-        self.N = initial_n if initial_n is not None else {}
+        self.store = create_q_store(q_store, q_store_capacity, eviction, q_store_spill)
+        self.checkpoint_format = checkpoint_format
+        self.replay = ReplayBuffer(replay_size) if replay_size > 0 and replay_batch > 0 else None
+        self.replay_batch = replay_batch
+        self.sweeping = None
+        if sweeping_backups > 0:
+            self.sweeping = PrioritizedSweeping(self, sweeping_backups, sweeping_threshold)
+        self.dyna = None
+        if dyna_model_size > 0:
+            self.dyna = DynaPlanner(self, dyna_model_size)
+            world.idle_listeners.append(self.dyna)
+            self.dyna.start()
+        if initial_q is not None or initial_n is not None:
+            self.store.load_dicts(initial_q or {}, initial_n or {})
         self.world = world
         self.state_repr = state_repr
         self.tag = tag
         self.exploration_function_type = exploration_function_type
+        self.changes = None  # (s, a) -> [number of visits, N before the first change], when tracking changes
+        self.select_best_actions = {
+            'optimistic': self.get_best_actions_optimistic,
+            'random': self.get_best_actions_random,
+            'combined': self.get_best_actions_combined
+        }.get(exploration, self.get_best_actions_no_exploration)
+        self.count_visits = exploration == 'combined'
+        self.nearest = None
+        if nearest_radius > 0 and state_repr == 'verbose':
+            self.nearest = NearestStateIndex(nearest_radius)
 
     def get_best_actions(self, s):
-        if self.exploration is 'optimistic':
-            return self.get_best_actions_optimistic(s)
-        elif self.exploration is 'random':
-            return self.get_best_actions_random(s)
-        elif self.exploration is 'combined':
-            return self.get_best_actions_combined(s)
-        else:
-            return self.get_best_actions_no_exploration(s)
+        if self.nearest is not None:
+            self.initialize_from_nearest(s)
+        return self.select_best_actions(s)
 
     def update(self, s, a, s_next, reward):
         self.q_update(s, a, s_next, reward)
+        if self.replay is not None:
+            self.replay.add(s, a, reward, s_next)
+            self.replay_update()
+        if self.sweeping is not None:
+            self.sweeping.update(s, a, s_next, reward)
+        if self.dyna is not None:
+            self.dyna.add(s, a, reward, s_next)
 
     def get_best_actions_random(self, s):
         """
@@ -73,16 +112,7 @@ class QLearner(Learner):
         """
         actions = get_valid_action_numbers_from_state(s, self.state_repr)
         logging.debug('Valid actions: {}'.format([action_number_to_name(a) for a in actions]))
-        max_q = float('-inf')
-        max_actions = []
-        for a in actions:
-            q = self.exploration_function(s, a)
-            if q > max_q:
-                max_q = q
-                max_actions = [a]
-            elif q == max_q:
-                max_actions.append(a)
-        return max_actions
+        return self.store.get_best_actions_optimistic(s, actions, self.unexplored_threshold, self.unexplored_reward)
 
     def get_best_actions_combined(self, s):
         """
@@ -100,87 +130,425 @@ class QLearner(Learner):
         """
         Q-learning update.
         """
-        if self.exploration is 'combined':
-            self.N[s, a] = self.N.get((s, a), 0) + 1
-        old_q = self.get_q(s, a)
-        new_q = old_q + self.alpha * (reward + self.gamma * self.get_max_q(s_next) - old_q)
+        if self.changes is not None:
+            self.record_change((s, a), 1)
+        if self.count_visits:
+            self.store.increment_n(s, a)
+        new_q = self.q_backup(s, a, s_next, reward)
+        self.update_close(a, new_q)
+
+    def q_backup(self, s, a, s_next, reward):
+        """
+        Q-learning backup of a single transition, without visit counting.
+
+        :return: the new Q value
+        """
+        new_q = self.get_q(s, a) + self.alpha * self.td_error(s, a, s_next, reward)
         if new_q == float('inf'):
             logging.info('Infinite Q saved!')
         if new_q == float('-inf'):
             logging.info('-Infinite Q saved!')
-        self.Q[s, a] = new_q
-        self.update_close(a, new_q)
+        self.store.set_q(s, a, new_q)
+        return new_q
+
+    def td_error(self, s, a, s_next, reward):
+        return reward + self.gamma * self.get_max_q(s_next) - self.get_q(s, a)
+
+    def simulated_backup(self, s, a, s_next, reward):
+        """
+        Q-learning backup of a transition which was not just experienced (replayed, or simulated with a model).
+
+        :return: the new Q value
+        """
+        if self.changes is not None:
+            self.record_change((s, a), 0)
+        return self.q_backup(s, a, s_next, reward)
+
+    def replay_update(self):
+        """
+        Apply the Q-learning backups of a batch of transitions sampled from the replay buffer.
+        """
+        for s, a, reward, s_next in zip(*self.replay.sample(self.replay_batch)):
+            self.simulated_backup(s, a, s_next, reward)
 
     def save(self, filename):
         """
-        Save the current learning parameters to a pickle file.
+        Save the current learning parameters to a pickle file, or to a columnar checkpoint, and empty the delta log
+        which they supersede.
         """
-        save_to_pickle(self.Q, '{}_{}'.format(filename, 'Q'))
-        save_to_pickle(self.N, '{}_{}'.format(filename, 'N'))
+        reset_delta_log(filename)
+        if self.checkpoint_format == 'columnar':
+            save_checkpoint(self.store, filename)
+            return
+        Q, N = self.store.to_dicts()
+        save_to_pickle(Q, '{}_{}'.format(filename, 'Q'))
+        save_to_pickle(N, '{}_{}'.format(filename, 'N'))
 
     def load(self, filename):
         """
-        Load learning parameters from a pickle file.
+        Load learning parameters from a pickle file, or from a columnar checkpoint.
+        """
+        if self.checkpoint_format == 'columnar':
+            load_checkpoint(self.store, filename)
+            logging.debug('Loaded {} Q values'.format(len(self.store)))
+            self.index_states()
+            return
+        Q = load_from_pickle('{}_{}'.format(filename, 'Q'))
+        N = load_from_pickle('{}_{}'.format(filename, 'N'))
+        self.store.load_dicts(Q, N)
+        logging.debug('Loaded Q: {}'.format(Q))
+        logging.debug('Loaded N: {}'.format(N))
+        self.index_states()
+
+    def has_learning_data(self, filename):
+        """
+        Check whether learning parameters were saved with the given filename.
+        """
+        return learning_data_exists(filename, self.checkpoint_format)
+
+    def index_states(self):
+        """
+        Index the stored states for the nearest state lookups, if enabled.
+        """
+        if self.nearest is not None:
+            for s in self.store.get_states():
+                self.nearest.add(s)
+
+    def save_changes(self, filename, episode):
+        """
+        Append the Q and N entries changed since the last call to the delta log. Requires track_changes.
+
+        :return: the number of appended entries
+        """
+        entries = {key: (q, self.store.get_n(*key)) for key, (q, visits, n_increase) in self.pop_changes().items()}
+        append_delta(filename, episode, entries)
+        return len(entries)
+
+    def compact(self, filename, episode):
+        """
+        Save the current learning parameters, replacing the delta log with the given episode.
+        """
+        self.save(filename)
+        reset_delta_log(filename, episode)
+
+    def load_changes(self, filename):
         """
-        self.Q = load_from_pickle('{}_{}'.format(filename, 'Q'))
-        self.N = load_from_pickle('{}_{}'.format(filename, 'N'))
-        logging.debug('Loaded Q: {}'.format(self.Q))
-        logging.debug('Loaded N: {}'.format(self.N))
+        Apply the deltas of the delta log on top of the loaded learning parameters.
+
+        :return: the episode of the last delta, or 0 if the log is empty
+        """
+        episode = 0
+        for episode, entries in read_deltas(filename):
+            self.apply_entries(entries)
+        return episode
 
     def get_best_single_action(self, s):
-        if self.exploration is 'optimistic':
-            actions = self.get_best_actions_optimistic(s)
-        elif self.exploration is 'random':
-            actions = self.get_best_actions_random(s)
-        elif self.exploration is 'combined':
-            actions = self.get_best_actions_combined(s)
-        else:
-            actions = self.get_best_actions_no_exploration(s)
-        return random.choice(actions)
+        if self.nearest is not None:
+            self.initialize_from_nearest(s)
+        return random.choice(self.select_best_actions(s))
+
+    def initialize_from_nearest(self, s):
+        """
+        Initialize the Q values of a state never seen before to the mean Q values of the nearest visited states within
+        the Hamming radius, and index the state as visited.
+        """
+        if s in self.nearest:
+            return
+        if s not in self.store:
+            nearest_states = self.nearest.get_nearest(s)
+            if nearest_states:
+                logging.debug('Initializing Q from {} nearest states'.format(len(nearest_states)))
+                for a in get_valid_action_numbers_from_state(s, self.state_repr):
+                    q = sum(self.store.get_q(s_near, a) for s_near in nearest_states) / float(len(nearest_states))
+                    self.store.set_q(s, a, q)
+                    if self.changes is not None:
+                        self.record_change((s, a), 0)
+        self.nearest.add(s)
 
     def get_q(self, s, a):
-        return self.Q.get((s, a), 0)
+        return self.store.get_q(s, a)
 
     def get_best_actions_no_exploration(self, s):
         actions = get_valid_action_numbers_from_state(s, self.state_repr)
-        max_q = float('-inf')
-        max_actions = []
-        for a in actions:
-            q = self.get_q(s, a)
-            if q > max_q:
-                max_q = q
-                max_actions = [a]
-            elif q == max_q:
-                max_actions.append(a)
-        return max_actions
+        return self.store.get_best_actions(s, actions)
 
     def exploration_function(self, s, a):
-        if self.exploration_function_type is 'simple':
+        if self.exploration_function_type == 'simple':
             return self.exploration_function_simple(s, a)
         else:
             return None
 
     def exploration_function_simple(self, s, a):
-        return self.unexplored_reward if self.N.get((s, a), 0) < self.unexplored_threshold else self.get_q(s, a)
+        return self.unexplored_reward if self.store.get_n(s, a) < self.unexplored_threshold else self.get_q(s, a)
 
     def get_best_action(self, s, actions):
-        best_action = None
-        max_q = float('-inf')
-        for a in actions:
-            q = self.get_q(s, a)
-            if q > max_q:
-                max_q = q
-                best_action = a
-        return best_action
+        return self.store.get_best_action(s, actions)
 
     def get_max_q(self, s):
-        max_q = float('-inf')
-        for a in get_valid_action_numbers_from_state(s):
-            max_q = max(max_q, self.Q.get((s, a), 0))
-        return max_q if max_q != float('-inf') else 0
+        return self.store.get_max_q(s, get_valid_action_numbers_from_state(s, self.state_repr))
 
     def update_close(self, a, new_q):
+        if self.distance_metric is None:
+            return
         states_close, actions_close = self.world.get_close_states_actions(a, distance_metric=self.distance_metric)
-        for s_close, a_close in zip(states_close, actions_close):
-            self.Q[s_close, a_close] = new_q
+        if self.changes is not None:
+            for key in zip(states_close, actions_close):
+                self.record_change(key, 0)
+        self.store.set_q_many(states_close, actions_close, new_q)
+
+    def q_size(self):
+        return len(self.store)
+
+    def num_states(self):
+        return self.store.num_states()
+
+    def num_evictions(self):
+        return self.store.num_evictions
+
+    def track_changes(self):
+        """
+        Start keeping track of the Q entries changed since the last call to pop_changes.
+        """
+        self.changes = {}
+
+    def record_change(self, key, visits):
+        change = self.changes.get(key)
+        if change is None:
+            self.changes[key] = [visits, self.store.get_n(*key)]
+        else:
+            change[0] += visits
+
+    def pop_changes(self):
+        """
+        Get the Q entries changed since the last call, and stop reporting them.
+
+        :return: a dict from (s, a) to (Q value, number of visits, increase of N) of every changed entry
+        """
+        changes = {key: (self.store.get_q(*key), visits, self.store.get_n(*key) - initial_n)
+                   for key, (visits, initial_n) in self.changes.items()}
+        self.changes = {}
+        return changes
+
+    def apply_entries(self, entries):
+        """
+        Overwrite Q and N entries, e.g. with the ones of a merged Q-table.
+
+        :param entries: a dict from (s, a) to (Q value, N value)
+        """
+        for (s, a), (q, n) in entries.items():
+            self.store.set_q(s, a, q)
+            if n > 0:
+                self.store.set_n(s, a, n)
+
+
+class FeatureQLearner(Learner):
+    """
+    Q-learner approximating Q(s, a) as the sum of the weights of the active binary features of s for action a, with
+    one row of weights per action number. The memory used is fixed, whatever the number of visited states.
+
+    There are no visit counts, so the optimistic prior of the 'optimistic' and 'combined' exploration modes does not
+    apply: 'random' and 'combined' are epsilon-greedy, 'optimistic' is greedy. The delta logs hold no entries, as
+    saving changes saves all of the weights.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, world, alpha, gamma, epsilon, exploration, state_repr, num_features, tag=None,
+                 checkpoint_format='pickle', dtype=np.float64):
+        self.world = world
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.exploration = exploration
+        self.state_repr = state_repr
+        self.tag = tag
+        self.checkpoint_format = checkpoint_format
+        self.weights = np.zeros((NUM_ACTION_COLUMNS, num_features), dtype=dtype)
+        self.dyna = None  # No planning thread
+        self.explore = exploration in ('random', 'combined')
+        self.last_state = None
+        self.last_features = None
+
+    @abstractmethod
+    def compute_features(self, s):
+        """
+        Get the indices of the active features of the given state, without duplicates.
+        """
+        raise NotImplementedError
+
+    def get_features(self, s):
+        """
+        Get the indices of the active features of the given state, remembering the last state, which is usually
+        looked up again: as s_next by the update, then by the next action selection.
+        """
+        if s != self.last_state:
+            self.last_features = np.array(self.compute_features(s), dtype=np.intp)
+            self.last_state = s
+        return self.last_features
+
+    def get_q_values(self, s):
+        """
+        Get the Q values of every action number from the given state.
+        """
+        return self.weights[:, self.get_features(s)].sum(axis=1)
+
+    def get_q(self, s, a):
+        return self.weights[a, self.get_features(s)].sum()
+
+    def get_best_actions(self, s):
+        actions = get_valid_action_numbers_from_state(s, self.state_repr)
+        if self.explore and random.random() < self.epsilon:
+            action = random.choice(actions)
+            logging.debug('Randomly chose {}'.format(action_number_to_name(action)))
+            return [action]
+        return self.get_best_actions_no_exploration(s, actions)
+
+    def get_best_actions_no_exploration(self, s, actions):
+        q_values = self.get_q_values(s).tolist()
+        max_q = max(q_values[a] for a in actions)
+        return [a for a in actions if q_values[a] == max_q]
+
+    def get_best_single_action(self, s):
+        return random.choice(self.get_best_actions(s))
+
+    def get_best_action(self, s, actions):
+        q_values = self.get_q_values(s).tolist()
+        return max(actions, key=lambda a: q_values[a])
+
+    def get_max_q(self, s):
+        actions = get_valid_action_numbers_from_state(s, self.state_repr)
+        if not actions:
+            return 0
+        q_values = self.get_q_values(s).tolist()
+        return max(q_values[a] for a in actions)
+
+    def update(self, s, a, s_next, reward):
+        """
+        Gradient TD update of the weights of the active features, with the learning rate divided by their number so
+        that the Q value moves by alpha times the TD error, as in a Q-table.
+        """
+        features = self.get_features(s)
+        td_error = reward + self.gamma * self.get_max_q(s_next) - self.weights[a, features].sum()
+        self.weights[a, features] += self.alpha * td_error / len(features)
+
+    def q_size(self):
+        return self.weights.size
+
+    def num_states(self):
+        return None  # States are not stored
+
+    def num_evictions(self):
+        return 0
+
+    def save(self, filename):
+        """
+        Save the weights to a pickle file, or to a columnar checkpoint, and empty the delta log.
+        """
+        reset_delta_log(filename)
+        if self.checkpoint_format == 'columnar':
+            save_weights(self.weights, filename)
+            return
+        save_to_pickle(self.weights, '{}_{}'.format(filename, 'W'))
+
+    def load(self, filename):
+        """
+        Load the weights from a pickle file, or from a columnar checkpoint.
+        """
+        if self.checkpoint_format == 'columnar':
+            weights = load_weights(filename)
+        else:
+            weights = load_from_pickle('{}_{}'.format(filename, 'W'))
+        if weights.shape != self.weights.shape:
+            raise ValueError('Expected weights of shape {}, got {}'.format(self.weights.shape, weights.shape))
+        self.weights = weights
+
+    def has_learning_data(self, filename):
+        return learning_data_exists(filename, self.checkpoint_format, column='weights.npy', pickle_suffix='W')
+
+    def track_changes(self):
+        pass
+
+    def save_changes(self, filename, episode):
+        """
+        Save the weights, as they are small and every update changes many of them.
+
+        :return: the number of appended delta log entries, always 0
+        """
+        self.compact(filename, episode)
+        return 0
+
+    def compact(self, filename, episode):
+        """
+        Save the weights, replacing the delta log with the given episode.
+        """
+        self.save(filename)
+        reset_delta_log(filename, episode)
+
+    def load_changes(self, filename):
+        """
+        :return: the episode of the last delta, or 0 if the log is empty
+        """
+        episode = 0
+        for episode, _ in read_deltas(filename):
+            pass
+        return episode
+
+
+class LinearQLearner(FeatureQLearner):
+    """
+    Linear Q-learner over the pyramid features of verbose states (see features.get_pyramid_features), or the one-hot
+    values of simple states.
+    """
+    def __init__(self, world, alpha, gamma, epsilon, exploration, state_repr, tag=None, checkpoint_format='pickle'):
+        if state_repr == 'verbose':
+            self.feature_function = get_pyramid_features
+            num_features = NUM_PYRAMID_FEATURES
+        else:
+            self.feature_function = get_simple_features
+            num_features = NUM_SIMPLE_FEATURES
+        FeatureQLearner.__init__(self, world, alpha, gamma, epsilon, exploration, state_repr, num_features, tag=tag,
+                                 checkpoint_format=checkpoint_format)
+
+    def compute_features(self, s):
+        return self.feature_function(s)
+
+
+class HashedQLearner(FeatureQLearner):
+    """
+    Linear Q-learner over the hashed components of the states of any encoder (see features.get_hashed_features), with
+    a fixed number of float32 weights per action. The hash of the whole state is a feature, so the learner behaves like
+    a Q-table until collisions start sharing weights, while the other components generalize across states.
+
+    The components are hashed from a canonical encoding rather than with the built-in hash, so saved weights load in
+    any run, Python version and platform.
+    """
+    def __init__(self, world, alpha, gamma, epsilon, exploration, state_repr, tag=None, checkpoint_format='pickle',
+                 memory_size=HASHED_MEMORY_SIZE):
+        FeatureQLearner.__init__(self, world, alpha, gamma, epsilon, exploration, state_repr, memory_size, tag=tag,
+                                 checkpoint_format=checkpoint_format, dtype=np.float32)
+        self.memory_size = memory_size
+
+    def compute_features(self, s):
+        return get_hashed_features(s, self.state_repr, self.memory_size)
+
+
+def create_learner(world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward, exploration,
+                   distance_metric, state_repr, role=None, learner_type='tabular', learner_types=None,
+                   hashed_memory_size=HASHED_MEMORY_SIZE, tag=None, **options):
+    """
+    Create a learner of the given type: 'tabular' for a QLearner, 'linear' for a LinearQLearner, 'hashed' for a
+    HashedQLearner. Options other than the checkpoint format only apply to Q-tables, so feature learners ignore them.
 
+    :param role: the role of the learner in its agent ('block', 'enemy' or 'friendly'), if any
+    :param learner_types: a dict from role to the learner type of that role, overriding learner_type
+    :param hashed_memory_size: the number of weights per action of a HashedQLearner
+    """
+    learner_type = (learner_types or {}).get(role) or learner_type
+    checkpoint_format = options.get('checkpoint_format', 'pickle')
+    if learner_type == 'linear':
+        return LinearQLearner(world, alpha, gamma, epsilon, exploration, state_repr, tag=tag,
+                              checkpoint_format=checkpoint_format)
+    if learner_type == 'hashed':
+        return HashedQLearner(world, alpha, gamma, epsilon, exploration, state_repr, tag=tag,
+                              checkpoint_format=checkpoint_format, memory_size=hashed_memory_size)
+    return QLearner(world, alpha, gamma, epsilon, unexplored_threshold, unexplored_reward, exploration,
+                    distance_metric, state_repr, tag=tag, **options)
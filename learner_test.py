@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from agent import QbertAgent
+from fake_ale import FakeALE
+
+VERBOSE_AGENT_TYPES = ['block', 'enemy', 'friendly', 'subsumption', 'combined_verbose']
+
+
+def play(agent, num_actions=300):
+    world = agent.world
+    world.reset()
+    for _ in range(num_actions):
+        agent.action()
+        if world.ale.game_over():
+            world.reset_game()
+            world.reset()
+
+
+@pytest.mark.parametrize('agent_type,state_representation',
+                         [(agent_type, 'verbose') for agent_type in VERBOSE_AGENT_TYPES] + [('subsumption', 'simple')])
+def test_prioritized_sweeping(agent_type, state_representation):
+    random.seed(0)
+    agent = QbertAgent(agent_type=agent_type, state_representation=state_representation, display_screen=False,
+                       sound=False, ale=FakeALE(), sweeping_backups=4)
+    play(agent)
+    learners = agent.get_learners().values()
+    assert all(len(learner.sweeping.model) > 0 for learner in learners)
+    if agent_type != 'enemy':  # The fake emulator never rewards the enemy agent, so there is no priority to sweep
+        assert sum(learner.sweeping.num_sweeps for learner in learners) > 0
+
+
+
+@pytest.mark.parametrize('state_encoding', ['tuple', 'bitboard'])
+@pytest.mark.parametrize('agent_type', VERBOSE_AGENT_TYPES)
+def test_nearest_state_initialization(agent_type, state_encoding):
+    random.seed(0)
+    agent = QbertAgent(agent_type=agent_type, state_representation='verbose', state_encoding=state_encoding,
+                       display_screen=False, sound=False, ale=FakeALE(), nearest_radius=2)
+    play(agent)
+    for learner in agent.get_learners().values():
+        assert len(learner.nearest) > 0
+        assert all(s in learner.nearest for s in learner.store.get_states())
@@ -3,6 +3,9 @@ import logging
 from argparse import ArgumentParser
 from agent import QbertAgent
 from csv_utils import save_to_csv
+from learner import HASHED_MEMORY_SIZE
+
+LEARNER_TYPES = ['tabular', 'linear', 'hashed']
 
 LOGGING_LEVELS = {
     'info': logging.INFO,
@@ -13,28 +16,143 @@ LOGGING_LEVELS = {
 }
 
 
+def check_memory_ceiling(memory_ceiling, q_store, nearest_radius, replay_size, dyna_model_size, sweeping_backups):
+    """
+    Check that the memory ceiling, if set, can bound the memory used: it lowers the capacity of the 'bounded' Q stores,
+    so none of the options keeping the evicted states in memory may be enabled.
+
+    :raise ValueError: if the memory ceiling cannot be used with the given options
+    """
+    if memory_ceiling is None:
+        return
+    if q_store != 'bounded':
+        raise ValueError("The memory ceiling requires the 'bounded' Q store")
+    state_holding_options = [option for option, value in (
+        ('nearest_radius', nearest_radius),
+        ('replay_size', replay_size),
+        ('dyna_model_size', dyna_model_size),
+        ('sweeping_backups', sweeping_backups)) if value > 0]
+    if state_holding_options:
+        raise ValueError('The memory ceiling cannot be used with {}: the states evicted from the Q stores would stay '
+                         'in memory'.format(', '.join(state_holding_options)))
+
+
 def play_learning_agent(num_episodes=2, show_image=False, load_learning_filename=None,
                         save_learning_filename=None, plot_filename=None, csv_filename=None, display_screen=False,
                         state_representation='simple', agent_type='subsumption', exploration=None,
-                        distance_metric=None, random_seed=123):
+                        distance_metric=None, random_seed=123, state_encoding='tuple', perception='rgb',
+                        q_store='dict', q_store_capacity=None, eviction='lru', q_store_spill=False,
+                        memory_ceiling=None, checkpoint_format='pickle', checkpoint_interval=None, resume=False,
+                        reset_mode='emulator', start_level=1, planning_depth=0, planning_budget=0.05,
+                        replay_size=0, replay_batch=0, sweeping_backups=0, dyna_model_size=0, nearest_radius=0,
+                        learner_type='tabular', block_learner_type=None, enemy_learner_type=None,
+                        friendly_learner_type=None, hashed_memory_size=HASHED_MEMORY_SIZE, telemetry_filename=None,
+                        telemetry_sample_interval=None, trace_directory=None, ale=None):
     """
     Let the learning agent play with the specified parameters.
+
+    :param q_store_capacity: the maximum number of states in memory of every 'bounded' Q store (None for no maximum)
+    :param eviction: the eviction policy of the 'bounded' Q stores: 'lru' or 'visits'
+    :param q_store_spill: whether the 'bounded' Q stores spill evicted states to temporary databases, instead of
+                          dropping them
+    :param memory_ceiling: if set, the resident memory in megabytes above which the capacity of the 'bounded' Q stores
+                           is lowered. It is a soft ceiling, only checked at the end of each episode, and it requires
+                           the nearest state index, replay, Dyna-Q and prioritized sweeping to be disabled, as they
+                           keep the evicted states in memory
+
+    :param checkpoint_interval: if set, the number of episodes between two appends of the changed learning data to
+                                the delta logs of save_learning_filename
+    :param resume: whether to resume from the learning data and delta logs of save_learning_filename, if saved
+    :param start_level: with the 'snapshot' reset mode, the level to start episodes at once it was reached
+    :param planning_depth: if positive, the number of decisions simulated ahead by the subsumption agent when an enemy
+                           is nearby
+    :param planning_budget: the time budget of the simulations of a decision, in seconds
+    :param replay_size: the number of transitions kept in the replay buffer of every learner (0 to disable replay)
+    :param replay_batch: the number of transitions replayed after every action
+    :param sweeping_backups: the maximum number of prioritized sweeping backups after every action (0 to disable
+                             prioritized sweeping)
+    :param dyna_model_size: the number of transitions kept in the model of the Dyna-Q planning thread of every learner
+                            (0 to disable Dyna-Q planning)
+    :param nearest_radius: if positive, the Hamming radius within which the Q values of new verbose states are
+                           initialized from the nearest visited states
+    :param learner_type: the type of the learners: 'tabular' Q-tables, 'linear' function approximation over binary
+                         state features, or 'hashed' function approximation over hashed state components
+    :param block_learner_type: if set, the type of the block learner, overriding learner_type (and likewise for
+                               enemy_learner_type and friendly_learner_type)
+    :param hashed_memory_size: the number of weights per action of every hashed learner
+    :param telemetry_filename: if set, the JSON lines file to stream the timings and statistics of every episode to
+    :param telemetry_sample_interval: if set, the number of actions between two actions whose duration and frames
+                                      are also streamed to the telemetry file
+    :param trace_directory: if set, the directory to record a trace of the emulator frames to, for replay by ReplayALE
+    :param ale: the emulator to play with, e.g. a FakeALE or a ReplayALE (None for the ALE)
     """
+    check_memory_ceiling(memory_ceiling, q_store, nearest_radius, replay_size, dyna_model_size, sweeping_backups)
     logging.info('Plot filename: {}'.format(plot_filename))
     logging.info('Agent type: {}'.format(agent_type))
     logging.info('Distance metric: {}'.format(distance_metric))
     logging.info('Exploration: {}'.format(exploration))
+    logging.info('State encoding: {}'.format(state_encoding))
+    logging.info('Perception: {}'.format(perception))
+    logging.info('Q store: {}'.format(q_store))
+    if q_store == 'bounded':
+        logging.info('Q store capacity: {} states, {} eviction, {}'.format(
+            q_store_capacity, eviction, 'spilled to disk' if q_store_spill else 'dropped'))
+        logging.info('Memory ceiling: {} MB'.format(memory_ceiling))
+    logging.info('Checkpoint format: {}'.format(checkpoint_format))
+    logging.info('Checkpoint interval: {}'.format(checkpoint_interval))
+    logging.info('Reset mode: {}'.format(reset_mode))
+    logging.info('Start level: {}'.format(start_level))
+    logging.info('Planning depth: {}'.format(planning_depth))
+    logging.info('Replay: {} transitions, {} per action'.format(replay_size, replay_batch))
+    logging.info('Prioritized sweeping backups: {}'.format(sweeping_backups))
+    logging.info('Dyna-Q model size: {}'.format(dyna_model_size))
+    logging.info('Nearest state radius: {}'.format(nearest_radius))
+    logging.info('Learner types: {} (block: {}, enemy: {}, friendly: {})'.format(
+        learner_type, block_learner_type, enemy_learner_type, friendly_learner_type))
+    logging.info('Hashed memory size: {}'.format(hashed_memory_size))
+    logging.info('Trace directory: {}'.format(trace_directory))
     agent = QbertAgent(display_screen=display_screen, state_representation=state_representation, agent_type=agent_type,
-                       exploration=exploration, distance_metric=distance_metric, random_seed=random_seed)
+                       exploration=exploration, distance_metric=distance_metric, random_seed=random_seed,
+                       state_encoding=state_encoding, perception=perception, q_store=q_store,
+                       q_store_capacity=q_store_capacity, eviction=eviction, q_store_spill=q_store_spill,
+                       checkpoint_format=checkpoint_format, reset_mode=reset_mode, planning_depth=planning_depth,
+                       planning_budget=planning_budget, replay_size=replay_size, replay_batch=replay_batch,
+                       sweeping_backups=sweeping_backups, dyna_model_size=dyna_model_size,
+                       nearest_radius=nearest_radius, learner_type=learner_type,
+                       block_learner_type=block_learner_type, enemy_learner_type=enemy_learner_type,
+                       friendly_learner_type=friendly_learner_type, hashed_memory_size=hashed_memory_size,
+                       trace_directory=trace_directory, ale=ale)
     world = agent.world
+    ceiling = None
+    if memory_ceiling is not None:
+        from memory import MemoryCeiling, MEGABYTE
+        from q_store import BoundedQStore
+        stores = [learner.store for learner in agent.get_learners().values()
+                  if isinstance(getattr(learner, 'store', None), BoundedQStore)]
+        ceiling = MemoryCeiling(stores, memory_ceiling * MEGABYTE)
     max_score = 0
     max_level = 1
     scores = []
-    if load_learning_filename is not None:
+    first_episode = 0
+    if resume and save_learning_filename is not None and has_learning_data(agent, save_learning_filename):
+        agent.load(save_learning_filename)
+        first_episode = agent.load_changes(save_learning_filename)
+        logging.info('Resumed {} after episode {}'.format(save_learning_filename, first_episode))
+    elif load_learning_filename is not None:
         agent.load(load_learning_filename)
-    for episode in range(num_episodes):
+    telemetry = None
+    if telemetry_filename is not None:
+        from telemetry import Telemetry
+        telemetry = Telemetry(agent, telemetry_filename, telemetry_sample_interval)
+    checkpointing = checkpoint_interval is not None and save_learning_filename is not None
+    if checkpointing:
+        for learner in agent.get_learners().values():
+            learner.track_changes()
+        agent.compact(save_learning_filename, first_episode)
+        num_logged_entries = 0
+    for episode in range(first_episode, num_episodes):
         total_reward = 0
-        world.reset()
+        world.reset(start_level)
         while not world.ale.game_over():
             total_reward += agent.action()
         if show_image:
@@ -45,17 +163,50 @@ def play_learning_agent(num_episodes=2, show_image=False, load_learning_filename
         logging.info('Episode {} ended with score: {}'.format(episode + 1, total_reward))
         max_score = max(max_score, total_reward)
         max_level = max(max_level, agent.world.level)
-        world.ale.reset_game()
+        if telemetry is not None:
+            telemetry.record_episode(episode + 1, total_reward, agent.world.level)
+        world.reset_game()
+        if ceiling is not None:
+            ceiling.check()
+        if checkpointing and (episode + 1) % checkpoint_interval == 0:
+            num_logged_entries += agent.save_changes(save_learning_filename, episode + 1)
+            if num_logged_entries > agent.q_size():
+                agent.compact(save_learning_filename, episode + 1)
+                num_logged_entries = 0
+    if telemetry is not None:
+        telemetry.close()
+    if world.trace is not None:
+        world.trace.close()
+    agent.close()
     if csv_filename is not None:
         save_to_csv(scores, csv_filename)
     if plot_filename is not None:
         from plotter import plot_scores
         plot_scores(scores, plot_filename)
-    if save_learning_filename is not None:
+    if checkpointing:
+        agent.compact(save_learning_filename, num_episodes)
+    elif save_learning_filename is not None:
         agent.save(save_learning_filename)
     logging.info('Maximum reward: {}'.format(max_score))
     logging.info('Maximum level: {}'.format(max_level))
     logging.info('Total Q size: {}'.format(agent.q_size()))
+    for name, learner in agent.get_learners().items():
+        if learner.num_evictions() > 0:
+            logging.info('Evicted states ({}): {}'.format(name, learner.num_evictions()))
+        if learner.dyna is not None:
+            logging.info('Planning updates ({}): {} ({:.0f} per second)'.format(name, learner.dyna.num_updates,
+                                                                               learner.dyna.get_updates_per_second()))
+    num_actions, mean_frames, max_frames = world.transitions.get_frame_stats()
+    logging.info('Frames per action: {:.1f} on average, {} at most ({} actions)'.format(mean_frames, max_frames,
+                                                                                      num_actions))
+
+
+def has_learning_data(agent, filename):
+    """
+    Check whether the learning data of every learner of the agent was saved with the given filename.
+    """
+    return all(learner.has_learning_data(learner_filename)
+               for learner_filename, learner in agent.get_learner_filenames(filename).items())
 
 
 def setup_logging(level):
@@ -101,9 +252,134 @@ def parse_command_line_arguments():
                         help='The random seed to use.')
     parser.add_argument('-i', '--show_image', default=False, type=bool,
                         help='Whether to show a screenshot at the end of every episode.')
+    parser.add_argument('-b', '--state_encoding', default='tuple', choices=['tuple', 'bitboard'],
+                        help='The encoding of verbose states: nested tuples or integer bitboards.')
+    parser.add_argument('-g', '--perception', default='rgb', choices=['rgb', 'ram'],
+                        help='The perception backend: parse the RGB screen or decode the RAM.')
+    parser.add_argument('-q', '--q_store', default='dict', choices=['dict', 'array', 'bounded'],
+                        help='The Q-table storage: dicts keyed on (state, action), arrays indexed by interned state, '
+                             'or dicts evicting states beyond a capacity.')
+    parser.add_argument('--q_store_capacity', default=None, type=int,
+                        help="The maximum number of states in memory of every 'bounded' Q store.")
+    parser.add_argument('--eviction', default='lru', choices=['lru', 'visits'],
+                        help="Which states the 'bounded' Q stores evict: the least recently used, or the least "
+                             "visited.")
+    parser.add_argument('--q_store_spill', action='store_true',
+                        help="Spill the states evicted by the 'bounded' Q stores to temporary databases, instead of "
+                             "dropping them.")
+    parser.add_argument('--memory_ceiling', default=None, type=float,
+                        help="The resident memory in megabytes above which the capacity of the 'bounded' Q stores is "
+                             "lowered. The ceiling is soft: it is only checked at the end of each episode, so the "
+                             "memory may exceed it during an episode. Not compatible with the options keeping states "
+                             "outside of the Q stores (--nearest_radius, --replay_size, --dyna_model_size and "
+                             "--sweeping_backups).")
+    parser.add_argument('-k', '--checkpoint_format', default='pickle', choices=['pickle', 'columnar'],
+                        help='The format of the learning data files: Q and N pickles, or columnar checkpoints loaded '
+                             'with memory mapping (see checkpoint.py).')
+    parser.add_argument('-t', '--checkpoint_interval', default=None, type=int,
+                        help='The number of episodes between two appends of the changed learning data to the delta '
+                             'logs of the save learning file.')
+    parser.add_argument('-u', '--resume', action='store_true',
+                        help='Resume from the save learning file and its delta logs, if they exist.')
+    parser.add_argument('-j', '--reset_mode', default='emulator', choices=['emulator', 'snapshot'],
+                        help='How episodes start: reset the emulator and wait for the intro, or restore a snapshot of '
+                             'the start of a level.')
+    parser.add_argument('-v', '--start_level', default=1, type=int,
+                        help="The level to start episodes at with the 'snapshot' reset mode, once it was reached.")
+    parser.add_argument('-n', '--planning_depth', default=0, type=int,
+                        help='The number of decisions simulated ahead by the subsumption agent when an enemy is nearby '
+                             '(0 to disable planning).')
+    parser.add_argument('-z', '--planning_budget', default=0.05, type=float,
+                        help='The time budget of the simulations of a decision, in seconds.')
+    parser.add_argument('--replay_size', default=0, type=int,
+                        help='The number of transitions kept in the replay buffer of every learner (0 to disable '
+                             'replay).')
+    parser.add_argument('--replay_batch', default=0, type=int,
+                        help='The number of transitions replayed after every action.')
+    parser.add_argument('--sweeping_backups', default=0, type=int,
+                        help='The maximum number of prioritized sweeping backups after every action (0 to disable '
+                             'prioritized sweeping).')
+    parser.add_argument('--dyna_model_size', default=0, type=int,
+                        help='The number of transitions kept in the model of the Dyna-Q planning thread of every '
+                             'learner (0 to disable Dyna-Q planning).')
+    parser.add_argument('--nearest_radius', default=0, type=int,
+                        help='The Hamming radius within which the Q values of new verbose states are initialized from '
+                             'the nearest visited states (0 to disable).')
+    parser.add_argument('--learner_type', default='tabular', choices=LEARNER_TYPES,
+                        help='The type of the learners: Q-tables, or linear function approximation with a fixed memory '
+                             'over binary state features or hashed state components. The Q-table options only apply '
+                             'to tabular learners.')
+    parser.add_argument('--block_learner_type', default=None, choices=LEARNER_TYPES,
+                        help='The type of the block learner, overriding the learner type.')
+    parser.add_argument('--enemy_learner_type', default=None, choices=LEARNER_TYPES,
+                        help='The type of the enemy learner, overriding the learner type.')
+    parser.add_argument('--friendly_learner_type', default=None, choices=LEARNER_TYPES,
+                        help='The type of the friendly learner, overriding the learner type.')
+    parser.add_argument('--hashed_memory_size', default=HASHED_MEMORY_SIZE, type=int,
+                        help='The number of weights per action of every hashed learner.')
+    parser.add_argument('--telemetry_filename', default=None,
+                        help='The JSON lines file to stream the timings and statistics of every episode to.')
+    parser.add_argument('--telemetry_sample_interval', default=None, type=int,
+                        help='The number of actions between two actions whose duration and frames are also streamed '
+                             'to the telemetry file.')
+    parser.add_argument('--trace_directory', default=None,
+                        help='The directory to record a trace of the emulator frames, RAM and rewards to.')
+    parser.add_argument('-w', '--num_workers', default=1, type=int,
+                        help='The number of worker processes playing episodes in parallel with a merged Q-table.')
+    parser.add_argument('-y', '--sync_interval', default=10, type=int,
+                        help='The number of episodes played by each worker between two Q-table merges.')
 
     args = parser.parse_args()
+    try:
+        check_memory_ceiling(args.memory_ceiling, args.q_store, args.nearest_radius, args.replay_size,
+                             args.dyna_model_size, args.sweeping_backups)
+    except ValueError as e:
+        parser.error(str(e))
     setup_logging(args.logging_level)
+    if args.num_workers > 1:
+        if any(learner_type not in (None, 'tabular') for learner_type in (
+                args.learner_type, args.block_learner_type, args.enemy_learner_type, args.friendly_learner_type)):
+            parser.error('Parallel workers only merge tabular learners')
+        single_process_options = [option for option, value in (
+            ('--memory_ceiling', args.memory_ceiling is not None),
+            ('--checkpoint_interval', args.checkpoint_interval is not None),
+            ('--resume', args.resume),
+            ('--telemetry_filename', args.telemetry_filename is not None),
+            ('--trace_directory', args.trace_directory is not None),
+            ('--start_level', args.start_level != 1),
+            ('--display_screen', args.display_screen),
+            ('--show_image', args.show_image)) if value]
+        if single_process_options:
+            parser.error('{} cannot be used with parallel workers'.format(', '.join(single_process_options)))
+        from parallel import play_parallel_learning_agent
+        play_parallel_learning_agent(num_workers=args.num_workers,
+                                     num_episodes=args.num_episodes,
+                                     sync_interval=args.sync_interval,
+                                     load_learning_filename=args.load_learning_filename,
+                                     save_learning_filename=args.save_learning_filename,
+                                     plot_filename=args.plot_filename,
+                                     csv_filename=args.csv_filename,
+                                     random_seed=args.random_seed,
+                                     state_representation=args.state_representation,
+                                     agent_type=args.agent_type,
+                                     exploration=args.exploration,
+                                     distance_metric=args.distance_metric,
+                                     state_encoding=args.state_encoding,
+                                     perception=args.perception,
+                                     q_store=args.q_store,
+                                     q_store_capacity=args.q_store_capacity,
+                                     eviction=args.eviction,
+                                     q_store_spill=args.q_store_spill,
+                                     checkpoint_format=args.checkpoint_format,
+                                     reset_mode=args.reset_mode,
+                                     planning_depth=args.planning_depth,
+                                     planning_budget=args.planning_budget,
+                                     replay_size=args.replay_size,
+                                     replay_batch=args.replay_batch,
+                                     sweeping_backups=args.sweeping_backups,
+                                     dyna_model_size=args.dyna_model_size,
+                                     nearest_radius=args.nearest_radius)
+        return
     play_learning_agent(num_episodes=args.num_episodes,
                         load_learning_filename=args.load_learning_filename,
                         save_learning_filename=args.save_learning_filename,
@@ -115,7 +391,34 @@ def parse_command_line_arguments():
                         exploration=args.exploration,
                         distance_metric=args.distance_metric,
                         random_seed=args.random_seed,
-                        show_image=args.show_image)
+                        show_image=args.show_image,
+                        state_encoding=args.state_encoding,
+                        perception=args.perception,
+                        q_store=args.q_store,
+                        q_store_capacity=args.q_store_capacity,
+                        eviction=args.eviction,
+                        q_store_spill=args.q_store_spill,
+                        memory_ceiling=args.memory_ceiling,
+                        checkpoint_format=args.checkpoint_format,
+                        checkpoint_interval=args.checkpoint_interval,
+                        resume=args.resume,
+                        reset_mode=args.reset_mode,
+                        start_level=args.start_level,
+                        planning_depth=args.planning_depth,
+                        planning_budget=args.planning_budget,
+                        replay_size=args.replay_size,
+                        replay_batch=args.replay_batch,
+                        sweeping_backups=args.sweeping_backups,
+                        dyna_model_size=args.dyna_model_size,
+                        nearest_radius=args.nearest_radius,
+                        learner_type=args.learner_type,
+                        block_learner_type=args.block_learner_type,
+                        enemy_learner_type=args.enemy_learner_type,
+                        friendly_learner_type=args.friendly_learner_type,
+                        hashed_memory_size=args.hashed_memory_size,
+                        telemetry_filename=args.telemetry_filename,
+                        telemetry_sample_interval=args.telemetry_sample_interval,
+                        trace_directory=args.trace_directory)
 
 
 if __name__ == '__main__':
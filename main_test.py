@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from agent import QbertAgent
+from checkpoint import read_deltas
+from fake_ale import FakeALE
+from main import play_learning_agent
+
+EPISODE_LENGTH = 40
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('pickle')
+
+
+def load_q_size(filename, checkpoint_format, q_store):
+    agent = QbertAgent(display_screen=False, sound=False, checkpoint_format=checkpoint_format, q_store=q_store,
+                       ale=FakeALE(episode_length=EPISODE_LENGTH))
+    agent.load(filename)
+    agent.load_changes(filename)
+    return agent.q_size()
+
+
+def play(num_episodes, checkpoint_format, q_store, **options):
+    play_learning_agent(num_episodes=num_episodes, save_learning_filename='data', checkpoint_format=checkpoint_format,
+                        q_store=q_store, ale=FakeALE(episode_length=EPISODE_LENGTH), **options)
+
+
+@pytest.mark.parametrize('checkpoint_format,q_store', [('columnar', 'array'), ('columnar', 'dict'),
+                                                       ('pickle', 'dict')])
+def test_resume_twice(checkpoint_format, q_store):
+    play(2, checkpoint_format, q_store, checkpoint_interval=1, resume=True)
+    first_q_size = load_q_size('data', checkpoint_format, q_store)
+    play(4, checkpoint_format, q_store, checkpoint_interval=1, resume=True)
+    play(6, checkpoint_format, q_store, checkpoint_interval=1, resume=True)
+    assert load_q_size('data', checkpoint_format, q_store) >= first_q_size > 0
+    assert [episode for episode, _ in read_deltas('data_block')] == [6]
+
+
+def test_load_and_save_same_columnar_checkpoint():
+    play(1, 'columnar', 'array')
+    first_q_size = load_q_size('data', 'columnar', 'array')
+    play(1, 'columnar', 'array', load_learning_filename='data')
+    play(1, 'columnar', 'array', load_learning_filename='data', checkpoint_interval=1)
+    assert load_q_size('data', 'columnar', 'array') >= first_q_size > 0
+
+
+@pytest.mark.parametrize('option', ['nearest_radius', 'replay_size', 'dyna_model_size', 'sweeping_backups'])
+def test_memory_ceiling_with_state_holding_option(option):
+    with pytest.raises(ValueError):
+        play_learning_agent(num_episodes=1, q_store='bounded', memory_ceiling=100, ale=FakeALE(), **{option: 10})
@@ -0,0 +1,60 @@
+import logging
+import os
+import sys
+
+MEGABYTE = 1024 * 1024
+
+
+def get_resident_memory():
+    """
+    Get the resident memory of the process, in bytes: its current value on Linux, else its peak value.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, kilobytes elsewhere
+
+
+class MemoryCeiling:
+    """
+    Keeps the resident memory of the process under a soft ceiling by capping the bounded Q stores of an agent: once the
+    ceiling is exceeded when checked, their capacity is lowered to a fraction of the states they hold in memory, so that
+    new states replace evicted ones instead of adding to them. Evicted states are only released if nothing else refers
+    to them.
+
+    The Python allocator usually keeps freed memory for reuse rather than returning it to the system, so the resident
+    memory may not drop after an eviction. The capacity is only lowered again if it kept growing since, by more than a
+    tolerance.
+    """
+    def __init__(self, stores, ceiling, fraction=0.9, tolerance=0.02):
+        """
+        :param stores: the BoundedQStores to cap
+        :param ceiling: the maximum resident memory, in bytes
+        :param fraction: the fraction of the states in memory kept by each store when the ceiling is exceeded
+        :param tolerance: the growth of the resident memory since the capacity was last lowered, as a fraction of the
+                          ceiling, above which it is lowered again
+        """
+        self.stores = stores
+        self.ceiling = ceiling
+        self.fraction = fraction
+        self.tolerance = tolerance
+        self.capped_memory = 0  # Resident memory when the capacity was last lowered
+
+    def check(self):
+        """
+        Lower the capacity of the stores if the resident memory exceeds the ceiling and grew since it was last lowered.
+
+        :return: whether the capacity was lowered
+        """
+        resident_memory = get_resident_memory()
+        if resident_memory <= max(self.ceiling, self.capped_memory + self.tolerance * self.ceiling):
+            return False
+        for store in self.stores:
+            store.set_capacity(int(store.num_states_in_memory() * self.fraction))
+        self.capped_memory = resident_memory
+        logging.info('Resident memory of {:.0f} MB above the ceiling, capped Q stores to {} states'.format(
+            resident_memory / float(MEGABYTE), [store.capacity for store in self.stores]))
+        return True
@@ -0,0 +1,119 @@
+from bitboard import popcount
+from tuple_utils import flatten_tuples
+
+COMPONENT_BITS = 21  # Bits per packed grid, enough for a pyramid of blocks and for the discs
+MAX_STATE_BITS = 4 * COMPONENT_BITS  # Block colors, enemies, friendlies and discs of combined verbose states
+
+
+def pack_component(component):
+    """
+    Packs a grid of a verbose state into an integer, with the bits of a bitboard (a nested tuple grid is flattened in
+    row-major order, which is the bit order of the bitboards).
+    """
+    if isinstance(component, tuple):
+        bits = 0
+        for i, value in enumerate(flatten_tuples(component)):
+            if value:
+                bits |= 1 << i
+        return bits
+    return component
+
+
+def pack_state(s):
+    """
+    Splits a verbose state, in either encoding, into Qbert's position and the concatenated bits of its grids.
+    """
+    bits = 0
+    for i, component in enumerate(s[1:]):
+        bits |= pack_component(component) << (i * COMPONENT_BITS)
+    return s[0], bits
+
+
+class HammingIndex:
+    """
+    Multi-index hashing of bit strings, to find the bit strings within a Hamming distance of a query.
+
+    The bits are split into radius + 1 interleaved substrings, each with a hash table. Two bit strings within the
+    radius differ in at most radius substrings, so they share at least one substring exactly, and the candidates are
+    found with one lookup per table before being checked.
+    """
+    def __init__(self, radius, num_bits=MAX_STATE_BITS):
+        num_tables = radius + 1
+        self.radius = radius
+        self.masks = [sum(1 << i for i in range(j, num_bits, num_tables)) for j in range(num_tables)]
+        self.tables = [{} for _ in range(num_tables)]  # Substring -> ids of the bit strings
+        self.bit_strings = []
+
+    def add(self, bits):
+        """
+        Add a bit string.
+
+        :return: the id of the bit string
+        """
+        i = len(self.bit_strings)
+        self.bit_strings.append(bits)
+        for mask, table in zip(self.masks, self.tables):
+            table.setdefault(bits & mask, []).append(i)
+        return i
+
+    def query(self, bits):
+        """
+        Get the bit strings within the radius of the given one.
+
+        :return: a list of (Hamming distance, id) pairs
+        """
+        candidates = set()
+        for mask, table in zip(self.masks, self.tables):
+            candidates.update(table.get(bits & mask, ()))
+        bit_strings = self.bit_strings
+        radius = self.radius
+        return [(d, i) for d, i in ((popcount(bits ^ bit_strings[i]), i) for i in candidates) if d <= radius]
+
+    def __len__(self):
+        return len(self.bit_strings)
+
+
+class NearestStateIndex:
+    """
+    Index of verbose states answering which indexed states with the same position of Qbert are the nearest within a
+    Hamming distance of the grids (colors, enemies, friendlies and discs) of a state.
+    """
+    def __init__(self, radius):
+        self.radius = radius
+        self.indexes = {}  # Position -> (HammingIndex of the states at that position, states by id)
+        self.indexed = set()
+
+    def add(self, s):
+        """
+        Index a state, unless it already is.
+        """
+        if s in self.indexed:
+            return
+        self.indexed.add(s)
+        position, bits = pack_state(s)
+        entry = self.indexes.get(position)
+        if entry is None:
+            entry = self.indexes[position] = HammingIndex(self.radius), []
+        entry[0].add(bits)
+        entry[1].append(s)
+
+    def get_nearest(self, s):
+        """
+        Get the indexed states within the radius of the given state which are the nearest to it.
+        """
+        position, bits = pack_state(s)
+        entry = self.indexes.get(position)
+        if entry is None:
+            return []
+        index, states = entry
+        matches = index.query(bits)
+        if not matches:
+            return []
+        min_distance = min(d for d, _ in matches)
+        return [states[i] for d, i in matches if d == min_distance]
+
+    def __contains__(self, s):
+        return s in self.indexed
+
+    def __len__(self):
+        return len(self.indexed)
@@ -0,0 +1,176 @@
+import logging
+import multiprocessing
+from multiprocessing.queues import Empty
+
+from agent import QbertAgent, LEARNER_NAMES, get_learner_filenames
+from csv_utils import save_to_csv
+from learner import QLearner
+
+POLL_INTERVAL = 5  # Seconds between two checks that the workers are alive while waiting for their messages
+
+
+class QTableMerger:
+    """
+    Coordinator-side Q-tables, merging the changes reported by the workers by visit-count weighting.
+    """
+    def __init__(self, learners, num_workers):
+        tables = {name: learner.store.to_dicts() for name, learner in learners.items()}
+        self.Q = {name: dict(Q) for name, (Q, N) in tables.items()}
+        self.N = {name: dict(N) for name, (Q, N) in tables.items()}
+        self.visits = {name: dict(N) for name, (Q, N) in tables.items()}
+        self.pending = [{name: set() for name in learners} for _ in range(num_workers)]
+
+    def merge(self, worker, changes):
+        """
+        Merge the changes of a worker into the Q-tables.
+
+        :param worker: the index of the worker
+        :param changes: a dict from learner name to the changes returned by QLearner.pop_changes
+        :return: a dict from learner name to the (Q value, N value) of every entry changed since the last merge of the
+                 worker, to be applied with QLearner.apply_entries
+        """
+        for name, learner_changes in changes.items():
+            Q, N, visits = self.Q[name], self.N[name], self.visits[name]
+            for key, (q, num_visits, n_increase) in learner_changes.items():
+                old_visits = visits.get(key, 0)
+                if key in Q and old_visits + num_visits > 0:
+                    Q[key] = (old_visits * Q[key] + num_visits * q) / float(old_visits + num_visits)
+                else:
+                    Q[key] = q
+                visits[key] = old_visits + num_visits
+                if n_increase > 0:
+                    N[key] = N.get(key, 0) + n_increase
+            for pending in self.pending:
+                pending[name].update(learner_changes)
+        entries = {}
+        for name, keys in self.pending[worker].items():
+            Q, N = self.Q[name], self.N[name]
+            entries[name] = {key: (Q[key], N.get(key, 0)) for key in keys}
+            keys.clear()
+        return entries
+
+
+def run_worker(worker, random_seed, num_episodes, sync_interval, load_learning_filename, agent_options,
+               to_coordinator, from_coordinator):
+    """
+    Worker process loop, playing episodes and periodically synchronizing its Q-tables with the coordinator.
+    """
+    agent = QbertAgent(display_screen=False, random_seed=random_seed, **agent_options)
+    if load_learning_filename is not None:
+        agent.load(load_learning_filename)
+    learners = agent.get_learners()
+    for learner in learners.values():
+        learner.track_changes()
+    world = agent.world
+    for episode in range(num_episodes):
+        total_reward = 0
+        world.reset()
+        while not world.ale.game_over():
+            total_reward += agent.action()
+        to_coordinator.put(('score', worker, (total_reward, world.level)))
+        world.reset_game()
+        if (episode + 1) % sync_interval == 0 or episode == num_episodes - 1:
+            to_coordinator.put(('sync', worker, {name: learner.pop_changes() for name, learner in learners.items()}))
+            for name, entries in from_coordinator.get().items():
+                learners[name].apply_entries(entries)
+    agent.close()
+    to_coordinator.put(('done', worker, None))
+
+
+def create_merged_learners(agent_type, checkpoint_format):
+    """
+    Create the coordinator-side learners of an agent type, which only load and save the merged Q-tables, so they need
+    no world (and no emulator).
+
+    :return: a dict from learner name to QLearner
+    """
+    return {name: QLearner(None, alpha=0, gamma=0, epsilon=0, unexplored_threshold=0, unexplored_reward=0,
+                           exploration=None, distance_metric=None, state_repr=None,
+                           checkpoint_format=checkpoint_format)
+            for name in LEARNER_NAMES[agent_type]}
+
+
+def check_workers(processes, done):
+    """
+    Check that the workers which are not done are still running, terminating every worker if one of them died, as the
+    others would then wait for a merge of its Q-table forever.
+
+    :param processes: the worker processes
+    :param done: the indices of the workers which are done
+    :raise RuntimeError: if a worker died
+    """
+    for worker, process in enumerate(processes):
+        if worker not in done and not process.is_alive():
+            for other in processes:
+                if other.is_alive():
+                    other.terminate()
+            raise RuntimeError('Worker {} died with exit code {}'.format(worker, process.exitcode))
+
+
+def play_parallel_learning_agent(num_workers=2, num_episodes=2, sync_interval=10, load_learning_filename=None,
+                                 save_learning_filename=None, plot_filename=None, csv_filename=None,
+                                 random_seed=123, **agent_options):
+    """
+    Let learning agents play in parallel worker processes with distinct random seeds, sharing a merged Q-table.
+
+    :param num_workers: the number of worker processes
+    :param num_episodes: the total number of episodes, split evenly among the workers
+    :param sync_interval: the number of episodes played by a worker between two synchronizations of its Q-table
+    :param agent_options: the keyword arguments of every worker's QbertAgent
+    """
+    logging.info('Workers: {}'.format(num_workers))
+    logging.info('Sync interval: {}'.format(sync_interval))
+    learners = create_merged_learners(agent_options.get('agent_type', 'subsumption'),
+                                      agent_options.get('checkpoint_format', 'pickle'))
+    if load_learning_filename is not None:
+        for learner_filename, learner in get_learner_filenames(learners, load_learning_filename).items():
+            learner.load(learner_filename)
+    merger = QTableMerger(learners, num_workers)
+
+    to_coordinator = multiprocessing.Queue()
+    from_coordinator = [multiprocessing.Queue() for _ in range(num_workers)]
+    processes = []
+    for worker in range(num_workers):
+        worker_episodes = num_episodes // num_workers + (1 if worker < num_episodes % num_workers else 0)
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(worker, random_seed + worker, worker_episodes, sync_interval,
+                                                 load_learning_filename, agent_options, to_coordinator,
+                                                 from_coordinator[worker]))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+
+    scores = []
+    max_level = 1
+    done = set()
+    while len(done) < num_workers:
+        try:
+            message, worker, data = to_coordinator.get(timeout=POLL_INTERVAL)
+        except Empty:
+            check_workers(processes, done)
+            continue
+        if message == 'score':
+            total_reward, level = data
+            scores.append(total_reward)
+            max_level = max(max_level, level)
+            logging.info('Episode {} (worker {}) ended with score: {}'.format(len(scores), worker, total_reward))
+        elif message == 'sync':
+            from_coordinator[worker].put(merger.merge(worker, data))
+        elif message == 'done':
+            done.add(worker)
+    for process in processes:
+        process.join()
+
+    for name, learner in learners.items():
+        learner.apply_entries({key: (q, merger.N[name].get(key, 0)) for key, q in merger.Q[name].items()})
+    if csv_filename is not None:
+        save_to_csv(scores, csv_filename)
+    if plot_filename is not None:
+        from plotter import plot_scores
+        plot_scores(scores, plot_filename)
+    if save_learning_filename is not None:
+        for learner_filename, learner in get_learner_filenames(learners, save_learning_filename).items():
+            learner.save(learner_filename)
+    logging.info('Maximum reward: {}'.format(max(scores) if scores else 0))
+    logging.info('Maximum level: {}'.format(max_level))
+    logging.info('Total Q size: {}'.format(sum(learner.q_size() for learner in learners.values())))
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+import parallel
+from agent import get_learner_filenames
+from fake_ale import FakeALE
+from parallel import QTableMerger, play_parallel_learning_agent, create_merged_learners
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('pickle')
+
+
+S = (0, 1, 0, 1)
+T = (1, 1, None, None)
+
+
+def create_merger(num_workers=2):
+    learners = create_merged_learners('block', 'pickle')
+    learners['block'].apply_entries({(T, 2): (2.0, 2)})
+    return QTableMerger(learners, num_workers)
+
+
+def test_merge_weights_by_visits():
+    merger = create_merger()
+    assert merger.merge(0, {'block': {(S, 3): (1.0, 3, 3)}}) == {'block': {(S, 3): (1.0, 3)}}
+    assert merger.merge(1, {'block': {(S, 3): (3.0, 1, 1), (T, 2): (5.0, 2, 2)}}) == \
+        {'block': {(S, 3): (1.5, 4), (T, 2): (3.5, 4)}}
+    assert merger.merge(0, {'block': {}}) == {'block': {(S, 3): (1.5, 4), (T, 2): (3.5, 4)}}  # Changed by worker 1
+    assert merger.merge(0, {'block': {}}) == {'block': {}}
+
+
+def test_merge_unvisited_changes():
+    merger = create_merger()
+    merger.merge(0, {'block': {(S, 3): (1.0, 0, 0)}})
+    assert merger.Q['block'][S, 3] == 1.0  # A new entry, e.g. set by a backup to a close state
+    merger.merge(1, {'block': {(S, 3): (4.0, 0, 0), (T, 2): (6.0, 0, 0)}})
+    assert merger.Q['block'][S, 3] == 4.0  # Still never visited
+    assert merger.Q['block'][T, 2] == 2.0  # Outweighed by the visits of the loaded entry
+    assert merger.N['block'] == {(T, 2): 2}
+
+
+def test_parallel_workers():
+    play_parallel_learning_agent(num_workers=2, num_episodes=4, sync_interval=1, save_learning_filename='data',
+                                 sound=False, ale=FakeALE(episode_length=40))
+    learners = create_merged_learners('subsumption', 'pickle')
+    for learner_filename, learner in get_learner_filenames(learners, 'data').items():
+        learner.load(learner_filename)
+    assert sum(learner.q_size() for learner in learners.values()) > 0
+
+
+def test_dead_worker(monkeypatch):
+    monkeypatch.setattr(parallel, 'POLL_INTERVAL', 0.1)
+    with pytest.raises(RuntimeError):
+        play_parallel_learning_agent(num_workers=2, num_episodes=4, sync_interval=1, sound=False,
+                                     ale=FakeALE(episode_length=40), q_store='missing')
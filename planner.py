@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from geometry import NEIGHBOURS, MOVE_ACTION_NUMBERS
+from transition import TransitionEngine
+
+
+class LookaheadPlanner:
+    """
+    Ranks Qbert's actions by survival, by simulating every sequence of moves up to a given depth from a clone of the
+    emulator state, including the jumps off the pyramid onto discs.
+
+    The sequences starting with each move are simulated by a pool of threads, each with its own emulator created by
+    the world's emulator factory (the ALE releases the GIL while emulating), within a time budget per decision.
+    """
+    def __init__(self, world, depth=2, time_budget=0.05, num_threads=len(MOVE_ACTION_NUMBERS)):
+        if world.emulator_factory is None:
+            raise ValueError('Planning requires an emulator factory to simulate actions from the world\'s emulator')
+        self.world = world
+        self.depth = depth
+        self.time_budget = time_budget
+        self.frame_skip = world.ale.getInt('frame_skip')
+        self.local = threading.local()
+        self.pool = ThreadPool(num_threads)
+        self.num_decisions = 0
+        self.num_timeouts = 0
+
+    def get_emulator(self):
+        """
+        Get the emulator and transition engine of the current thread, creating them on first use.
+        """
+        transitions = getattr(self.local, 'transitions', None)
+        if transitions is None:
+            ale = self.world.emulator_factory(self.frame_skip)
+            transitions = self.local.transitions = TransitionEngine(ale, np.zeros(ale.getRAMSize(), dtype=np.uint8),
+                                                                    self.frame_skip)
+        return transitions
+
+    def simulate(self, state, cell, a, depth, deadline):
+        """
+        Simulate every sequence of moves of the given depth starting with action a.
+
+        :param state: the emulator state to start from
+        :param cell: the (row, col) of Qbert in that state
+        :return: the number of surviving and of simulated sequences, or None if the deadline passed
+        """
+        if time.time() > deadline:
+            return None
+        transitions = self.get_emulator()
+        ale = transitions.ale
+        ale.restoreState(state)
+        num_lives = ale.lives()
+        transitions.perform_action(a)
+        if ale.lives() < num_lives:
+            return 0, 1
+        next_cell = dict(NEIGHBOURS[cell]).get(a)
+        if depth == 1 or next_cell is None:  # Off the pyramid without losing a life (on a disc)
+            return 1, 1
+        next_state = ale.cloneState()
+        num_survived = 0
+        num_simulated = 0
+        for next_a in MOVE_ACTION_NUMBERS:
+            result = self.simulate(next_state, next_cell, next_a, depth - 1, deadline)
+            if result is None:
+                return None
+            num_survived += result[0]
+            num_simulated += result[1]
+        return num_survived, num_simulated
+
+    def rank_actions(self):
+        """
+        Simulate the moves from the current state of the world.
+
+        :return: a dict from the action numbers simulated within the time budget to their survival rate
+        """
+        self.num_decisions += 1
+        deadline = time.time() + self.time_budget
+        state = self.world.ale.cloneState()
+        cell = self.world.current_row, self.world.current_col
+        results = [(a, self.pool.apply_async(self.simulate, (state, cell, a, self.depth, deadline)))
+                   for a in MOVE_ACTION_NUMBERS]
+        survival_rates = {}
+        for a, result in results:
+            try:
+                counts = result.get(max(0, deadline - time.time()))
+            except TimeoutError:
+                counts = None
+            if counts is None:
+                self.num_timeouts += 1
+            else:
+                survival_rates[a] = counts[0] / float(counts[1])
+        logging.debug('Survival rates: {}'.format(survival_rates))
+        return survival_rates
+
+    def filter_actions(self, candidates):
+        """
+        Keep the candidate actions with the highest survival rate, along with the ones which could not be simulated in
+        time, or the actions with the highest survival rate if there are none.
+        """
+        survival_rates = self.rank_actions()
+        if not survival_rates:
+            return candidates
+        max_rate = max(survival_rates.values())
+        safest = [a for a, rate in survival_rates.items() if rate == max_rate]
+        return [a for a in candidates if a in safest or a not in survival_rates] or safest
+
+    def close(self):
+        self.pool.terminate()
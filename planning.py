@@ -0,0 +1,65 @@
+import threading
+import time
+
+from replay import ReplayBuffer
+
+
+class DynaPlanner(threading.Thread):
+    """
+    Dyna-Q planning thread for a QLearner, applying backups of transitions sampled from a bounded model of the last
+    real transitions while the world waits on the emulator. The model is a ReplayBuffer, so it only holds the states of
+    the transitions it keeps.
+
+    The world resumes the planner when it starts waiting on the emulator and pauses it when it is done. The planner
+    holds its lock while applying a batch of backups, and pause waits for the current batch, so the Q store is only
+    written by one thread at a time without being copied.
+    """
+    def __init__(self, learner, model_size, batch_size=8):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.learner = learner
+        self.model = ReplayBuffer(model_size)
+        self.batch_size = batch_size
+        self.idle = threading.Event()  # Set while the world waits on the emulator
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.num_updates = 0
+        self.idle_time = 0.0  # Total time during which planning was allowed, in seconds
+        self.idle_start = None
+
+    def add(self, s, a, reward, s_next):
+        """
+        Add a real transition to the model. Must not be called while the planner is resumed.
+        """
+        self.model.add(s, a, reward, s_next)
+
+    def resume(self):
+        self.idle_start = time.time()
+        self.idle.set()
+
+    def pause(self):
+        self.idle.clear()
+        with self.lock:
+            pass
+        self.idle_time += time.time() - self.idle_start
+
+    def stop(self):
+        self.stopped = True
+        self.idle.set()
+
+    def run(self):
+        while not self.stopped:
+            self.idle.wait()
+            with self.lock:
+                planning = self.idle.is_set() and not self.stopped and len(self.model) > 0
+                if planning:
+                    for s, a, reward, s_next in zip(*self.model.sample(self.batch_size)):
+                        self.learner.simulated_backup(s, a, s_next, reward)
+                    self.num_updates += self.batch_size
+            time.sleep(0 if planning else 0.001)  # Let the main thread take the GIL back between batches
+
+    def get_updates_per_second(self):
+        """
+        Get the number of planning updates per second of emulator wait.
+        """
+        return self.num_updates / self.idle_time if self.idle_time > 0 else 0
@@ -0,0 +1,667 @@
+import heapq
+import pickle
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from itertools import islice
+
+import numpy as np
+
+from bitboard import popcount
+
+NUM_ACTION_COLUMNS = 6  # Action numbers 0 (noop) to 5 (down)
+
+
+class QStore:
+    """
+    Storage of the Q values and visit counts N of (state, action) pairs. Missing entries have Q = 0 and N = 0.
+    """
+    __metaclass__ = ABCMeta
+
+    num_evictions = 0  # Number of states evicted to bound the memory used, by bounded stores only
+
+    @abstractmethod
+    def get_q(self, s, a):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_q(self, s, a, q):
+        raise NotImplementedError
+
+    def set_q_many(self, states, actions, q):
+        """
+        Set the Q value of every (state, action) pair of the given states and actions to q.
+        """
+        for s, a in zip(states, actions):
+            self.set_q(s, a, q)
+
+    @abstractmethod
+    def get_n(self, s, a):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_n(self, s, a, n):
+        raise NotImplementedError
+
+    @abstractmethod
+    def increment_n(self, s, a):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_best_actions(self, s, actions):
+        """
+        Get the actions with the maximum Q value in the given state.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_best_actions_optimistic(self, s, actions, unexplored_threshold, unexplored_reward):
+        """
+        Get the actions with the maximum Q value in the given state, where the Q value of the actions visited less than
+        unexplored_threshold times is replaced by unexplored_reward.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_best_action(self, s, actions):
+        """
+        Get the first action with the maximum Q value in the given state.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_max_q(self, s, actions):
+        """
+        Get the maximum Q value of the given actions in the given state (0 if there are no actions).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self):
+        """
+        Get the number of stored Q values.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def num_states(self):
+        """
+        Get the number of states with a stored Q value or visit count.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_states(self):
+        """
+        Get the states with a stored Q value or visit count.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def __contains__(self, s):
+        """
+        Check whether the given state has a stored Q value or visit count.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def to_dicts(self):
+        """
+        Get the stored Q values and visit counts as dicts from (s, a) to Q and N.
+        """
+        raise NotImplementedError
+
+    def load_dicts(self, Q, N):
+        """
+        Replace the stored Q values and visit counts with dicts from (s, a) to Q and N.
+        """
+        self.clear()
+        for (s, a), q in Q.items():
+            self.set_q(s, a, q)
+        for (s, a), n in N.items():
+            self.set_n(s, a, n)
+
+    @abstractmethod
+    def to_arrays(self):
+        """
+        Get the stored Q values and visit counts as one row per state.
+
+        :return: the list of states, and the (num_states, NUM_ACTION_COLUMNS) arrays of Q values, visit counts and
+                 flags of the stored Q values
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_arrays(self, states, q, n, stored):
+        """
+        Replace the stored Q values and visit counts with the rows returned by to_arrays.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+
+class StateRecord(object):
+    """
+    Q values and visit counts of every action in a single state, indexed by action number.
+    """
+    __slots__ = ('q', 'n', 'stored')
+
+    def __init__(self):
+        self.q = [0] * NUM_ACTION_COLUMNS
+        self.n = [0] * NUM_ACTION_COLUMNS
+        self.stored = 0  # Bit mask of the actions with a stored Q value
+
+
+class DictQStore(QStore):
+    """
+    Q store keyed on states, with one StateRecord per state so that selecting an action takes a single lookup.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.records = {}
+        self.num_entries = 0
+
+    def get_record(self, s):
+        """
+        Get the record of the given state, adding an empty one if the state was never seen.
+        """
+        record = self.records.get(s)
+        if record is None:
+            record = self.records[s] = StateRecord()
+        return record
+
+    def get_q(self, s, a):
+        record = self.records.get(s)
+        return record.q[a] if record is not None else 0
+
+    def set_q(self, s, a, q):
+        record = self.get_record(s)
+        if not record.stored & (1 << a):
+            record.stored |= 1 << a
+            self.num_entries += 1
+        record.q[a] = q
+
+    def set_q_many(self, states, actions, q):
+        records = self.records
+        for s, a in zip(states, actions):
+            record = records.get(s)
+            if record is None:
+                record = records[s] = StateRecord()
+            if not record.stored & (1 << a):
+                record.stored |= 1 << a
+                self.num_entries += 1
+            record.q[a] = q
+
+    def get_n(self, s, a):
+        record = self.records.get(s)
+        return record.n[a] if record is not None else 0
+
+    def set_n(self, s, a, n):
+        self.get_record(s).n[a] = n
+
+    def increment_n(self, s, a):
+        self.get_record(s).n[a] += 1
+
+    def get_best_actions(self, s, actions):
+        record = self.records.get(s)
+        if record is None or not actions:
+            return list(actions)
+        q = record.q
+        max_q = max([q[a] for a in actions])
+        return [a for a in actions if q[a] == max_q]
+
+    def get_best_actions_optimistic(self, s, actions, unexplored_threshold, unexplored_reward):
+        record = self.records.get(s)
+        if record is None or not actions:
+            return list(actions)
+        q, n = record.q, record.n
+        values = [unexplored_reward if n[a] < unexplored_threshold else q[a] for a in actions]
+        max_q = max(values)
+        return [a for a, value in zip(actions, values) if value == max_q]
+
+    def get_best_action(self, s, actions):
+        if not actions:
+            return None
+        record = self.records.get(s)
+        if record is None:
+            return actions[0]
+        return max(actions, key=record.q.__getitem__)
+
+    def get_max_q(self, s, actions):
+        record = self.records.get(s)
+        if record is None or not actions:
+            return 0
+        q = record.q
+        return max([q[a] for a in actions])
+
+    def __len__(self):
+        return self.num_entries
+
+    def num_states(self):
+        return len(self.records)
+
+    def get_states(self):
+        return list(self.records)
+
+    def __contains__(self, s):
+        return s in self.records
+
+    def iter_records(self):
+        """
+        Iterate over the (state, StateRecord) pairs of every stored state.
+        """
+        return iter(self.records.items())
+
+    def to_dicts(self):
+        Q = {}
+        N = {}
+        for s, record in self.iter_records():
+            for a in range(NUM_ACTION_COLUMNS):
+                if record.stored & (1 << a):
+                    Q[s, a] = record.q[a]
+                if record.n[a] != 0:
+                    N[s, a] = record.n[a]
+        return Q, N
+
+    def to_arrays(self):
+        items = list(self.iter_records())
+        states = [s for s, _ in items]
+        records = [record for _, record in items]
+        q = np.array([record.q for record in records], dtype=np.float64).reshape(-1, NUM_ACTION_COLUMNS)
+        n = np.array([record.n for record in records], dtype=np.int64).reshape(-1, NUM_ACTION_COLUMNS)
+        stored_masks = np.array([record.stored for record in records], dtype=np.int64)
+        stored = (stored_masks[:, np.newaxis] >> np.arange(NUM_ACTION_COLUMNS)) & 1 == 1
+        return states, q, n, stored
+
+    def load_arrays(self, states, q, n, stored):
+        self.clear()
+        stored_masks = np.dot(stored, 1 << np.arange(NUM_ACTION_COLUMNS)).tolist()
+        for s, q_row, n_row, stored_mask in zip(states, q.tolist(), n.tolist(), stored_masks):
+            record = self.records[s] = StateRecord()
+            record.q = q_row
+            record.n = n_row
+            record.stored = stored_mask
+        self.num_entries = int(np.count_nonzero(stored))
+
+
+class StateInterner:
+    """
+    Assigns a unique integer id to every distinct state, in order of first appearance.
+    """
+    def __init__(self, states=()):
+        self.states = list(states)
+        self.ids = dict(zip(self.states, range(len(self.states))))
+
+    def intern(self, s):
+        """
+        Get the id of the given state, assigning a new one if the state was never seen.
+        """
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.states)
+            self.ids[s] = i
+            self.states.append(s)
+        return i
+
+    def lookup(self, s):
+        """
+        Get the id of the given state, or -1 if the state was never seen.
+        """
+        return self.ids.get(s, -1)
+
+    def __len__(self):
+        return len(self.states)
+
+
+class ArrayQStore(QStore):
+    """
+    Q store which interns every state to an integer id and keeps Q and N in contiguous (num_states, num_actions)
+    arrays, grown as needed.
+    """
+    def __init__(self, initial_capacity=1024, num_actions=NUM_ACTION_COLUMNS):
+        self.initial_capacity = initial_capacity
+        self.num_actions = num_actions
+        self.clear()
+
+    def clear(self):
+        self.interner = StateInterner()
+        self.q = np.zeros((self.initial_capacity, self.num_actions), dtype=np.float64)
+        self.n = np.zeros((self.initial_capacity, self.num_actions), dtype=np.int64)
+        self.present = np.zeros((self.initial_capacity, self.num_actions), dtype=bool)  # Q value stored or not
+        self.num_entries = 0
+
+    def intern(self, s):
+        """
+        Get the row of the given state, adding one (and growing the arrays) if the state was never seen.
+        """
+        i = self.interner.intern(s)
+        if i >= len(self.q):
+            self.grow(max(2 * len(self.q), self.initial_capacity))
+        return i
+
+    def grow(self, capacity):
+        q = np.zeros((capacity, self.num_actions), dtype=self.q.dtype)
+        n = np.zeros((capacity, self.num_actions), dtype=self.n.dtype)
+        present = np.zeros((capacity, self.num_actions), dtype=bool)
+        q[:len(self.q)] = self.q
+        n[:len(self.n)] = self.n
+        present[:len(self.present)] = self.present
+        self.q, self.n, self.present = q, n, present
+
+    def get_q(self, s, a):
+        i = self.interner.lookup(s)
+        return self.q[i, a] if i >= 0 else 0
+
+    def set_q(self, s, a, q):
+        i = self.intern(s)
+        if not self.present[i, a]:
+            self.present[i, a] = True
+            self.num_entries += 1
+        self.q[i, a] = q
+
+    def set_q_many(self, states, actions, q):
+        rows = [self.intern(s) for s in states]
+        present = self.present
+        for i, a in set(zip(rows, actions)):
+            if not present[i, a]:
+                present[i, a] = True
+                self.num_entries += 1
+        self.q[rows, actions] = q
+
+    def get_n(self, s, a):
+        i = self.interner.lookup(s)
+        return self.n[i, a] if i >= 0 else 0
+
+    def set_n(self, s, a, n):
+        self.n[self.intern(s), a] = n
+
+    def increment_n(self, s, a):
+        self.n[self.intern(s), a] += 1
+
+    def get_best_actions(self, s, actions):
+        i = self.interner.lookup(s)
+        if i < 0:
+            return list(actions)
+        actions = np.asarray(actions)
+        row = self.q[i, actions]
+        return actions[row == row.max()].tolist()
+
+    def get_best_actions_optimistic(self, s, actions, unexplored_threshold, unexplored_reward):
+        i = self.interner.lookup(s)
+        if i < 0:
+            return list(actions)
+        actions = np.asarray(actions)
+        row = np.where(self.n[i, actions] < unexplored_threshold, unexplored_reward, self.q[i, actions])
+        return actions[row == row.max()].tolist()
+
+    def get_best_action(self, s, actions):
+        i = self.interner.lookup(s)
+        if len(actions) == 0:
+            return None
+        if i < 0:
+            return actions[0]
+        return actions[int(np.argmax(self.q[i, np.asarray(actions)]))]
+
+    def get_max_q(self, s, actions):
+        i = self.interner.lookup(s)
+        if i < 0 or len(actions) == 0:
+            return 0
+        return self.q[i, np.asarray(actions)].max()
+
+    def __len__(self):
+        return self.num_entries
+
+    def num_states(self):
+        return len(self.interner)
+
+    def get_states(self):
+        return list(self.interner.states)
+
+    def __contains__(self, s):
+        return self.interner.lookup(s) >= 0
+
+    def to_dicts(self):
+        Q = {}
+        N = {}
+        states = self.interner.states
+        for i, a in zip(*np.nonzero(self.present[:len(states)])):
+            Q[states[i], int(a)] = float(self.q[i, a])
+        for i, a in zip(*np.nonzero(self.n[:len(states)])):
+            N[states[i], int(a)] = int(self.n[i, a])
+        return Q, N
+
+    def to_arrays(self):
+        num_states = len(self.interner)
+        return list(self.interner.states), self.q[:num_states], self.n[:num_states], self.present[:num_states]
+
+    def load_arrays(self, states, q, n, stored):
+        """
+        Adopt the given arrays without copying them, so that a memory-mapped checkpoint is only read (and copied) as
+        its rows are accessed. The arrays are copied to memory when a new state is added.
+        """
+        self.interner = StateInterner(states)
+        self.q, self.n, self.present = q, n, stored
+        self.num_entries = int(np.count_nonzero(stored))
+
+
+EVICTION_BATCH = 0.05  # Fraction of the capacity evicted at once when full, so that eviction is amortized
+EVICTION_POLICIES = ('lru', 'visits')
+
+
+class SpillStore:
+    """
+    Records evicted from a BoundedQStore, in a private temporary SQLite database which is deleted when closed (in
+    SQLite's temporary directory, set by the TMPDIR environment variable). States are keyed on their repr, which is
+    canonical for the tuples of integers and None of every state representation, unlike their pickle.
+    """
+    def __init__(self):
+        import sqlite3
+        # The store is used by one thread at a time, but not always the same one (see planning.DynaPlanner)
+        self.connection = sqlite3.connect('', check_same_thread=False)
+        self.connection.execute('CREATE TABLE records (key TEXT PRIMARY KEY, record BLOB, num_entries INTEGER)')
+        self.num_states = 0
+        self.num_entries = 0
+
+    def add(self, items):
+        """
+        Add (state, StateRecord) pairs of states which are not in the spill store.
+        """
+        rows = [(repr(s), pickle.dumps((s, record.q, record.n, record.stored), protocol=pickle.HIGHEST_PROTOCOL),
+                 popcount(record.stored)) for s, record in items]
+        self.connection.executemany('INSERT INTO records VALUES (?, ?, ?)', rows)
+        self.num_states += len(rows)
+        self.num_entries += sum(row[2] for row in rows)
+
+    def pop(self, s):
+        """
+        Remove the record of the given state.
+
+        :return: the record, or None if the state is not in the spill store
+        """
+        if self.num_states == 0:
+            return None
+        key = repr(s)
+        row = self.connection.execute('SELECT record, num_entries FROM records WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('DELETE FROM records WHERE key = ?', (key,))
+        self.num_states -= 1
+        self.num_entries -= row[1]
+        return to_record(pickle.loads(row[0]))
+
+    def __contains__(self, s):
+        return self.num_states > 0 and self.connection.execute('SELECT 1 FROM records WHERE key = ?',
+                                                               (repr(s),)).fetchone() is not None
+
+    def iter_records(self):
+        """
+        Iterate over the (state, StateRecord) pairs of the spilled states.
+        """
+        for row in self.connection.execute('SELECT record FROM records').fetchall():
+            spilled = pickle.loads(row[0])
+            yield spilled[0], to_record(spilled)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM records')
+        self.num_states = 0
+        self.num_entries = 0
+
+
+def to_record(row):
+    """
+    Convert a spilled (state, Q values, visit counts, stored mask) row to a StateRecord.
+    """
+    record = StateRecord()
+    _, record.q, record.n, record.stored = row
+    return record
+
+
+class RecordCache(OrderedDict):
+    """
+    Records of a BoundedQStore, in order of last use: looking a record up moves it to the end, loading it from the
+    spill store if it was spilled, and adding a record to a full cache first evicts a batch of records.
+    """
+    def __init__(self, store):
+        OrderedDict.__init__(self)
+        self.store = store
+
+    def get(self, s, default=None):
+        record = OrderedDict.pop(self, s, None)
+        if record is None:
+            return self.store.load_spilled(s, default)
+        OrderedDict.__setitem__(self, s, record)
+        return record
+
+    def __setitem__(self, s, record):
+        store = self.store
+        if store.capacity is not None and len(self) >= store.capacity and not OrderedDict.__contains__(self, s):
+            store.evict(len(self) - store.capacity + max(1, int(store.capacity * EVICTION_BATCH)))
+        OrderedDict.__setitem__(self, s, record)
+
+
+class BoundedQStore(DictQStore):
+    """
+    DictQStore keeping at most a given number of states in memory. When full, the least recently used states, or the
+    least visited ones (the least recently used first among equals), are evicted in batches: either dropped, which
+    forgets them, or spilled to a SpillStore, from which they are loaded back when used again.
+
+    Lookups and updates go through a RecordCache, so that the methods of DictQStore apply unchanged.
+    """
+    def __init__(self, capacity=None, eviction='lru', spill=False):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError('Unknown eviction policy: {}'.format(eviction))
+        self.capacity = capacity
+        self.eviction = eviction
+        self.spill = SpillStore() if spill else None
+        self.num_evictions = 0
+        self.protected = frozenset()  # States which are not evicted, as the current operation is updating them
+        DictQStore.__init__(self)
+
+    def clear(self):
+        self.records = RecordCache(self)
+        self.num_entries = 0
+        if self.spill is not None:
+            self.spill.clear()
+
+    def set_capacity(self, capacity):
+        """
+        Change the maximum number of states kept in memory (None for no maximum), evicting states beyond it.
+        """
+        self.capacity = capacity if capacity is None else max(1, capacity)
+        if self.capacity is not None and len(self.records) > self.capacity:
+            self.evict(len(self.records) - self.capacity)
+
+    def set_q_many(self, states, actions, q):
+        """
+        Set the Q values of several state-action pairs, none of whose states is evicted to make room for the others
+        (which would lose the new, never visited states first with the 'visits' policy).
+        """
+        states = list(states)
+        self.protected = frozenset(states)
+        try:
+            DictQStore.set_q_many(self, states, actions, q)
+        finally:
+            self.protected = frozenset()
+        if self.capacity is not None and len(self.records) > self.capacity:
+            self.evict(len(self.records) - self.capacity)  # More new states than the whole capacity
+
+    def evict(self, num_states):
+        """
+        Evict the given number of states from memory, according to the eviction policy, sparing the protected ones.
+        """
+        records = self.records
+        protected = self.protected
+        candidates = ((s, record) for s, record in records.items() if s not in protected)
+        if self.eviction == 'visits':
+            states = [s for s, _ in heapq.nsmallest(num_states, candidates, key=lambda item: sum(item[1].n))]
+        else:
+            states = [s for s, _ in islice(candidates, num_states)]
+        evicted = [(s, OrderedDict.pop(records, s)) for s in states]
+        self.num_entries -= sum(popcount(record.stored) for _, record in evicted)
+        self.num_evictions += len(evicted)
+        if self.spill is not None:
+            self.spill.add(evicted)
+
+    def load_spilled(self, s, default=None):
+        """
+        Load the record of the given state back from the spill store, if it was spilled.
+
+        :return: the record, or default if the state was not spilled
+        """
+        if self.spill is None:
+            return default
+        record = self.spill.pop(s)
+        if record is None:
+            return default
+        self.records[s] = record
+        self.num_entries += popcount(record.stored)
+        return record
+
+    def __len__(self):
+        return self.num_entries + (self.spill.num_entries if self.spill is not None else 0)
+
+    def num_states(self):
+        return len(self.records) + (self.spill.num_states if self.spill is not None else 0)
+
+    def num_states_in_memory(self):
+        return len(self.records)
+
+    def get_states(self):
+        return [s for s, _ in self.iter_records()]
+
+    def __contains__(self, s):
+        return OrderedDict.__contains__(self.records, s) or self.spill is not None and s in self.spill
+
+    def iter_records(self):
+        records = list(self.records.items())
+        if self.spill is not None:
+            records.extend(self.spill.iter_records())
+        return iter(records)
+
+    def load_arrays(self, states, q, n, stored):
+        DictQStore.load_arrays(self, states, q, n, stored)
+        self.num_entries = sum(popcount(record.stored) for record in self.records.values())  # Without evicted ones
+
+
+Q_STORES = {
+    'dict': DictQStore,
+    'array': ArrayQStore,
+    'bounded': BoundedQStore
+}
+
+
+def create_q_store(q_store, capacity=None, eviction='lru', spill=False):
+    """
+    Create an empty Q store of the given type ('dict', 'array' or 'bounded').
+
+    :param capacity: the maximum number of states in memory of a bounded store (None for no maximum)
+    :param eviction: the eviction policy of a bounded store: 'lru' (least recently used) or 'visits' (least visited)
+    :param spill: whether a bounded store spills the evicted states to a temporary database, instead of dropping them
+    """
+    if q_store == 'bounded':
+        return BoundedQStore(capacity, eviction, spill)
+    return Q_STORES[q_store]()
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from q_store import create_q_store
+
+ACTIONS = [2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('eviction', ['lru', 'visits'])
+def test_set_q_many_keeps_the_new_states(eviction):
+    store = create_q_store('bounded', capacity=20, eviction=eviction)
+    for i in range(20):
+        store.set_q((i,), 2, 1.0)
+        store.set_n((i,), 2, 5)
+    states = [(100 + i,) for i in range(5)]
+    store.set_q_many(states, [3] * len(states), 0.5)
+    assert store.num_states() <= 20
+    assert all(store.get_q(s, 3) == 0.5 for s in states)
+
+
+def test_set_q_many_beyond_the_capacity():
+    store = create_q_store('bounded', capacity=4, eviction='visits')
+    store.set_q_many([(i,) for i in range(10)], [2] * 10, 0.5)
+    assert store.num_states() == 4
+
+
+def apply_random_operations(stores, num_operations=3000, num_states=300):
+    random.seed(0)
+    states = [(i % 21, i // 21) for i in range(num_states)]
+    for _ in range(num_operations):
+        operation = random.random()
+        s, a = random.choice(states), random.choice(ACTIONS)
+        if operation < 0.4:
+            q = random.random()
+            for store in stores:
+                store.set_q(s, a, q)
+        elif operation < 0.5:
+            n = random.randint(0, 10)
+            for store in stores:
+                store.set_n(s, a, n)
+        elif operation < 0.8:
+            for store in stores:
+                store.increment_n(s, a)
+        else:
+            close_states = random.sample(states, 5)
+            close_actions = [random.choice(ACTIONS) for _ in close_states]
+            q = random.random()
+            for store in stores:
+                store.set_q_many(close_states, close_actions, q)
+    return states
+
+
+def query(store, states):
+    results = []
+    for s in states + [(-1, -1)]:
+        results.append([store.get_q(s, a) for a in ACTIONS] + [store.get_n(s, a) for a in ACTIONS] + [
+            sorted(store.get_best_actions(s, ACTIONS)),
+            sorted(store.get_best_actions_optimistic(s, ACTIONS, 3, 1.0)),
+            store.get_best_action(s, ACTIONS),
+            store.get_max_q(s, ACTIONS),
+            s in store])
+    return results, len(store), store.num_states(), store.to_dicts()
+
+
+@pytest.mark.parametrize('q_store,options', [
+    ('array', {}),
+    ('bounded', {}),
+    ('bounded', {'capacity': 50, 'spill': True}),
+    ('bounded', {'capacity': 50, 'eviction': 'visits', 'spill': True}),
+])
+def test_parity_with_the_dict_store(q_store, options):
+    expected = create_q_store('dict')
+    actual = create_q_store(q_store, **options)
+    states = apply_random_operations([expected, actual])
+    assert query(actual, states) == query(expected, states)
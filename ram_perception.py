@@ -0,0 +1,138 @@
+import logging
+
+import numpy as np
+
+from world import PROBE_YS, PROBE_XS, NUM_BLOCKS, FLASH_CHECK_PROBE, CODE_BLACK, find_qbert_cell
+
+# Byte addresses from the published Qbert RAM annotations
+TILE_ADDRESSES = np.array([
+    21,
+    52, 54,
+    83, 85, 87,
+    98, 100, 102, 104,
+    1, 3, 5, 7, 9,
+    32, 34, 36, 38, 40, 42,
+], dtype=np.intp)  # Tile value of each block, in row-major order
+QBERT_X_BYTE = 43
+QBERT_Y_BYTE = 67
+
+OFF_PYRAMID = None  # Qbert coordinates which do not correspond to a block (on a disc, falling, ...)
+
+PERCEPTION_FIELDS = ('block_bits', 'enemy_bits', 'friendly_bits', 'disc_bits', 'current_row', 'current_col')
+
+
+class RamPerception:
+    """
+    Perception backend which decodes the block colors and Qbert's position from the 128-byte RAM instead of the RGB
+    screen.
+
+    The RAM only holds raw tile values and sprite coordinates, so the tile value of each desired color and the block
+    corresponding to each of Qbert's coordinates are calibrated against the screen parser the first time they are
+    encountered. Enemies, friendlies, discs and the desired color are read from the palette-indexed screen (a third of
+    the size of the RGB screen) at the same probe pixels as update_rgb, with the palette itself calibrated against the
+    RGB screen, as the annotations do not cover their bytes. Those probe pixels include the blocks and Qbert, so the
+    values decoded from the RAM are checked against them on every frame which is not flashing, and the frame is parsed
+    from the screen instead (recalibrating the values) whenever they disagree.
+    """
+    def __init__(self, world):
+        width, height = world.ale.getScreenDims()
+        self.world = world
+        self.screen = np.empty([height, width], dtype=np.uint8)
+        self.palette = np.full(256, -1, dtype=np.int64)  # Packed color code of each palette index (-1 if unknown)
+        self.goal_tile_values = {}  # Tile value of each desired color
+        self.qbert_positions = {}  # Block (or OFF_PYRAMID) at each of Qbert's (x, y) coordinates
+        self.num_updates = 0
+        self.num_calibrations = 0
+        self.num_mismatches = 0  # Number of frames on which the values decoded from the RAM disagreed with the screen
+
+    def update(self):
+        """
+        Updates the world's blocks, agents and discs from the current RAM and palette-indexed screen, or from the
+        screen alone when a RAM value is not calibrated yet or disagrees with the screen.
+        """
+        world = self.world
+        self.num_updates += 1
+        codes = self.probe_codes()
+        tiles = world.ram[TILE_ADDRESSES]
+        coordinates = int(world.ram[QBERT_X_BYTE]), int(world.ram[QBERT_Y_BYTE])
+        world.parse_probe_codes(codes, parse_blocks=False)
+        goal_tile_value = self.goal_tile_values.get(world.desired_color_code)
+        if goal_tile_value is None or coordinates not in self.qbert_positions:
+            self.calibrate(codes, tiles, coordinates)
+            return
+        colored = tiles == goal_tile_value
+        position = self.qbert_positions[coordinates]
+        if codes[FLASH_CHECK_PROBE] == CODE_BLACK and not self.agrees(codes, colored, position):
+            self.num_mismatches += 1
+            logging.debug('RAM values {} and {} disagree with the screen, recalibrating them'.format(
+                tiles.tolist(), coordinates))
+            self.calibrate(codes, tiles, coordinates)
+            return
+        world.set_block_colors(colored)
+        if position is not OFF_PYRAMID:
+            world.current_row, world.current_col = position
+
+    def agrees(self, codes, colored, position):
+        """
+        Checks the block colors and Qbert's position decoded from the RAM against the probed pixels of the screen.
+        """
+        if not np.array_equal(colored, codes[:NUM_BLOCKS] == self.world.desired_color_code):
+            return False
+        qbert_cell = find_qbert_cell(codes)
+        return qbert_cell is None or qbert_cell == position  # Qbert may be hidden behind another sprite
+
+    def probe_codes(self):
+        """
+        Gets the packed color codes of the probed pixels from the palette-indexed screen, falling back to the RGB
+        screen (and learning the missing palette entries) when an unknown palette index is encountered.
+        """
+        world = self.world
+        world.ale.getScreen(self.screen)
+        indices = self.screen[PROBE_YS, PROBE_XS]
+        codes = self.palette[indices]
+        if (codes < 0).any():
+            world.ale.getScreenRGB(world.rgb_screen)
+            codes = world.rgb_probe_codes()
+            self.palette[indices] = codes
+        return codes
+
+    def calibrate(self, codes, tiles, coordinates):
+        """
+        Parses the blocks and Qbert from the screen, and records the goal tile value of the desired color and Qbert's
+        position at the given coordinates.
+        """
+        world = self.world
+        self.num_calibrations += 1
+        qbert_found = world.parse_block_codes(codes)
+        self.record(self.qbert_positions, coordinates,
+                    (world.current_row, world.current_col) if qbert_found else OFF_PYRAMID)
+        if codes[FLASH_CHECK_PROBE] != CODE_BLACK:
+            return  # The desired color is not parsed while the screen flashes
+
+        colored = codes[:NUM_BLOCKS] == world.desired_color_code
+        if colored.any():
+            goal_tile_values = np.unique(tiles[colored])
+            if len(goal_tile_values) == 1 and not (tiles[~colored] == goal_tile_values[0]).any():
+                self.record(self.goal_tile_values, world.desired_color_code, int(goal_tile_values[0]))
+
+    def record(self, calibration, key, value):
+        """
+        Records the value of a RAM key in a calibration.
+        """
+        previous = calibration.get(key, value)
+        if previous != value:
+            logging.debug('RAM value {} recalibrated from {} to {}'.format(key, previous, value))
+        calibration[key] = value
+
+
+def cross_validate(world):
+    """
+    Decodes the current frame with both the RGB and the RAM perception backends of the world.
+
+    :return: the names of the perception fields on which the two backends disagree
+    """
+    world.update_rgb()
+    expected = [getattr(world, field) for field in PERCEPTION_FIELDS]
+    world.ram_perception.update()
+    actual = [getattr(world, field) for field in PERCEPTION_FIELDS]
+    return [field for field, e, a in zip(PERCEPTION_FIELDS, expected, actual) if e != a]
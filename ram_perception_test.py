@@ -0,0 +1,40 @@
+from fake_ale import FakeALE
+from ram_perception import cross_validate, QBERT_X_BYTE, QBERT_Y_BYTE
+from world import QbertWorld
+
+
+def create_world():
+    world = QbertWorld(random_seed=123, frame_skip=4, repeat_action_probability=0, sound=False, display_screen=False,
+                       block_state_repr='verbose', enemy_state_repr='verbose', friendly_state_repr='verbose',
+                       perception='ram', ale=FakeALE())
+    world.reset()
+    return world
+
+
+def test_agrees_with_the_screen():
+    world = create_world()
+    for _ in range(200):
+        assert cross_validate(world) == []
+        world.perform_action(2)
+    assert world.ram_perception.num_mismatches == 0
+
+
+def test_falls_back_to_the_screen_on_a_wrong_goal_tile_value():
+    world = create_world()
+    perception = world.ram_perception
+    goal_tile_values = dict(perception.goal_tile_values)
+    perception.goal_tile_values = {color: value + 1 for color, value in goal_tile_values.items()}
+    assert cross_validate(world) == []
+    assert perception.num_mismatches == 1
+    assert perception.goal_tile_values == goal_tile_values
+
+
+def test_falls_back_to_the_screen_on_a_wrong_qbert_position():
+    world = create_world()
+    perception = world.ram_perception
+    coordinates = int(world.ram[QBERT_X_BYTE]), int(world.ram[QBERT_Y_BYTE])
+    row, col = perception.qbert_positions[coordinates]
+    perception.qbert_positions[coordinates] = (row + 1, col) if row < 6 else (row - 1, 0)
+    assert cross_validate(world) == []
+    assert perception.num_mismatches == 1
+    assert perception.qbert_positions[coordinates] == (row, col)
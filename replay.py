@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of the last transitions (s, a, reward, s_next), stored as preallocated columns of states, action
+    numbers and rewards. The states are held by the ring itself, so the states of overwritten transitions are released.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.states = [None] * capacity
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = [None] * capacity
+        self.size = 0
+        self.position = 0  # Index of the next transition to write
+        self.random_state = np.random.RandomState(random.getrandbits(32))
+
+    def add(self, s, a, reward, s_next):
+        i = self.position
+        self.states[i] = s
+        self.actions[i] = a
+        self.rewards[i] = reward
+        self.next_states[i] = s_next
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """
+        Sample transitions uniformly, with replacement.
+
+        :return: the lists of states, actions, rewards and next states of the sampled transitions
+        """
+        indices = self.random_state.randint(self.size, size=batch_size)
+        states, next_states = self.states, self.next_states
+        return ([states[i] for i in indices.tolist()],
+                self.actions[indices].tolist(),
+                self.rewards[indices].tolist(),
+                [next_states[i] for i in indices.tolist()])
+
+    def __len__(self):
+        return self.size
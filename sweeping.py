@@ -0,0 +1,69 @@
+import heapq
+import itertools
+
+
+class PrioritizedSweeping:
+    """
+    Prioritized sweeping for a QLearner: keeps a model of the last (next state, reward) of every (state, action) pair
+    with the predecessors of every state, and after every real step backs up the pairs with the largest TD errors,
+    propagating the changes backwards through the predecessors.
+    """
+    def __init__(self, learner, num_backups, threshold=1e-3):
+        self.learner = learner
+        self.num_backups = num_backups
+        self.threshold = threshold
+        self.model = {}  # (s, a) -> (s_next, reward)
+        self.predecessors = {}  # s_next -> set of (s, a)
+        self.heap = []  # (-priority, insertion count, (s, a)), possibly with outdated entries
+        self.priorities = {}  # (s, a) -> priority of its queued heap entry
+        self.counter = itertools.count()
+        self.num_sweeps = 0
+
+    def push(self, key):
+        """
+        Queue a (state, action) pair with the magnitude of its TD error as priority, if above the threshold.
+        """
+        s_next, reward = self.model[key]
+        priority = abs(self.learner.td_error(key[0], key[1], s_next, reward))
+        if priority > self.threshold and priority > self.priorities.get(key, 0):
+            self.priorities[key] = priority
+            heapq.heappush(self.heap, (-priority, next(self.counter), key))
+
+    def pop(self):
+        """
+        Get the queued (state, action) pair with the highest priority, or None if the queue is empty.
+        """
+        while self.heap:
+            negative_priority, _, key = heapq.heappop(self.heap)
+            if self.priorities.get(key) == -negative_priority:
+                del self.priorities[key]
+                return key
+        return None
+
+    def update(self, s, a, s_next, reward):
+        """
+        Record a real transition in the model and sweep.
+        """
+        key = s, a
+        previous = self.model.get(key)
+        if previous is not None and previous[0] != s_next:
+            self.predecessors[previous[0]].discard(key)
+        self.model[key] = s_next, reward
+        self.predecessors.setdefault(s_next, set()).add(key)
+        self.push(key)
+        self.sweep()
+
+    def sweep(self):
+        """
+        Back up the queued pairs with the highest priorities, queueing the predecessors of the backed up states.
+        """
+        for _ in range(self.num_backups):
+            key = self.pop()
+            if key is None:
+                break
+            s, a = key
+            s_next, reward = self.model[key]
+            self.learner.simulated_backup(s, a, s_next, reward)
+            self.num_sweeps += 1
+            for predecessor in self.predecessors.get(s, ()):
+                self.push(predecessor)
@@ -0,0 +1,166 @@
+import json
+from collections import OrderedDict
+from timeit import default_timer
+
+from memory import get_resident_memory, MEGABYTE
+from q_store import RecordCache
+
+WORLD_METHODS = ('perform_action', 'update_perception', 'update_rgb')
+LEARNER_METHODS = ('get_best_actions', 'get_best_single_action', 'update', 'update_close')
+
+
+class Telemetry:
+    """
+    Instruments an agent, its world and its learners, and streams one JSON line of statistics per episode, preceded by
+    one line per sampled action if a sample interval is given.
+
+    Instrumented methods are wrapped on the instances only, so that agents without telemetry are not slowed down.
+    Timings are inclusive: a method calling another instrumented method also counts the time spent in it. The lookups
+    of the caches (the feature cache of the feature learners, and the state interner or the record cache of the
+    'array' and 'bounded' Q stores) are counted the same way, so the agent is to be instrumented after loading its
+    learning data, which replaces these caches.
+    """
+    def __init__(self, agent, filename, sample_interval=None):
+        """
+        :param sample_interval: if set, the number of actions between two sampled actions
+        """
+        self.agent = agent
+        self.world = agent.world
+        self.learners = agent.get_learners()
+        self.file = open(filename, 'w')
+        self.timings = {}  # Instrumented method name -> [number of calls, total seconds] since the last episode
+        self.lookups = {}  # Instrumented cache name -> [number of lookups, number of hits] since the last episode
+        encoders = [name for name in dir(self.world) if name.startswith('to_state_')]
+        self.instrument(self.world, 'world', WORLD_METHODS + tuple(encoders))
+        for learner_name, learner in self.learners.items():
+            self.instrument(learner, learner_name, LEARNER_METHODS)
+            self.instrument_caches(learner, learner_name)
+        self.num_actions, self.num_frames = self.count_frames()
+        self.sample_interval = sample_interval
+        self.num_episode_actions = 0
+        if sample_interval is not None:
+            agent.action = self.sample_actions(agent.action)
+        ram_perception = self.world.ram_perception
+        self.num_ram_updates = ram_perception.num_updates if ram_perception is not None else 0
+        self.num_ram_calibrations = ram_perception.num_calibrations if ram_perception is not None else 0
+
+    def instrument(self, obj, prefix, method_names):
+        for method_name in method_names:
+            if not hasattr(obj, method_name):
+                continue
+            timing = self.timings['{}.{}'.format(prefix, method_name)] = [0, 0.0]
+            setattr(obj, method_name, time_calls(getattr(obj, method_name), timing))
+
+    def instrument_caches(self, learner, learner_name):
+        if hasattr(learner, 'get_features'):
+            lookups = self.lookups['{}.features'.format(learner_name)] = [0, 0]
+            learner.get_features = count_hits(learner.get_features, lookups, lambda s: s == learner.last_state)
+        store = getattr(learner, 'store', None)
+        if hasattr(store, 'interner'):
+            interner = store.interner
+            lookups = self.lookups['{}.interner'.format(learner_name)] = [0, 0]
+            interner.intern = count_hits(interner.intern, lookups, lambda s: s in interner.ids)
+            interner.lookup = count_hits(interner.lookup, lookups, lambda s: s in interner.ids)
+        elif isinstance(getattr(store, 'records', None), RecordCache):
+            records = store.records
+            lookups = self.lookups['{}.records'.format(learner_name)] = [0, 0]
+            records.get = count_hits(records.get, lookups, lambda s: OrderedDict.__contains__(records, s))
+
+    def sample_actions(self, action):
+        """
+        Wrap the action method of the agent to write a line with the duration and the frames of every sampled action.
+        """
+        def sampled_action():
+            self.num_episode_actions += 1
+            if self.num_episode_actions % self.sample_interval != 0:
+                return action()
+            _, num_frames = self.count_frames()
+            start = default_timer()
+            reward = action()
+            seconds = default_timer() - start
+            self.write({
+                'step': self.num_episode_actions,
+                'seconds': seconds,
+                'frames': self.count_frames()[1] - num_frames,
+                'reward': reward
+            })
+            return reward
+        return sampled_action
+
+    def count_frames(self):
+        frames_consumed = self.world.transitions.frames_consumed
+        return sum(frames_consumed.values()), sum(frames * count for frames, count in frames_consumed.items())
+
+    def record_episode(self, episode, score, level):
+        """
+        Write the statistics of the episode which just ended, and start counting the next one.
+        """
+        num_actions, num_frames = self.count_frames()
+        episode_actions = num_actions - self.num_actions
+        episode_frames = num_frames - self.num_frames
+        self.num_actions, self.num_frames = num_actions, num_frames
+        record = {
+            'episode': episode,
+            'score': score,
+            'level': int(level),
+            'actions': episode_actions,
+            'frames': episode_frames,
+            'frames_per_action': episode_frames / float(episode_actions) if episode_actions else 0,
+            'q_size': {name: learner.q_size() for name, learner in self.learners.items()},
+            'num_states': {name: learner.num_states() for name, learner in self.learners.items()},
+            'evictions': {name: learner.num_evictions() for name, learner in self.learners.items()},
+            'resident_memory_mb': get_resident_memory() / float(MEGABYTE),
+            'timings': {name: {'calls': calls, 'seconds': seconds}
+                        for name, (calls, seconds) in sorted(self.timings.items()) if calls > 0}
+        }
+        ram_perception = self.world.ram_perception
+        if ram_perception is not None:
+            num_updates = ram_perception.num_updates - self.num_ram_updates
+            num_calibrations = ram_perception.num_calibrations - self.num_ram_calibrations
+            self.num_ram_updates = ram_perception.num_updates
+            self.num_ram_calibrations = ram_perception.num_calibrations
+            record['ram_cache_hit_rate'] = 1 - num_calibrations / float(num_updates) if num_updates else 0
+        record['cache_hit_rates'] = {name: hits / float(lookups)
+                                     for name, (lookups, hits) in sorted(self.lookups.items()) if lookups > 0}
+        self.write(record)
+        for timing in self.timings.values():
+            timing[0] = 0
+            timing[1] = 0.0
+        for lookups in self.lookups.values():
+            lookups[0] = 0
+            lookups[1] = 0
+        self.num_episode_actions = 0
+
+    def write(self, record):
+        json.dump(record, self.file)
+        self.file.write('\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def count_hits(method, lookups, is_hit):
+    """
+    Wrap a method looking a key up in a cache to add its number of calls, and of calls for which is_hit(key) is True
+    beforehand, to the given [lookups, hits] list.
+    """
+    def counted_method(key, *args, **kwargs):
+        lookups[0] += 1
+        if is_hit(key):
+            lookups[1] += 1
+        return method(key, *args, **kwargs)
+    return counted_method
+
+
+def time_calls(method, timing):
+    """
+    Wrap a method to add its number of calls and total duration to the given [calls, seconds] list.
+    """
+    def timed_method(*args, **kwargs):
+        start = default_timer()
+        result = method(*args, **kwargs)
+        timing[0] += 1
+        timing[1] += default_timer() - start
+        return result
+    return timed_method
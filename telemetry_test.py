@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+from fake_ale import FakeALE
+from main import play_learning_agent
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('pickle')
+
+
+def read_telemetry(**options):
+    play_learning_agent(num_episodes=2, telemetry_filename='telemetry.jsonl', ale=FakeALE(episode_length=40),
+                        **options)
+    with open('telemetry.jsonl') as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize('q_store,cache', [('array', 'interner'), ('bounded', 'records')])
+def test_q_store_cache_hit_rates(q_store, cache):
+    episodes = read_telemetry(q_store=q_store, q_store_capacity=100)
+    assert [record['episode'] for record in episodes] == [1, 2]
+    hit_rates = episodes[-1]['cache_hit_rates']
+    assert set(hit_rates) == set('{}.{}'.format(name, cache) for name in ('block', 'enemy', 'friendly'))
+    assert all(0 < hit_rate <= 1 for hit_rate in hit_rates.values())
+
+
+def test_feature_cache_hit_rates():
+    episodes = read_telemetry(learner_type='linear')
+    assert set(episodes[-1]['cache_hit_rates']) == {'block.features', 'enemy.features', 'friendly.features'}
+
+
+def test_sampled_actions():
+    records = read_telemetry(telemetry_sample_interval=5)
+    samples = [record for record in records if 'step' in record]
+    episodes = [record for record in records if 'episode' in record]
+    assert len(episodes) == 2
+    assert len(samples) == sum(record['actions'] // 5 for record in episodes)
+    assert all(sample['step'] % 5 == 0 and sample['frames'] > 0 for sample in samples)
@@ -0,0 +1,114 @@
+import logging
+from collections import Counter
+
+NO_OP = 0
+
+SAM_SCORE = 300
+GREEN_BALL_OR_LEVEL_UP_SCORE = 100
+KILL_COILY_SCORE = 500
+LOSE_LIFE_PENALTY = -100
+
+# Events of the score differences received while waiting for the next decision
+BLOCK_EVENT = 0
+SAM_EVENT = 1
+COILY_EVENT = 2
+GREEN_BALL_OR_LEVEL_UP_EVENT = 3
+
+SCORE_EVENTS = {
+    SAM_SCORE: SAM_EVENT,
+    KILL_COILY_SCORE: COILY_EVENT,
+    GREEN_BALL_OR_LEVEL_UP_SCORE: GREEN_BALL_OR_LEVEL_UP_EVENT
+}  # Any other score difference is a block event
+
+
+class TransitionEngine:
+    """
+    Steps the emulator with NO_OP after an action until Qbert can take the next decision, which is when the first RAM
+    byte is 0 and the last bit of the last RAM byte is 1, and classifies the score differences received meanwhile.
+
+    Keeps track of the number of frames consumed by every action.
+    """
+    def __init__(self, ale, ram, frame_skip):
+        self.ale = ale
+        self.ram = ram
+        self.last_byte = len(ram) - 1
+        self.frame_skip = frame_skip
+        self.frames_consumed = Counter()  # Number of actions which consumed each number of frames
+
+    def perform_action(self, a):
+        """
+        Perform the given action number a, and wait until the next decision.
+
+        :return: the block score, friendly score, enemy score and enemy penalty
+        """
+        ale = self.ale
+        act = ale.act
+        get_ram = ale.getRAM
+        ram = self.ram
+        last_byte = self.last_byte
+        score = act(a)
+        friendly_score = 0
+        enemy_score = 0
+        enemy_penalty = 0
+        level_up_score = 0
+        num_acts = 1
+        initial_num_lives = ale.lives()
+        get_ram(ram)
+        while not (ram[0] == 0 and ram[last_byte] & 1):
+            num_lives = ale.lives()
+            if num_lives < initial_num_lives:
+                enemy_penalty = LOSE_LIFE_PENALTY
+            if num_lives == 0:
+                break
+            score_diff = act(NO_OP)
+            num_acts += 1
+            event = SCORE_EVENTS.get(score_diff, BLOCK_EVENT)
+            if event == BLOCK_EVENT:
+                score += score_diff
+            elif event == SAM_EVENT:
+                friendly_score = score_diff
+            elif event == COILY_EVENT:
+                logging.info('Killed Coily!')
+                enemy_score = score_diff
+            else:
+                while score_diff == GREEN_BALL_OR_LEVEL_UP_SCORE:
+                    level_up_score += score_diff
+                    score_diff = act(NO_OP)
+                    num_acts += 1
+            get_ram(ram)
+
+        if level_up_score != 0:
+            if level_up_score == GREEN_BALL_OR_LEVEL_UP_SCORE:
+                # Green Ball
+                friendly_score = level_up_score
+            else:
+                # Level Up
+                score += level_up_score
+        self.frames_consumed[num_acts * self.frame_skip] += 1
+        return score, friendly_score, enemy_score, enemy_penalty
+
+    def wait(self):
+        """
+        Wait until the next decision.
+
+        :return: the score received meanwhile
+        """
+        act = self.ale.act
+        get_ram = self.ale.getRAM
+        ram = self.ram
+        last_byte = self.last_byte
+        reward = 0
+        while not (ram[0] == 0 and ram[last_byte] & 1):
+            reward += act(NO_OP)
+            get_ram(ram)
+        return reward
+
+    def get_frame_stats(self):
+        """
+        Get the number of actions performed, and the mean and maximum number of frames consumed by an action.
+        """
+        num_actions = sum(self.frames_consumed.values())
+        if num_actions == 0:
+            return 0, 0, 0
+        total_frames = sum(frames * count for frames, count in self.frames_consumed.items())
+        return num_actions, total_frames / float(num_actions), max(self.frames_consumed)
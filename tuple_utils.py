@@ -7,6 +7,14 @@ def list_to_tuple_with_value(lst, row_num, col_num, val):
                  for i, row in enumerate(lst))
 
 
+def tuple_with_value(t, row_num, col_num, val):
+    """
+    Same as list_to_tuple_with_value on a nested tuple, sharing its unchanged rows.
+    """
+    row = t[row_num]
+    return t[:row_num] + (row[:col_num] + (val,) + row[col_num + 1:],) + t[row_num + 1:]
+
+
 def hamming_distance(s1, s2):
     f1 = flatten_tuples(s1)
     f2 = flatten_tuples(s2)
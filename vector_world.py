@@ -0,0 +1,120 @@
+import logging
+import multiprocessing
+
+import numpy as np
+
+from world import QbertWorld
+
+NUM_SCORES = 4  # block score, friendly score, enemy score and enemy penalty
+
+
+def run_world(connection, random_seed, frame_skip, repeat_action_probability, state_methods, world_options):
+    """
+    Worker process loop which owns a single QbertWorld and serves the commands of a VectorQbertWorld.
+    """
+    world = QbertWorld(random_seed, frame_skip, repeat_action_probability, False, False, **world_options)
+    world.reset()
+    while True:
+        command, data = connection.recv()
+        if command == 'step':
+            scores = world.perform_action(data)
+            connection.send((scores, world.ale.game_over(), [getattr(world, m)() for m in state_methods]))
+        elif command == 'reset':
+            world.reset_game()
+            world.reset()
+            connection.send([getattr(world, m)() for m in state_methods])
+        elif command == 'states':
+            connection.send([getattr(world, m)() for m in state_methods])
+        elif command == 'call':
+            method, args = data
+            connection.send(getattr(world, method)(*args))
+        elif command == 'close':
+            connection.close()
+            break
+
+
+class VectorQbertWorld:
+    """
+    N Qbert worlds, each with its own emulator in its own process and its own random seed, stepped in lock-step.
+
+    Every world steps concurrently, so the busy-wait of one world in perform_action does not block the others.
+    """
+    def __init__(self, num_worlds, random_seed=123, frame_skip=4, repeat_action_probability=0,
+                 state_methods=('to_state_combined_verbose',), world_options=None):
+        self.num_worlds = num_worlds
+        self.state_methods = tuple(state_methods)
+        self.connections = []
+        self.processes = []
+        for i in range(num_worlds):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_world,
+                                              args=(worker_connection, random_seed + i, frame_skip,
+                                                    repeat_action_probability, self.state_methods,
+                                                    world_options or {}))
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        logging.info('Started {} Qbert worlds with seeds {} to {}'.format(num_worlds, random_seed,
+                                                                         random_seed + num_worlds - 1))
+
+    def step(self, actions):
+        """
+        Perform one action number in every world.
+
+        :param actions: the N action numbers, one for each world
+        :return: the (N, 4) array of block, friendly, enemy and enemy penalty scores, the (N,) array of game over
+                 flags and the (N, len(state_methods)) object array of state encodings after the actions
+        """
+        for connection, a in zip(self.connections, actions):
+            connection.send(('step', int(a)))
+        scores = np.zeros((self.num_worlds, NUM_SCORES), dtype=np.int64)
+        game_overs = np.zeros(self.num_worlds, dtype=bool)
+        states = np.empty((self.num_worlds, len(self.state_methods)), dtype=object)
+        for i, connection in enumerate(self.connections):
+            scores[i], game_overs[i], world_states = connection.recv()
+            for j, s in enumerate(world_states):
+                states[i, j] = s
+        return scores, game_overs, states
+
+    def reset(self, indices=None):
+        """
+        Reset the games of the worlds with the given indices (all worlds by default).
+
+        :return: the (len(indices), len(state_methods)) object array of state encodings after the reset
+        """
+        indices = range(self.num_worlds) if indices is None else indices
+        for i in indices:
+            self.connections[i].send(('reset', None))
+        return self.collect_states(indices)
+
+    def states(self):
+        """
+        Get the (N, len(state_methods)) object array of the current state encodings of every world.
+        """
+        for connection in self.connections:
+            connection.send(('states', None))
+        return self.collect_states(range(self.num_worlds))
+
+    def call(self, method, *args):
+        """
+        Call a QbertWorld method with the given arguments in every world, and return the list of results.
+        """
+        for connection in self.connections:
+            connection.send(('call', (method, args)))
+        return [connection.recv() for connection in self.connections]
+
+    def collect_states(self, indices):
+        states = np.empty((len(indices), len(self.state_methods)), dtype=object)
+        for row, i in enumerate(indices):
+            for j, s in enumerate(self.connections[i].recv()):
+                states[row, j] = s
+        return states
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('close', None))
+            connection.close()
+        for process in self.processes:
+            process.join()
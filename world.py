@@ -1,15 +1,18 @@
+import copy
 import logging
 import sys
 from abc import ABCMeta, abstractmethod
 
 import numpy as np
-from ale_python_interface import ALEInterface
 
-from actions import get_action_diffs, action_number_to_name, \
-    get_action_number_diffs, get_valid_action_numbers, get_inverse_action, ACTION_NUM_DIFFS, ACTION_NUM_DIFFS_WITH_NOOP
-from tuple_utils import list_to_tuple, list_to_tuple_with_value
+from actions import get_action_diffs, action_number_to_name, get_action_number_diffs, get_inverse_action
+from bitboard import SURROUNDING_DISC_BITS, popcount
+from geometry import NUM_ROWS, CELLS, CELL_BITS, NEIGHBOURS, ADJACENT_MASKS, NEIGHBOURHOOD_MASKS, RAY_MASKS, \
+    SURROUNDING_CELLS, SURROUNDING_BITS, SURROUNDING_ADJACENT_MASKS, SURROUNDING_NEIGHBOURHOOD_MASKS, \
+    SURROUNDING_RAY_MASKS, NEARBY
+from transition import TransitionEngine
+from tuple_utils import list_to_tuple, list_to_tuple_with_value, tuple_with_value
 
-NUM_ROWS = 6
 NUM_COLS = 6
 
 QBERT_Y, QBERT_X = 28, 77
@@ -59,10 +62,6 @@ INITIAL_DISCS = [
     [0, 0]
 ]  # Indicates if there is a disc at the left or right at each row
 
-LEFT_EDGE_BLOCKS = [(1, 0), (2, 0), (3, 0), (4, 0)]
-RIGHT_EDGE_BLOCKS = [(1, 1), (2, 2), (3, 3), (4, 4)]
-BOTTOM_BLOCKS = [(5, 1), (5, 2), (5, 3), (5, 4)]
-
 COLOR_YELLOW = 210, 210, 64
 COLOR_BLACK = 0, 0, 0
 COLOR_QBERT = 181, 83, 40
@@ -75,17 +74,123 @@ AGENT_BLOCK_OFFSET_RANGE = 30
 DISC_OFFSET_Y = 14
 DISC_OFFSET_X = 14
 
-NO_OP = 0
-
-SAM_SCORE = 300
-GREEN_BALL_OR_LEVEL_UP_SCORE = 100
-KILL_COILY_SCORE = 500
-LOSE_LIFE_PENALTY = -100
-
 LEVEL_BYTE = 99
 
 FLASH_CHECK_Y, FLASH_CHECK_X = 40, 140
 
+SNAPSHOT_FIELDS = ('desired_color', 'desired_color_code', 'block_colors', 'enemies', 'friendlies', 'discs',
+                   'current_row', 'current_col', 'level', 'enemy_present', 'friendly_present', 'num_colored_blocks',
+                   'block_bits', 'enemy_bits', 'friendly_bits', 'disc_bits')  # World fields restored with a snapshot
+
+
+def get_level_snapshot_name(level):
+    return 'level_{}'.format(level)
+
+
+def pack_color(color):
+    """
+    Packs an (r, g, b) color into a single 24-bit integer code.
+    """
+    r, g, b = color
+    return (int(r) << 16) | (int(g) << 8) | int(b)
+
+
+def unpack_color(code):
+    """
+    Unpacks a 24-bit integer color code into an (r, g, b) color.
+    """
+    code = int(code)
+    return (code >> 16) & 0xff, (code >> 8) & 0xff, code & 0xff
+
+
+CODE_YELLOW = pack_color(COLOR_YELLOW)
+CODE_BLACK = pack_color(COLOR_BLACK)
+CODE_QBERT = pack_color(COLOR_QBERT)
+CODE_GREEN = pack_color(COLOR_GREEN)
+CODE_PURPLE = pack_color(COLOR_PURPLE)
+
+NUM_BLOCKS = len(CELLS)
+ROW_BOUNDS = [(row * (row + 1) // 2, (row + 1) * (row + 2) // 2) for row in range(NUM_ROWS)]
+CLOSE_MOVES = {
+    cell: tuple((next_cell, CELL_BITS[next_cell], get_inverse_action(a)) for a, next_cell in moves)
+    for cell, moves in NEIGHBOURS.items()
+}  # (resulting block, its bit, inverse action) of every move from each block
+CLOSE_DISTANCE_METRICS = ('manhattan', 'hamming', 'same_result')
+SURROUNDING_ENEMY_CHECKS = {
+    cell: tuple(zip(SURROUNDING_BITS[cell], SURROUNDING_ADJACENT_MASKS[cell], SURROUNDING_DISC_BITS[cell]))
+    for cell in CELLS
+}  # (bit, adjacent mask, edge disc bit) of every direction from each block, None when unattainable
+DANGER_BITS = {
+    (row, col): (bits[0], None if bits[1] is None else CELL_BITS[row - 1, col - 1 if col != 0 else row - 1],
+                 bits[2], bits[3])
+    for (row, col), bits in SURROUNDING_BITS.items()
+}  # Bit of the block checked for an enemy in every direction by the 'adjacent_dangerous' enemy states. To the top
+# right, it has always been the top left block (wrapping around the row at the left edge), kept for learned Q values
+
+
+def build_probe_coordinates():
+    """
+    Builds the (y, x) coordinates of every pixel inspected when parsing a frame, in the following order:
+
+    - the block color pixel of every block (NUM_BLOCKS pixels)
+    - the agent pixels above every block (NUM_BLOCKS * AGENT_BLOCK_OFFSET_RANGE pixels)
+    - the left disc pixel of every row (NUM_ROWS pixels)
+    - the right disc pixel of every row (NUM_ROWS pixels)
+    - the score pixel and the flash check pixel
+    """
+    coordinates = [BLOCK_COORDINATES[row][col] for row, col in CELLS]
+    for row, col in CELLS:
+        rgb_y, rgb_x = BLOCK_COORDINATES[row][col]
+        for y_offset in range(AGENT_BLOCK_OFFSET_RANGE):
+            coordinates.append((rgb_y + AGENT_BLOCK_OFFSET - y_offset, rgb_x))
+    for row in range(NUM_ROWS):
+        rgb_y, rgb_x = BLOCK_COORDINATES[row][0]
+        coordinates.append((rgb_y - DISC_OFFSET_Y, rgb_x - DISC_OFFSET_X))
+    for row in range(NUM_ROWS):
+        rgb_y, rgb_x = BLOCK_COORDINATES[row][row]
+        coordinates.append((rgb_y - DISC_OFFSET_Y, rgb_x + DISC_OFFSET_X))
+    coordinates.append((SCORE_Y, SCORE_X))
+    coordinates.append((FLASH_CHECK_Y, FLASH_CHECK_X))
+    ys, xs = zip(*coordinates)
+    return np.array(ys, dtype=np.intp), np.array(xs, dtype=np.intp)
+
+
+PROBE_YS, PROBE_XS = build_probe_coordinates()
+AGENT_PROBES_START = NUM_BLOCKS
+LEFT_DISC_PROBES_START = AGENT_PROBES_START + NUM_BLOCKS * AGENT_BLOCK_OFFSET_RANGE
+RIGHT_DISC_PROBES_START = LEFT_DISC_PROBES_START + NUM_ROWS
+SCORE_PROBE = RIGHT_DISC_PROBES_START + NUM_ROWS
+FLASH_CHECK_PROBE = SCORE_PROBE + 1
+
+BLOCK_BIT_VALUES = np.left_shift(1, np.arange(NUM_BLOCKS, dtype=np.int64))  # Bitboard value of each block
+LEFT_DISC_BIT_VALUES = np.left_shift(1, 2 * np.arange(NUM_ROWS, dtype=np.int64))
+RIGHT_DISC_BIT_VALUES = np.left_shift(1, 2 * np.arange(NUM_ROWS, dtype=np.int64) + 1)
+
+
+def find_qbert_cell(codes):
+    """
+    Finds Qbert from the packed color codes of the probed pixels.
+
+    :return: the (row, col) of the block Qbert is on, or None if he is not on the pyramid
+    """
+    agent_codes = codes[AGENT_PROBES_START:LEFT_DISC_PROBES_START].reshape(NUM_BLOCKS, AGENT_BLOCK_OFFSET_RANGE)
+    qbert_blocks = np.flatnonzero((agent_codes == CODE_QBERT).any(axis=1))
+    return CELLS[qbert_blocks[-1]] if len(qbert_blocks) > 0 else None
+
+
+def create_ale(frame_skip):
+    """
+    Create an emulator of the Qbert ROM without screen, sound or sticky actions, e.g. to simulate actions.
+    """
+    from ale_python_interface import ALEInterface
+    ale = ALEInterface()
+    ale.setInt('frame_skip', frame_skip)
+    ale.setFloat('repeat_action_probability', 0)
+    ale.setBool('sound', False)
+    ale.setBool('display_screen', False)
+    ale.loadROM('qbert.bin')
+    return ale
+
 
 class World:
     __metaclass__ = ABCMeta
@@ -100,8 +205,21 @@ class World:
 
 class QbertWorld(World):
     def __init__(self, random_seed, frame_skip, repeat_action_probability, sound, display_screen,
-                 block_state_repr=None, enemy_state_repr=None, friendly_state_repr=None):
-        ale = ALEInterface()
+                 block_state_repr=None, enemy_state_repr=None, friendly_state_repr=None, state_encoding='tuple',
+                 perception='rgb', reset_mode='emulator', ale=None, trace_directory=None, emulator_factory=None):
+        """
+        :param ale: the emulator to play with, or None for an ALEInterface
+        :param emulator_factory: a function creating an emulator whose states can be restored from the ones of ale,
+                                 given the frame skip (create_ale if ale is None, else no factory if None)
+        """
+        if ale is None:
+            from ale_python_interface import ALEInterface
+            ale = ALEInterface()
+            emulator_factory = emulator_factory or create_ale
+        self.trace = None
+        if trace_directory is not None:
+            from game_trace import TraceRecorder
+            ale = self.trace = TraceRecorder(ale, trace_directory)
 
         # Get & Set the desired settings
         if random_seed is not None:
@@ -138,13 +256,17 @@ class QbertWorld(World):
         self.rgb_screen = rgb_screen
         self.ram_size = ale.getRAMSize()
         self.ram = ram
+        self.transitions = TransitionEngine(ale, ram, frame_skip)
+        self.emulator_factory = emulator_factory
+        self.idle_listeners = []  # Resumed while waiting on the emulator and paused afterwards, e.g. DynaPlanner
 
         # Verbose state representation
         self.desired_color = COLOR_YELLOW
-        self.block_colors = INITIAL_COLORS
-        self.enemies = INITIAL_ENEMY_POSITIONS
-        self.friendlies = INITIAL_FRIENDLY_POSITIONS
-        self.discs = INITIAL_DISCS
+        self.desired_color_code = CODE_YELLOW
+        self.block_colors = [list(row) for row in INITIAL_COLORS]
+        self.enemies = [list(row) for row in INITIAL_ENEMY_POSITIONS]
+        self.friendlies = [list(row) for row in INITIAL_FRIENDLY_POSITIONS]
+        self.discs = [list(row) for row in INITIAL_DISCS]
         self.current_row, self.current_col = 0, 0
         self.level = 1
         self.enemy_present = False
@@ -154,52 +276,46 @@ class QbertWorld(World):
         self.friendly_state_repr = friendly_state_repr
         self.num_colored_blocks = 0
 
-    def perform_action(self, a):
-        score = 0
-        friendly_score = 0
-        enemy_score = 0
-        enemy_penalty = 0
-        score += self.ale.act(a)
-        initial_num_lives = self.ale.lives()
-        self.ale.getRAM(self.ram)
-        level_up_score = 0
-        while not (self.ram[0] == 0 and self.ram[self.ram_size - 1] & 1):  # last bit = 1 and first byte = 0
-            if self.ale.lives() < initial_num_lives:
-                enemy_penalty = LOSE_LIFE_PENALTY
-            if self.ale.lives() == 0:
-                break
-            score_diff = self.ale.act(NO_OP)
-            if score_diff == SAM_SCORE:
-                friendly_score = score_diff
-            elif score_diff == KILL_COILY_SCORE:
-                logging.info('Killed Coily!')
-                enemy_score = score_diff
-            elif score_diff == GREEN_BALL_OR_LEVEL_UP_SCORE:
-                while score_diff == GREEN_BALL_OR_LEVEL_UP_SCORE:
-                    level_up_score += score_diff
-                    score_diff = self.ale.act(NO_OP)
-            else:
-                score += score_diff
-            self.ale.getRAM(self.ram)
+        # Bitboard state representation (one bit per block, two bits per row for the discs)
+        self.state_encoding = state_encoding
+        self.block_bits = 0
+        self.enemy_bits = 0
+        self.friendly_bits = 0
+        self.disc_bits = 0
 
-        if level_up_score != 0:
-            if level_up_score == GREEN_BALL_OR_LEVEL_UP_SCORE:
-                # Green Ball
-                friendly_score = level_up_score
-            else:
-                # Level Up
-                score += level_up_score
+        # Perception backend
+        self.ram_perception = None
+        if perception == 'ram':
+            from ram_perception import RamPerception
+            self.ram_perception = RamPerception(self)
+
+        # Emulator snapshots, by name
+        self.reset_mode = reset_mode
+        self.snapshots = {}
 
-        if self.ram[LEVEL_BYTE] + 1 != self.level:
+    def perform_action(self, a):
+        if self.trace is not None:
+            self.trace.mark_decision()
+        for listener in self.idle_listeners:
+            listener.resume()
+        scores = self.transitions.perform_action(a)
+        for listener in self.idle_listeners:
+            listener.pause()
+        level_won = self.ram[LEVEL_BYTE] + 1 != self.level
+        if level_won:
             logging.debug('Current level: {}'.format(self.level))
             self.level = self.ram[LEVEL_BYTE] + 1
             logging.info('Level won! Progressing to level {}'.format(self.level))
             # score += self.reset_position()
-        self.update_rgb()
-        return score, friendly_score, enemy_score, enemy_penalty
+        self.update_perception()
+        if level_won:
+            self.save_level_snapshot()
+        return scores
 
     def to_state_combined_verbose(self):
         current_position = self.current_row, self.current_col
+        if self.state_encoding == 'bitboard':
+            return current_position, self.block_bits, self.enemy_bits, self.friendly_bits, self.disc_bits
         colors = list_to_tuple(self.block_colors)
         enemies = list_to_tuple(self.enemies)
         friendlies = list_to_tuple(self.friendlies)
@@ -207,35 +323,35 @@ class QbertWorld(World):
         return current_position, colors, enemies, friendlies, discs
 
     def to_state_blocks(self):
-        if self.block_state_repr is 'simple':
+        if self.block_state_repr == 'simple':
             return self.to_state_blocks_simple()
-        elif self.block_state_repr is 'adjacent':
+        elif self.block_state_repr == 'adjacent':
             return self.to_state_blocks_adjacent()
-        elif self.block_state_repr is 'adjacent_one_block_left':
+        elif self.block_state_repr == 'adjacent_one_block_left':
             return self.to_state_blocks_adjacent_one_block_left()
-        elif self.block_state_repr is 'along_direction':
+        elif self.block_state_repr == 'along_direction':
             return self.to_state_blocks_along_direction()
-        elif self.block_state_repr is 'verbose':
+        elif self.block_state_repr == 'verbose':
             return self.to_state_blocks_verbose()
 
     def to_state_enemies(self):
-        if self.enemy_state_repr is 'simple':
+        if self.enemy_state_repr == 'simple':
             return self.to_state_enemies_simple()
-        elif self.enemy_state_repr is 'adjacent':
+        elif self.enemy_state_repr == 'adjacent':
             return self.to_state_enemies_adjacent()
-        elif self.enemy_state_repr is 'adjacent_conservative':
+        elif self.enemy_state_repr == 'adjacent_conservative':
             return self.to_state_enemies_adjacent_conservative()
-        elif self.enemy_state_repr is 'adjacent_conservative_with_position':
+        elif self.enemy_state_repr == 'adjacent_conservative_with_position':
             return self.to_state_enemies_adjacent_conservative_with_position()
-        elif self.enemy_state_repr is 'adjacent_dangerous':
+        elif self.enemy_state_repr == 'adjacent_dangerous':
             return self.to_state_enemies_adjacent_dangerous()
-        elif self.enemy_state_repr is 'verbose':
+        elif self.enemy_state_repr == 'verbose':
             return self.to_state_enemies_verbose()
 
     def to_state_friendlies(self):
-        if self.friendly_state_repr is 'simple':
+        if self.friendly_state_repr == 'simple':
             return self.to_state_friendlies_simple()
-        elif self.friendly_state_repr is 'verbose':
+        elif self.friendly_state_repr == 'verbose':
             return self.to_state_friendlies_verbose()
 
     def to_state_blocks_simple(self):
@@ -246,19 +362,9 @@ class QbertWorld(World):
         0: uncolored block
         1: colored block
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-        if col != 0:
-            top_left = self.block_colors[row - 1][col - 1]
-        if col != row:
-            top_right = self.block_colors[row - 1][col]
-        if row != NUM_ROWS - 1:
-            bot_left = self.block_colors[row + 1][col]
-            bot_right = self.block_colors[row + 1][col + 1]
-        return top_left, top_right, bot_left, bot_right
+        bits = self.block_bits
+        return tuple(None if bit is None else int(bits & bit != 0)
+                     for bit in SURROUNDING_BITS[self.current_row, self.current_col])
 
     def to_state_blocks_adjacent(self):
         """
@@ -267,19 +373,9 @@ class QbertWorld(World):
         None: unattainable
         x: number of adjacent uncolored blocks, including current block (0, 1, 2, 3 or 4)
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-        if col != 0:
-            top_left = self.num_adjacent_uncolored_blocks(row - 1, col - 1)
-        if col != row:
-            top_right = self.num_adjacent_uncolored_blocks(row - 1, col)
-        if row != NUM_ROWS - 1:
-            bot_left = self.num_adjacent_uncolored_blocks(row + 1, col)
-            bot_right = self.num_adjacent_uncolored_blocks(row + 1, col + 1)
-        return top_left, top_right, bot_left, bot_right
+        uncolored = ~self.block_bits
+        return tuple(None if mask is None else popcount(mask & uncolored)
+                     for mask in SURROUNDING_NEIGHBOURHOOD_MASKS[self.current_row, self.current_col])
 
     def to_state_blocks_along_direction(self):
         """
@@ -288,31 +384,12 @@ class QbertWorld(World):
         None: unattainable
         x: number of colored blocks along each action direction (0, 1, 2, 3, 4 or 5)
         """
-        row = self.current_row
-        col = self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-        if col != 0:
-            top_left = self.num_blocks_along_direction(-1, -1)
-        if col != row:
-            top_right = self.num_blocks_along_direction(-1, 0)
-        if row != NUM_ROWS - 1:
-            bot_left = self.num_blocks_along_direction(1, 0)
-            bot_right = self.num_blocks_along_direction(1, 1)
-        return top_left, top_right, bot_left, bot_right
+        bits = self.block_bits
+        return tuple(None if mask is None else popcount(mask & bits)
+                     for mask in SURROUNDING_RAY_MASKS[self.current_row, self.current_col])
 
     def num_blocks_along_direction(self, row_diff, col_diff):
-        r = self.current_row + row_diff
-        c = self.current_col + col_diff
-        num_colored = 0
-        while 0 <= r < NUM_ROWS and 0 <= c <= r:
-            if self.block_colors[r][c] == 1:
-                num_colored += 1
-            r += row_diff
-            c += col_diff
-        return num_colored
+        return popcount(RAY_MASKS[self.current_row, self.current_col][row_diff, col_diff] & self.block_bits)
 
     def to_state_blocks_adjacent_one_block_left(self):
         """
@@ -323,18 +400,7 @@ class QbertWorld(World):
 
         final boolean: True if one uncolored block remaining
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-        if col != 0:
-            top_left = self.num_adjacent_uncolored_blocks(row - 1, col - 1)
-        if col != row:
-            top_right = self.num_adjacent_uncolored_blocks(row - 1, col)
-        if row != NUM_ROWS - 1:
-            bot_left = self.num_adjacent_uncolored_blocks(row + 1, col)
-            bot_right = self.num_adjacent_uncolored_blocks(row + 1, col + 1)
+        top_left, top_right, bot_left, bot_right = self.to_state_blocks_adjacent()
         one_block_remaining = self.is_one_block_remaining()
         return top_left, top_right, bot_left, bot_right, one_block_remaining
 
@@ -342,13 +408,7 @@ class QbertWorld(World):
         return self.num_colored_blocks == 20
 
     def num_adjacent_uncolored_blocks(self, row, col):
-        num_adjacent = 0
-        for diff_row, diff_col in ACTION_NUM_DIFFS_WITH_NOOP.values():
-            r = row + diff_row
-            c = col + diff_col
-            if 0 <= r < NUM_ROWS and 0 <= c <= r and self.block_colors[r][c] == 0:
-                num_adjacent += 1
-        return num_adjacent
+        return popcount(NEIGHBOURHOOD_MASKS[row, col] & ~self.block_bits)
 
     def to_state_blocks_adjacent_old(self):
         """
@@ -359,22 +419,11 @@ class QbertWorld(World):
         1: colored block
         2: adjacent uncolored block
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-        if col != 0:
-            top_left = self.adjacent_block_value(row - 1, col - 1)
-        if col != row:
-            top_right = self.adjacent_block_value(row - 1, col)
-        if row != NUM_ROWS - 1:
-            bot_left = self.adjacent_block_value(row + 1, col)
-            bot_right = self.adjacent_block_value(row + 1, col + 1)
-        return top_left, top_right, bot_left, bot_right
+        return tuple(None if cell is None else self.adjacent_block_value(*cell)
+                     for cell in SURROUNDING_CELLS[self.current_row, self.current_col])
 
     def adjacent_block_value(self, row, col):
-        if self.block_colors[row][col] == 0:
+        if not self.block_bits & CELL_BITS[row, col]:
             return 0
         else:
             if self.is_adjacent_uncolored_block(row, col):
@@ -383,16 +432,13 @@ class QbertWorld(World):
                 return 1
 
     def is_adjacent_uncolored_block(self, row, col):
-        for diff_row, diff_col in ACTION_NUM_DIFFS.values():
-            r = row + diff_row
-            c = col + diff_col
-            if 0 <= r < NUM_ROWS and 0 <= c <= r and self.block_colors[r][c] == 0:
-                return True
-        return False
+        return ADJACENT_MASKS[row, col] & ~self.block_bits != 0
 
     def to_state_blocks_verbose(self):
         current_position = self.current_row, self.current_col
         logging.debug('Current position: {}'.format(current_position))
+        if self.state_encoding == 'bitboard':
+            return current_position, self.block_bits
         colors = list_to_tuple(self.block_colors)
         return current_position, colors
 
@@ -404,32 +450,14 @@ class QbertWorld(World):
         0: block/disc
         1: enemy
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-
-        if col != 0 and self.enemies[row - 1][col - 1] == 0 or col == 0 and self.discs[row][0] == 1:
-            top_left = 0
-        elif col != 0 and self.enemies[row - 1][col - 1] == 1:
-            top_left = 1
-
-        if col != row and self.enemies[row - 1][col] == 0 or col == row and self.discs[row][1] == 1:
-            top_right = 0
-        elif col != row and self.enemies[row - 1][col] == 1:
-            top_right = 1
-
-        if row != NUM_ROWS - 1:
-            if self.enemies[row + 1][col] == 0:
-                bot_left = 0
+        enemies, discs = self.enemy_bits, self.disc_bits
+        state = []
+        for bit, _, disc in SURROUNDING_ENEMY_CHECKS[self.current_row, self.current_col]:
+            if bit is not None:
+                state.append(1 if enemies & bit else 0)
             else:
-                bot_left = 1
-            if self.enemies[row + 1][col + 1] == 0:
-                bot_right = 0
-            else:
-                bot_right = 1
-        return top_left, top_right, bot_left, bot_right
+                state.append(0 if disc is not None and discs & disc else None)
+        return tuple(state)
 
     def to_state_enemies_adjacent_dangerous(self):
         """
@@ -441,45 +469,17 @@ class QbertWorld(World):
         2: enemy adjacent
         3: enemy
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-
-        if col != 0 and self.enemies[row - 1][col - 1] == 1:
-            top_left = 3
-        elif self.is_enemy_adjacent(row - 1, col - 1):
-            top_left = 2
-        elif col != 0 and self.enemies[row - 1][col - 1] == 0:
-            top_left = 0
-        elif col == 0 and self.discs[row][0] == 1:
-            top_left = 1
-
-        if col != row and self.enemies[row - 1][col - 1] == 1:
-            top_right = 3
-        elif self.is_enemy_adjacent(row - 1, col):
-            top_right = 2
-        elif col != row and self.enemies[row - 1][col] == 0:
-            top_right = 0
-        elif col == row and self.discs[row][1] == 1:
-            top_right = 1
-
-        if row != NUM_ROWS - 1:
-            if self.enemies[row + 1][col] == 1:
-                bot_left = 3
-            elif self.is_enemy_adjacent(row + 1, col):
-                bot_left = 2
-            elif self.enemies[row + 1][col] == 0:
-                bot_left = 0
-
-            if self.enemies[row + 1][col + 1] == 1:
-                bot_right = 3
-            elif self.is_enemy_adjacent(row + 1, col + 1):
-                bot_right = 2
-            elif self.enemies[row + 1][col + 1] == 0:
-                bot_right = 0
-        return top_left, top_right, bot_left, bot_right
+        enemies, discs = self.enemy_bits, self.disc_bits
+        cell = self.current_row, self.current_col
+        state = []
+        for danger_bit, (bit, mask, disc) in zip(DANGER_BITS[cell], SURROUNDING_ENEMY_CHECKS[cell]):
+            if danger_bit is not None and enemies & danger_bit:
+                state.append(3)
+            elif bit is not None and not enemies & bit:
+                state.append(2 if enemies & mask else 0)
+            else:
+                state.append(1 if disc is not None and discs & disc else None)
+        return tuple(state)
 
     def to_state_enemies_adjacent(self):
         """
@@ -490,37 +490,7 @@ class QbertWorld(World):
         1: disc
         2: enemy adjacent
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-
-        if self.is_enemy_adjacent(row - 1, col - 1):
-            top_left = 2
-        elif col != 0 and self.enemies[row - 1][col - 1] == 0:
-            top_left = 0
-        elif col == 0 and self.discs[row][0] == 1:
-            top_left = 1
-
-        if self.is_enemy_adjacent(row - 1, col):
-            top_right = 2
-        elif col != row and self.enemies[row - 1][col] == 0:
-            top_right = 0
-        elif col == row and self.discs[row][1] == 1:
-            top_right = 1
-
-        if row != NUM_ROWS - 1:
-            if self.is_enemy_adjacent(row + 1, col):
-                bot_left = 2
-            elif self.enemies[row + 1][col] == 0:
-                bot_left = 0
-
-            if self.is_enemy_adjacent(row + 1, col + 1):
-                bot_right = 2
-            elif self.enemies[row + 1][col + 1] == 0:
-                bot_right = 0
-        return top_left, top_right, bot_left, bot_right
+        return self.encode_surrounding_enemies(2)
 
     def to_state_enemies_adjacent_conservative(self):
         """
@@ -530,37 +500,7 @@ class QbertWorld(World):
         0: block
         1: disc
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-
-        if self.is_enemy_adjacent(row - 1, col - 1):
-            top_left = None
-        elif col != 0 and self.enemies[row - 1][col - 1] == 0:
-            top_left = 0
-        elif col == 0 and self.discs[row][0] == 1:
-            top_left = 1
-
-        if self.is_enemy_adjacent(row - 1, col):
-            top_right = None
-        elif col != row and self.enemies[row - 1][col] == 0:
-            top_right = 0
-        elif col == row and self.discs[row][1] == 1:
-            top_right = 1
-
-        if row != NUM_ROWS - 1:
-            if self.is_enemy_adjacent(row + 1, col):
-                bot_left = None
-            elif self.enemies[row + 1][col] == 0:
-                bot_left = 0
-
-            if self.is_enemy_adjacent(row + 1, col + 1):
-                bot_right = None
-            elif self.enemies[row + 1][col + 1] == 0:
-                bot_right = 0
-        return top_left, top_right, bot_left, bot_right
+        return self.encode_surrounding_enemies(None)
 
     def to_state_enemies_adjacent_conservative_with_position(self):
         """
@@ -576,69 +516,51 @@ class QbertWorld(World):
         row and col:
             Represent Qbert's position on the board
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-
-        if self.is_enemy_adjacent(row - 1, col - 1):
-            top_left = None
-        elif col != 0 and self.enemies[row - 1][col - 1] == 0:
-            top_left = 0
-        elif col == 0 and self.discs[row][0] == 1:
-            top_left = 1
-
-        if self.is_enemy_adjacent(row - 1, col):
-            top_right = None
-        elif col != row and self.enemies[row - 1][col] == 0:
-            top_right = 0
-        elif col == row and self.discs[row][1] == 1:
-            top_right = 1
-
-        if row != NUM_ROWS - 1:
-            if self.is_enemy_adjacent(row + 1, col):
-                bot_left = None
-            elif self.enemies[row + 1][col] == 0:
-                bot_left = 0
-
-            if self.is_enemy_adjacent(row + 1, col + 1):
-                bot_right = None
-            elif self.enemies[row + 1][col + 1] == 0:
-                bot_right = 0
-        return top_left, top_right, bot_left, bot_right, self.current_row, self.current_col
+        return self.encode_surrounding_enemies(None) + (self.current_row, self.current_col)
+
+    def encode_surrounding_enemies(self, adjacent_value):
+        """
+        Encodes the blocks around Qbert as None when unattainable or holding an enemy, adjacent_value when an enemy is
+        adjacent to them, 0 otherwise, and as 1 for discs at the edge of the pyramid.
+        """
+        enemies, discs = self.enemy_bits, self.disc_bits
+        state = []
+        for bit, mask, disc in SURROUNDING_ENEMY_CHECKS[self.current_row, self.current_col]:
+            if bit is not None:
+                if enemies & bit:
+                    state.append(None)
+                else:
+                    state.append(adjacent_value if enemies & mask else 0)
+            else:
+                state.append(1 if disc is not None and discs & disc else None)
+        return tuple(state)
 
     def is_enemy_adjacent(self, row, col):
-        if 0 <= row < NUM_ROWS and 0 <= col <= row and self.enemies[row][col] != 1:
-            for diff_row, diff_col in ACTION_NUM_DIFFS.values():
-                r = row + diff_row
-                c = col + diff_col
-                if 0 <= r < NUM_ROWS and 0 <= c <= r and self.enemies[r][c] == 1:
-                    return True
-        return False
+        mask = ADJACENT_MASKS.get((row, col))
+        return mask is not None and not self.enemy_bits & CELL_BITS[row, col] and self.enemy_bits & mask != 0
 
     def is_friendly_adjacent(self, row, col):
-        if 0 <= row < NUM_ROWS and 0 <= col <= row and self.friendlies[row][col] != 1:
-            for diff_row, diff_col in ACTION_NUM_DIFFS.values():
-                r = row + diff_row
-                c = col + diff_col
-                if 0 <= r < NUM_ROWS and 0 <= c <= r and self.friendlies[r][c] == 1:
-                    return True
-        return False
+        mask = ADJACENT_MASKS.get((row, col))
+        return mask is not None and not self.friendly_bits & CELL_BITS[row, col] and self.friendly_bits & mask != 0
 
     def is_enemy_nearby(self):
-        r, c = self.current_row, self.current_col
-        return self.is_enemy_adjacent(r, c) or self.is_enemy_adjacent(r - 1, c - 1) or self.is_enemy_adjacent(r-1, c) \
-               or self.is_enemy_adjacent(r + 1, c) or self.is_enemy_adjacent(r + 1, c + 1)
+        bits = self.enemy_bits
+        for bit, mask in NEARBY[self.current_row, self.current_col]:
+            if not bits & bit and bits & mask:
+                return True
+        return False
 
     def is_friendly_nearby(self):
-        r, c = self.current_row, self.current_col
-        return self.is_friendly_adjacent(r, c) or self.is_friendly_adjacent(r - 1, c - 1) \
-               or self.is_friendly_adjacent(r-1, c) or self.is_friendly_adjacent(r + 1, c) \
-               or self.is_friendly_adjacent(r + 1, c + 1)
+        bits = self.friendly_bits
+        for bit, mask in NEARBY[self.current_row, self.current_col]:
+            if not bits & bit and bits & mask:
+                return True
+        return False
 
     def to_state_enemies_verbose(self):
         current_position = self.current_row, self.current_col
+        if self.state_encoding == 'bitboard':
+            return current_position, self.enemy_bits
         enemies = list_to_tuple(self.enemies)
         return current_position, enemies
 
@@ -650,22 +572,14 @@ class QbertWorld(World):
         0: no green
         1: green
         """
-        row, col = self.current_row, self.current_col
-        top_left = None
-        top_right = None
-        bot_left = None
-        bot_right = None
-        if col != 0:
-            top_left = self.friendlies[row - 1][col - 1]
-        if col != row:
-            top_right = self.friendlies[row - 1][col]
-        if row != NUM_ROWS - 1:
-            bot_left = self.friendlies[row + 1][col]
-            bot_right = self.friendlies[row + 1][col + 1]
-        return top_left, top_right, bot_left, bot_right
+        bits = self.friendly_bits
+        return tuple(None if bit is None else int(bits & bit != 0)
+                     for bit in SURROUNDING_BITS[self.current_row, self.current_col])
 
     def to_state_friendlies_verbose(self):
         current_position = self.current_row, self.current_col
+        if self.state_encoding == 'bitboard':
+            return current_position, self.friendly_bits
         friendlies = list_to_tuple(self.friendlies)
         return current_position, friendlies
 
@@ -673,64 +587,95 @@ class QbertWorld(World):
         diff_row, diff_col = get_action_diffs(action)
         return self.current_row + diff_row, self.current_col + diff_col
 
+    def update_perception(self):
+        """
+        Updates the blocks, agents and discs from the current frame, using the selected perception backend.
+        """
+        if self.ram_perception is not None:
+            self.ram_perception.update()
+        else:
+            self.update_rgb()
+
     def update_rgb(self):
         self.ale.getScreenRGB(self.rgb_screen)
+        self.parse_probe_codes(self.rgb_probe_codes())
+
+    def rgb_probe_codes(self):
+        """
+        Gathers every probed pixel of the RGB screen at once and packs it into a 24-bit color code.
+        """
+        pixels = self.rgb_screen[PROBE_YS, PROBE_XS].astype(np.int32)
+        return (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+    def parse_probe_codes(self, codes, parse_blocks=True):
+        """
+        Parses the packed color codes of the probed pixels (see build_probe_coordinates).
+
+        :param codes: the packed color codes of the probed pixels
+        :param parse_blocks: whether to also parse the block colors and Qbert's position
+        """
+        not_flashing = codes[FLASH_CHECK_PROBE] == CODE_BLACK
 
         # Score
-        score_color = self.rgb_screen[SCORE_Y][SCORE_X]
-        if self.screen_not_flashing() \
-                and not np.array_equal(score_color, COLOR_BLACK) \
-                and not np.array_equal(score_color, self.desired_color):
+        score_code = codes[SCORE_PROBE]
+        if not_flashing and score_code != CODE_BLACK and score_code != self.desired_color_code:
+            score_color = unpack_color(score_code)
             logging.debug('Identified {} as new desired color'.format(score_color))
             self.desired_color = score_color
-
-        self.enemy_present = False
-        self.friendly_present = False
-        self.num_colored_blocks = 0
-        for row in range(NUM_ROWS):
-            for col in range(row + 1):
-                rgb_y, rgb_x = BLOCK_COORDINATES[row][col]
-
-                # Color of block
-                if np.array_equal(self.rgb_screen[rgb_y][rgb_x], self.desired_color):
-                    self.num_colored_blocks += 1
-                    self.block_colors[row][col] = 1
-                else:
-                    self.block_colors[row][col] = 0
-
-                self.enemies[row][col] = 0
-                self.friendlies[row][col] = 0
-                # Agents
-                for y_offset in range(AGENT_BLOCK_OFFSET_RANGE):
-                    agent_offset = AGENT_BLOCK_OFFSET - y_offset
-                    # Enemy (purple)
-                    if np.array_equal(self.rgb_screen[rgb_y + agent_offset][rgb_x], COLOR_PURPLE):
-                        self.enemies[row][col] = 1
-                        self.enemy_present = True
-
-                    # Friendly (green)
-                    if np.array_equal(self.rgb_screen[rgb_y + agent_offset][rgb_x], COLOR_GREEN):
-                        self.friendlies[row][col] = 1
-                        self.friendly_present = True
-
-                    # Qbert (orange)
-                    if np.array_equal(self.rgb_screen[rgb_y + agent_offset][rgb_x], COLOR_QBERT):
-                        self.current_row, self.current_col = row, col
-
-                # Discs (relative to edge blocks)
-                if self.screen_not_flashing():
-                    if col == 0:
-                        if np.array_equal(self.rgb_screen[rgb_y - DISC_OFFSET_Y][rgb_x - DISC_OFFSET_X], COLOR_BLACK):
-                            self.discs[row][0] = 0
-                        else:
-                            self.discs[row][0] = 1
-                    if col == row:
-                        if np.array_equal(self.rgb_screen[rgb_y - DISC_OFFSET_Y][rgb_x + DISC_OFFSET_X], COLOR_BLACK):
-                            self.discs[row][1] = 0
-                        else:
-                            self.discs[row][1] = 1
+            self.desired_color_code = score_code
+
+        # Blocks
+        if parse_blocks:
+            self.parse_block_codes(codes)
+
+        # Agents
+        agent_codes = codes[AGENT_PROBES_START:LEFT_DISC_PROBES_START].reshape(NUM_BLOCKS, AGENT_BLOCK_OFFSET_RANGE)
+        enemies = (agent_codes == CODE_PURPLE).any(axis=1)
+        friendlies = (agent_codes == CODE_GREEN).any(axis=1)
+        self.enemy_present = bool(enemies.any())
+        self.friendly_present = bool(friendlies.any())
+        self.enemy_bits = int(np.dot(enemies, BLOCK_BIT_VALUES))
+        self.friendly_bits = int(np.dot(friendlies, BLOCK_BIT_VALUES))
+
+        enemies = enemies.astype(int).tolist()
+        friendlies = friendlies.astype(int).tolist()
+        for row, (start, end) in enumerate(ROW_BOUNDS):
+            self.enemies[row][:] = enemies[start:end]
+            self.friendlies[row][:] = friendlies[start:end]
+
+        # Discs (relative to edge blocks)
+        if not_flashing:
+            left_discs = codes[LEFT_DISC_PROBES_START:RIGHT_DISC_PROBES_START] != CODE_BLACK
+            right_discs = codes[RIGHT_DISC_PROBES_START:SCORE_PROBE] != CODE_BLACK
+            for row in range(NUM_ROWS):
+                self.discs[row][0] = int(left_discs[row])
+                self.discs[row][1] = int(right_discs[row])
+            self.disc_bits = int(np.dot(left_discs, LEFT_DISC_BIT_VALUES) + np.dot(right_discs, RIGHT_DISC_BIT_VALUES))
         logging.debug('Discs: {}'.format(self.discs))
 
+    def parse_block_codes(self, codes):
+        """
+        Parses the block colors and Qbert's position from the packed color codes of the probed pixels.
+
+        :return: True if Qbert was found on the pyramid
+        """
+        self.set_block_colors(codes[:NUM_BLOCKS] == self.desired_color_code)
+        qbert_cell = find_qbert_cell(codes)
+        if qbert_cell is not None:
+            self.current_row, self.current_col = qbert_cell
+            return True
+        return False
+
+    def set_block_colors(self, colored):
+        """
+        Sets the block colors from a boolean array of the blocks in row-major order (True for the desired color).
+        """
+        self.num_colored_blocks = int(np.count_nonzero(colored))
+        self.block_bits = int(np.dot(colored, BLOCK_BIT_VALUES))
+        colored = colored.astype(int).tolist()
+        for row, (start, end) in enumerate(ROW_BOUNDS):
+            self.block_colors[row][:] = colored[start:end]
+
     def screen_not_flashing(self):
         """
         Indicates the screen is flashing after a powerup.
@@ -738,21 +683,67 @@ class QbertWorld(World):
         return np.array_equal(self.rgb_screen[FLASH_CHECK_Y][FLASH_CHECK_X], COLOR_BLACK)
 
     def reset_position(self):
-        reward = 0
-        while not (self.ram[0] == 0 and self.ram[self.ram_size - 1] & 1):  # last bit = 1 and first byte = 0
-            reward += self.ale.act(NO_OP)
-            self.ale.getRAM(self.ram)
-        self.update_rgb()
+        reward = self.transitions.wait()
+        self.update_perception()
         return reward
 
-    def reset(self):
+    def reset(self, start_level=1):
+        """
+        Wait for the start of the game, or with the 'snapshot' reset mode, restore the snapshot of the start of the
+        given level (or of the highest level below it) if one was taken.
+        """
+        if self.reset_mode == 'snapshot':
+            for level in range(start_level, 0, -1):
+                if get_level_snapshot_name(level) in self.snapshots:
+                    if level != start_level:
+                        logging.debug('No snapshot of level {}, starting at level {}'.format(start_level, level))
+                    self.restore_snapshot(get_level_snapshot_name(level))
+                    return 0
         self.ale.getRAM(self.ram)
         self.level = self.ram[LEVEL_BYTE] + 1
-        return self.reset_position()
+        reward = self.reset_position()
+        self.save_level_snapshot()
+        return reward
+
+    def reset_game(self):
+        """
+        Reset the game after an episode, unless the next call to reset restores a snapshot.
+        """
+        if self.reset_mode != 'snapshot' or not self.snapshots:
+            self.ale.reset_game()
+
+    def save_level_snapshot(self):
+        """
+        With the 'snapshot' reset mode, save a snapshot of the start of the current level if there is none.
+        """
+        name = get_level_snapshot_name(self.level)
+        if self.reset_mode == 'snapshot' and name not in self.snapshots:
+            self.save_snapshot(name)
+
+    def save_snapshot(self, name):
+        """
+        Save the emulator state and the perceived world under the given name.
+        """
+        fields = {field: copy.deepcopy(getattr(self, field)) for field in SNAPSHOT_FIELDS}
+        self.snapshots[name] = self.ale.cloneState(), fields
+        logging.debug('Saved snapshot {}'.format(name))
+
+    def restore_snapshot(self, name):
+        """
+        Restore the emulator state and the perceived world saved under the given name.
+        """
+        state, fields = self.snapshots[name]
+        self.ale.restoreState(state)
+        self.ale.getRAM(self.ram)
+        for field, value in fields.items():
+            setattr(self, field, copy.deepcopy(value))
 
     def get_next_state_verbose(self, a):
         diff_row, diff_col = get_action_number_diffs(a)
         new_position = self.current_row + diff_row, self.current_col + diff_col
+        if self.state_encoding == 'bitboard':
+            new_colors = self.block_bits | CELL_BITS[new_position]
+            return new_position, new_colors, self.enemy_bits, self.friendly_bits, self.disc_bits
         new_colors = list_to_tuple_with_value(self.block_colors, new_position[0], new_position[1], 1)
         enemies = list_to_tuple(self.enemies)
         friendlies = list_to_tuple(self.friendlies)
@@ -760,19 +751,29 @@ class QbertWorld(World):
         return new_position, new_colors, enemies, friendlies, discs
 
     def get_close_states_actions(self, initial_action, distance_metric='simple'):
-        states = []
-        actions = []
-        if distance_metric is 'manhattan':
-            for a in get_valid_action_numbers(self.current_row, self.current_col):
-                states.append(self.get_next_state_verbose(a))
-                actions.append(initial_action)
-        elif distance_metric is 'hamming':
-            for a in get_valid_action_numbers(self.current_row, self.current_col):
-                states.append(self.get_next_state_verbose(a))
-                actions.append(get_inverse_action(a))
-        elif distance_metric is 'same_result':
-            for a in get_valid_action_numbers(self.current_row, self.current_col):
-                s = self.get_next_state_verbose(a)
-                states.append(s)
-                actions.append(get_inverse_action(a))
+        """
+        Get the verbose states resulting from every move from the current block (as in get_next_state_verbose), with
+        the action to generalize the backup of the initial action to in each of them.
+
+        The enemies, friendlies and discs are encoded once for all the states, and the block colors of each state only
+        differ from the current ones by the bit of the resulting block (or by one row of the tuple encoding).
+        """
+        if distance_metric not in CLOSE_DISTANCE_METRICS:
+            return [], []
+        moves = CLOSE_MOVES[self.current_row, self.current_col]
+        if self.state_encoding == 'bitboard':
+            block_bits, enemy_bits, friendly_bits, disc_bits = \
+                self.block_bits, self.enemy_bits, self.friendly_bits, self.disc_bits
+            states = [(cell, block_bits | bit, enemy_bits, friendly_bits, disc_bits) for cell, bit, _ in moves]
+        else:
+            colors = list_to_tuple(self.block_colors)
+            enemies = list_to_tuple(self.enemies)
+            friendlies = list_to_tuple(self.friendlies)
+            discs = list_to_tuple(self.discs)
+            states = [(cell, tuple_with_value(colors, cell[0], cell[1], 1), enemies, friendlies, discs)
+                      for cell, _, _ in moves]
+        if distance_metric == 'manhattan':
+            actions = [initial_action] * len(moves)
+        else:
+            actions = [inverse_action for _, _, inverse_action in moves]
         return states, actions